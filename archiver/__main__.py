@@ -6,8 +6,8 @@ import csv
 import os
 import sys
 
-from . import version, batch
-from .deposit import deposit, batch_deposit
+from . import version, batch, cache, download, inventory, packing, progress, restore, verify
+from .deposit import deposit, batch_deposit, prune_cache
 from .exceptions import FailureException
 
 
@@ -27,6 +27,65 @@ def print_header():
     )
 
 
+def add_dry_run_arguments(subparser):
+    """Add the options for dry runs, which are made against a FakeS3."""
+    subparser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Perform a "dry run" against a local stand-in for S3, without actually contacting AWS.',
+    )
+    subparser.add_argument(
+        '--dry-run-dir',
+        action='store',
+        help='Directory in which to store the objects of dry runs, for later dry runs (default: none are stored)',
+        default=None
+    )
+    subparser.add_argument(
+        '--dry-run-latency',
+        action='store',
+        help='Seconds added to each request of a dry run',
+        type=float,
+        default=None
+    )
+    subparser.add_argument(
+        '--dry-run-bandwidth',
+        action='store',
+        help='Maximum rate at which the dry run stand-in for S3 transfers data (e.g. "50MB", per second)',
+        default=None
+    )
+    subparser.add_argument(
+        '--dry-run-error-rate',
+        action='store',
+        help='Fraction of the requests of a dry run that fail with errors that are retried, such as 503 SlowDown',
+        type=float,
+        default=None
+    )
+
+
+def add_retrieval_arguments(subparser):
+    """Add the options for selecting the assets to restore or retrieve."""
+    subparser.add_argument(
+        '-r', '--results',
+        action='store',
+        nargs='+',
+        help='Results files (results.csv) of the deposits of the assets',
+        required=True
+    )
+    subparser.add_argument(
+        '-i', '--include',
+        action='append',
+        help='Only include the assets whose KEYPATH matches this pattern (such as "Archive092/*.tif"); '
+             'may be given more than once',
+        default=None
+    )
+    subparser.add_argument(
+        '-p', '--profile',
+        action='store',
+        help='AWS authorization profile',
+        default='default'
+    )
+
+
 def main():
     """Parse args and set the chosen sub-command as the default function."""
 
@@ -62,9 +121,16 @@ def main():
     deposit_parser.add_argument(
         '-c', '--chunk',
         action='store',
-        help='Chunk size for multipart uploads',
+        help='Chunk size for multipart uploads (in MB or GB), or "auto" to choose it for each asset',
         default=batch.DEFAULT_CHUNK_SIZE
     )
+    deposit_parser.add_argument(
+        '--target-parts',
+        action='store',
+        help='Number of parts to aim for when the chunk size is "auto"',
+        type=int,
+        default=batch.DEFAULT_TARGET_PARTS
+    )
     deposit_parser.add_argument(
         '-l', '--logs',
         action='store',
@@ -102,6 +168,13 @@ def main():
         type=int,
         default=batch.DEFAULT_MAX_THREADS
     )
+    deposit_parser.add_argument(
+        '--max-assets',
+        action='store',
+        help='Maximum number of assets to upload concurrently',
+        type=int,
+        default=batch.DEFAULT_MAX_ASSETS
+    )
 
     # argument parser for specifying the asset or list of assets to deposit
     files_group = deposit_parser.add_mutually_exclusive_group(required=True)
@@ -116,10 +189,119 @@ def main():
         help='Archive a single asset'
     )
     deposit_parser.add_argument(
-        '--dry-run',
+        '--hash-workers',
+        action='store',
+        help='Number of threads used to hash the assets before uploading them (0 to hash each asset as it is uploaded)',
+        type=int,
+        default=batch.DEFAULT_HASH_WORKERS
+    )
+    deposit_parser.add_argument(
+        '--hash-cache',
+        action='store',
+        nargs='?',
+        const=cache.DEFAULT_HASH_CACHE,
+        help=f'Reuse the MD5 and ETag of unchanged files from a hash cache file (default: {cache.DEFAULT_HASH_CACHE})',
+        default=None
+    )
+    deposit_parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Start uploading while the manifest is being read, instead of loading it first',
+    )
+    deposit_parser.add_argument(
+        '--preflight',
+        action='store_true',
+        help='Skip assets that are already in the bucket with the expected ETag',
+    )
+    deposit_parser.add_argument(
+        '--pack-threshold',
+        action='store',
+        help='Pack the assets smaller than this size (in MB or GB) into tar containers, instead of uploading '
+             'them one by one',
+        default=None
+    )
+    deposit_parser.add_argument(
+        '--pack-size',
+        action='store',
+        help=f'Target size of the containers of packed assets (default: {packing.DEFAULT_PACK_SIZE})',
+        default=None
+    )
+    deposit_parser.add_argument(
+        '--checksum-sha256',
+        action='store_true',
+        help='Send a SHA256 checksum with each upload request, for S3 to validate the data it receives',
+    )
+    deposit_parser.add_argument(
+        '--hash-on-upload',
+        action='store_true',
+        help='Calculate the MD5 and ETag from the bytes being uploaded, instead of reading the files beforehand',
+    )
+    deposit_parser.add_argument(
+        '--verify',
+        action='store',
+        choices=verify.VERIFY_POLICIES,
+        help='How to get the remote ETag of an uploaded asset: from the upload response, from the response with a '
+             'HEAD request for a sample of the assets, or from a HEAD request for every asset',
+        default=verify.DEFAULT_VERIFY_POLICY
+    )
+    deposit_parser.add_argument(
+        '--verify-sample-rate',
+        action='store',
+        help='Fraction of the assets verified with a HEAD request by the "sample" verify policy',
+        type=float,
+        default=verify.DEFAULT_VERIFY_SAMPLE_RATE
+    )
+    deposit_parser.add_argument(
+        '--verify-threads',
+        action='store',
+        help='Number of threads used to verify uploaded assets',
+        type=int,
+        default=verify.DEFAULT_VERIFY_THREADS
+    )
+    deposit_parser.add_argument(
+        '--max-bandwidth',
+        action='store',
+        help='Maximum upload rate, in KB, MB or GB per second (default: unlimited)',
+        default=None
+    )
+    deposit_parser.add_argument(
+        '--bandwidth-schedule',
+        action='store',
+        help='Maximum upload rates for periods of the day, as comma-separated HH:MM-HH:MM=RATE entries',
+        default=None
+    )
+    deposit_parser.add_argument(
+        '--bandwidth-control-file',
+        action='store',
+        help='File containing a maximum upload rate that overrides the others while it exists; '
+             'it is checked every few seconds, and on SIGHUP',
+        default=None
+    )
+    deposit_parser.add_argument(
+        '--progress',
+        action='store',
+        choices=progress.PROGRESS_MODES,
+        help='How to report progress: a status line, nothing, or JSON lines on stderr',
+        default=progress.DEFAULT_PROGRESS_MODE
+    )
+    deposit_parser.add_argument(
+        '--metrics-file',
+        action='store',
+        help='Prometheus textfile to write the deposit metrics to, while it runs',
+        default=None
+    )
+    deposit_parser.add_argument(
+        '--no-tcp-keepalive',
+        action='store_false',
+        dest='tcp_keepalive',
+        help='Do not send TCP keep-alive packets on idle connections to S3',
+    )
+    deposit_parser.add_argument(
+        '--trace-requests',
         action='store_true',
-        help='Perform a "dry run" without actually contacting AWS.',
+        help='Record the S3 requests made, and write a summary of them to requests.json in the log directory',
     )
+    add_dry_run_arguments(deposit_parser)
 
     deposit_parser.set_defaults(func=deposit)
 
@@ -139,9 +321,191 @@ def main():
         help='AWS authorization profile',
         default='default'
     )
+    batch_deposit_parser.add_argument(
+        '--progress',
+        action='store',
+        choices=progress.PROGRESS_MODES,
+        help='How to report progress: a status line, nothing, or JSON lines on stderr',
+        default=progress.DEFAULT_PROGRESS_MODE
+    )
+    add_dry_run_arguments(batch_deposit_parser)
 
     batch_deposit_parser.set_defaults(func=batch_deposit)
 
+    inventory_parser = subparsers.add_parser(
+        'inventory',
+        help='Write a manifest of the files in a directory tree.',
+        description='Write a manifest of the files in a directory tree, for use with the deposit subcommand'
+    )
+    inventory_parser.add_argument(
+        '-r', '--root',
+        action='store',
+        help='Root dir of the files to list',
+        required=True
+    )
+    inventory_parser.add_argument(
+        '-o', '--output',
+        action='store',
+        help='Manifest file to write',
+        required=True
+    )
+    inventory_parser.add_argument(
+        '-f', '--format',
+        action='store',
+        help='Manifest format (default: md5sum)',
+        choices=inventory.FORMATS,
+        default=inventory.MD5_SUM_FORMAT
+    )
+    inventory_parser.add_argument(
+        '-b', '--batch',
+        action='store',
+        help='Batch name for the inventory format (default: the name of the root dir)',
+        default=None
+    )
+    inventory_parser.add_argument(
+        '-e', '--etag-chunk',
+        action='store',
+        help='Include an ETAG column for this chunk size in the inventory format',
+        default=None
+    )
+    inventory_parser.add_argument(
+        '-w', '--workers',
+        action='store',
+        help='Number of threads used to scan directories and hash files',
+        type=int,
+        default=inventory.DEFAULT_INVENTORY_WORKERS
+    )
+    inventory_parser.add_argument(
+        '--parallel-digests',
+        action='store_true',
+        help='Calculate the MD5, SHA1 and SHA256 of each file on separate threads, in the inventory format'
+    )
+
+    inventory_parser.set_defaults(func=inventory.inventory)
+
+    restore_parser = subparsers.add_parser(
+        'restore',
+        help='Request the restore of deposited assets from Glacier.',
+        description='Request the restore of the assets listed in results files, or check the status of restores'
+    )
+    add_retrieval_arguments(restore_parser)
+    restore_parser.add_argument(
+        '-d', '--days',
+        action='store',
+        help=f'Number of days to keep the restored copies (default: {restore.DEFAULT_RESTORE_DAYS})',
+        type=int,
+        default=restore.DEFAULT_RESTORE_DAYS
+    )
+    restore_parser.add_argument(
+        '--tier',
+        action='store',
+        choices=restore.RESTORE_TIERS,
+        help=f'Retrieval tier (default: {restore.DEFAULT_RESTORE_TIER})',
+        default=restore.DEFAULT_RESTORE_TIER
+    )
+    restore_parser.add_argument(
+        '--rate',
+        action='store',
+        help=f'Maximum number of restore requests per second (default: {restore.DEFAULT_REQUEST_RATE})',
+        type=float,
+        default=restore.DEFAULT_REQUEST_RATE
+    )
+    restore_parser.add_argument(
+        '-t', '--threads',
+        action='store',
+        help='Number of threads making requests',
+        type=int,
+        default=restore.DEFAULT_RESTORE_THREADS
+    )
+    restore_parser.add_argument(
+        '--status',
+        action='store_true',
+        help='Only check the restore status of the assets, without requesting restores',
+    )
+    restore_parser.add_argument(
+        '--wait',
+        action='store_true',
+        help='Wait until the restores have completed',
+    )
+    restore_parser.add_argument(
+        '--poll-interval',
+        action='store',
+        help=f'Seconds between checks of the restore status while waiting '
+             f'(default: {restore.DEFAULT_POLL_INTERVAL})',
+        type=float,
+        default=restore.DEFAULT_POLL_INTERVAL
+    )
+    add_dry_run_arguments(restore_parser)
+
+    restore_parser.set_defaults(func=restore.restore)
+
+    retrieve_parser = subparsers.add_parser(
+        'retrieve',
+        help='Download deposited assets that have been restored.',
+        description='Download the assets listed in results files, once they have been restored'
+    )
+    add_retrieval_arguments(retrieve_parser)
+    retrieve_parser.add_argument(
+        '-o', '--output',
+        action='store',
+        help='Directory to download the assets into, at their KEYPATH',
+        required=True
+    )
+    retrieve_parser.add_argument(
+        '-t', '--threads',
+        action='store',
+        help=f'Number of assets downloaded at the same time (default: {restore.DEFAULT_RETRIEVE_THREADS})',
+        type=int,
+        default=restore.DEFAULT_RETRIEVE_THREADS
+    )
+    retrieve_parser.add_argument(
+        '--part-threads',
+        action='store',
+        help=f'Number of threads downloading the ranges of large assets, shared by all the assets '
+             f'(default: {download.DEFAULT_PART_THREADS})',
+        type=int,
+        default=download.DEFAULT_PART_THREADS
+    )
+    retrieve_parser.add_argument(
+        '--block-size',
+        action='store',
+        help='Largest range (in MB or GB) downloaded with a single request',
+        default=f'{download.DEFAULT_BLOCK_SIZE // (1024 ** 2)}MB'
+    )
+    retrieve_parser.add_argument(
+        '--overwrite',
+        action='store_true',
+        help='Download assets that are already in the output directory again',
+    )
+    add_dry_run_arguments(retrieve_parser)
+
+    retrieve_parser.set_defaults(func=restore.retrieve)
+
+    prune_cache_parser = subparsers.add_parser(
+        'prune-cache',
+        help='Remove old entries from a hash cache file.',
+    )
+    prune_cache_parser.add_argument(
+        '-f', '--cache-file',
+        action='store',
+        help=f'Hash cache file (default: {cache.DEFAULT_HASH_CACHE})',
+        default=cache.DEFAULT_HASH_CACHE
+    )
+    prune_cache_parser.add_argument(
+        '-d', '--days',
+        action='store',
+        help='Remove entries that have not been used for this many days',
+        type=float,
+        default=None
+    )
+    prune_cache_parser.add_argument(
+        '--missing',
+        action='store_true',
+        help='Remove entries for files that no longer exist',
+    )
+
+    prune_cache_parser.set_defaults(func=prune_cache)
+
     # parse the args and call the default sub-command function
     args = parser.parse_args()
     print_header()
@@ -1,94 +1,393 @@
 import hashlib
 import os
-from .exceptions import ConfigException
+import sys
+import threading
+from concurrent.futures import wait
 from .utils import calculate_relative_path
 
 GB = 1024 ** 3
+MB = 1024 ** 2
+
+# Default size of the blocks read from disk while hashing; each hash reads
+# into a single buffer of this size
+READ_BLOCK_SIZE = 8 * MB
+
+# Digests that may be calculated in the same pass as the MD5, named as in
+# hashlib; each is an attribute of AssetDigest
+DIGEST_ALGORITHMS = ('sha1', 'sha256')
+
+# Manifest columns whose values are mostly the same between rows, and so are
+# interned to share a single copy of each value
+INTERNED_COLUMNS = {'BATCH', 'DIRECTORY', 'EXTENSION'}
+
+# Shared tuples of manifest column names, see "intern_fields"
+_fields = {}
+_fields_lock = threading.Lock()
+
+
+def intern_fields(keys):
+    """
+    Return a tuple of the given column names, which is the same object for
+    every call with the same column names.
+    """
+    fields = tuple(keys)
+    with _fields_lock:
+        return _fields.setdefault(fields, fields)
 
 
 class Asset:
     """
     Class representing a binary resource to be archived.
+
+    Batches may hold millions of assets, so instances use __slots__, and the
+    manifest row is stored as a tuple of values, with the column names shared
+    between all the rows that have the same columns (see "manifest_row").
     """
 
-    def __init__(self, path, batch_name=None, md5=None, relpath=None, manifest_row=None, etag=None):
+    __slots__ = (
+        'local_path', 'batch_name', '_md5', 'digest', 'hash_cache', 'mtime', 'bytes', 'relpath', 'etag',
+        '_row_fields', '_row_values'
+    )
+
+    def __init__(self, path, batch_name=None, md5=None, relpath=None, manifest_row=None, etag=None, hash_cache=None):
         self.local_path = path
         self.batch_name = batch_name
-        self.md5 = md5 or self.calculate_md5()
-        self.filename = os.path.basename(self.local_path)
+        # The MD5 is calculated on first use when it is not provided, so that it
+        # can share a single pass over the file with the part MD5s (see "digest")
+        self._md5 = md5 or None
+        self.digest = None
+        self.hash_cache = hash_cache
         self.mtime = int(os.path.getmtime(self.local_path))
-        self.directory = os.path.dirname(self.local_path)
         self.bytes = os.path.getsize(self.local_path)
-        self.extension = os.path.splitext(self.filename)[1].lstrip('.').upper()
         self.relpath = relpath
         self.manifest_row = manifest_row
         self.etag = etag
 
-    def calculate_md5(self):
+    @property
+    def filename(self):
+        return os.path.basename(self.local_path)
+
+    @property
+    def directory(self):
+        return os.path.dirname(self.local_path)
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.filename)[1].lstrip('.').upper()
+
+    @property
+    def manifest_row(self):
+        """
+        The row of the manifest listing this asset, as a new dictionary.
+        """
+        if self._row_fields is None:
+            return None
+        return dict(zip(self._row_fields, self._row_values))
+
+    @manifest_row.setter
+    def manifest_row(self, row):
+        if row is None:
+            self._row_fields = None
+            self._row_values = None
+        else:
+            self._row_fields = intern_fields(row.keys())
+            self._row_values = tuple(
+                sys.intern(value) if field in INTERNED_COLUMNS and isinstance(value, str) else value
+                for field, value in row.items()
+            )
+
+    @property
+    def md5(self):
+        if self._md5 is None:
+            self._md5 = self.calculate_md5()
+        return self._md5
+
+    @md5.setter
+    def md5(self, value):
+        self._md5 = value
+
+    @property
+    def sha1(self):
+        return self.calculate_checksums().sha1
+
+    @property
+    def sha256(self):
+        return self.calculate_checksums().sha256
+
+    @property
+    def md5_known(self):
+        """
+        True if the MD5 is available without reading the file.
+        """
+        return self._md5 is not None
+
+    def calculate_md5(self, block_size=None):
         """
         Calculate and return the object's md5 hash.
         """
-        md5sum = hashlib.md5()
-        with open(self.local_path, 'rb') as f:
-            for data in f:
-                md5sum.update(data)
-        return md5sum.hexdigest()
+        if self.digest is not None:
+            return self.digest.md5
+        return self.read_digest(None, block_size).md5
 
-    def calculate_etag(self, chunk_size):
+    def calculate_digest(self, chunk_size, block_size=None, algorithms=(), executor=None):
+        """
+        Return the AssetDigest of the object for the given chunk size, reading
+        the file at most once, in blocks of block_size bytes (by default,
+        READ_BLOCK_SIZE). The whole-file MD5, the part MD5s and the digests
+        named in algorithms (see DIGEST_ALGORITHMS) are computed in the same
+        pass, on the threads of the executor if one is given, and the MD5 is
+        stored on the asset if it was not already known. When the MD5 is
+        known, no other digests are needed and the file is smaller than the
+        chunk size, the file is not read at all.
+        """
+        if self.digest is not None and self.digest.chunk_size == chunk_size and self.digest.includes(algorithms):
+            return self.digest
+
+        if self._md5 is not None and chunk_size is not None and self.bytes < chunk_size and not algorithms:
+            self.digest = AssetDigest(chunk_size, self.bytes, self._md5, [])
+        else:
+            self.digest = self.read_digest(chunk_size, block_size, algorithms, executor)
+            if self._md5 is None:
+                self._md5 = self.digest.md5
+        return self.digest
+
+    def calculate_checksums(self, block_size=None, executor=None):
+        """
+        Return the AssetDigest of the object including all of the
+        DIGEST_ALGORITHMS, for the chunk size of its current digest, if any,
+        so that the part MD5s are kept.
+        """
+        chunk_size = self.digest.chunk_size if self.digest is not None else None
+        return self.calculate_digest(chunk_size, block_size, DIGEST_ALGORITHMS, executor)
+
+    def read_digest(self, chunk_size, block_size=None, algorithms=(), executor=None):
+        """
+        Return the AssetDigest of the file from the hash cache, if there is a
+        valid entry for it, otherwise hash the file and add it to the cache.
+        The cache only holds MD5s, so the file is always read when other
+        digests are needed.
+        """
+        if self.hash_cache is None:
+            return calculate_digest(self.local_path, chunk_size, block_size, algorithms, executor)
+
+        stat_result = os.stat(self.local_path)
+        digest = self.hash_cache.get(self.local_path, stat_result, chunk_size) if not algorithms else None
+        if digest is None:
+            digest = calculate_digest(self.local_path, chunk_size, block_size, algorithms, executor)
+            self.hash_cache.put(self.local_path, stat_result, digest)
+        return digest
+
+    def calculate_etag(self, chunk_size, block_size=None):
         """
         Calculate the AWS etag: either the md5 hash, or for files larger than
         the specified chunk size, the hash of all the chunk hashes concatenated
-        together, followed by the number of chunks.
+        together, followed by the number of chunks. For files smaller than the
+        chunk size whose MD5 is known, the file is not read (see
+        "calculate_digest").
         """
-        file_size = os.path.getsize(self.local_path)
+        return self.calculate_digest(chunk_size, block_size).etag
 
-        if file_size == 0:
-            # Special handling for zero byte files, just return the MD5 sum of
-            # an empty string
-            return hashlib.md5(b'').hexdigest()
 
-        # Min unchunked file_size is the smaller of chunk_size and GB
-        min_unchunked_file_size = min(chunk_size, GB)
+class AssetDigest:
+    """
+    The result of a single hashing pass over a file: the whole-file MD5, and
+    the MD5 of each part when the file is split into parts of chunk_size bytes
+    (as in an S3 multipart upload). The part digests are empty if the digest
+    was derived from a known MD5 without reading the file. The SHA1 and
+    SHA256 of the file are None unless they were calculated in the same pass.
+    """
+
+    def __init__(self, chunk_size, size, md5, part_digests, sha1=None, sha256=None):
+        self.chunk_size = chunk_size
+        self.size = size
+        self.md5 = md5
+        self.part_digests = part_digests
+        self.sha1 = sha1
+        self.sha256 = sha256
 
-        # For files that are small enough not to be chunked, simply return
-        # the asset MD5
-        use_asset_md5 = (file_size < min_unchunked_file_size) and self.md5
-        if use_asset_md5:
+    def includes(self, algorithms):
+        """
+        True if the digest has a value for each of the given algorithms.
+        """
+        return all(getattr(self, name) is not None for name in algorithms)
+
+    @property
+    def part_md5s(self):
+        return [d.hex() for d in self.part_digests]
+
+    @property
+    def etag(self):
+        """
+        The AWS etag: the MD5 for files uploaded in a single request, otherwise
+        the hash of the part digests concatenated together, followed by the
+        number of parts. S3 uses a multipart upload whenever the file size
+        reaches the threshold, even if this results in a single part.
+        """
+        if self.chunk_size is None or self.size < self.chunk_size:
             return self.md5
+        digests = hashlib.md5(b''.join(self.part_digests))
+        return f'{digests.hexdigest()}-{len(self.part_digests)}'
+
+
+class DigestBuilder:
+    """
+    Incrementally builds an AssetDigest from the bytes of a file, which must be
+    passed to "update" in order. If chunk_size is None, the part MD5s are not
+    calculated. The digests named in algorithms (see DIGEST_ALGORITHMS) are
+    calculated from the same bytes.
+
+    hashlib releases the GIL while hashing large blocks, so if an executor is
+    given, each block is hashed by the MD5 and each of the other digests at the
+    same time, on its threads; "update" returns once they have all finished,
+    so the block may then be overwritten.
+    """
+
+    def __init__(self, chunk_size=None, algorithms=(), executor=None):
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._part = hashlib.md5() if chunk_size is not None else None
+        self._part_size = 0
+        self._part_digests = []
+        self._others = {name: hashlib.new(name) for name in algorithms}
+        self._executor = executor if self._others else None
+
+    def update(self, data):
+        self.size += len(data)
+        if self._executor is None:
+            self._update_md5(data)
+            for other in self._others.values():
+                other.update(data)
+            return
+
+        futures = [self._executor.submit(self._update_md5, data)]
+        futures.extend(self._executor.submit(other.update, data) for other in self._others.values())
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def _update_md5(self, data):
+        self._md5.update(data)
+        if self._part is None:
+            return
+
+        view = memoryview(data)
+        while len(view) > 0:
+            piece = view[:self.chunk_size - self._part_size]
+            self._part.update(piece)
+            self._part_size += len(piece)
+            if self._part_size == self.chunk_size:
+                self._part_digests.append(self._part.digest())
+                self._part = hashlib.md5()
+                self._part_size = 0
+            view = view[len(piece):]
+
+    def result(self):
+        part_digests = list(self._part_digests)
+        if self._part is not None and (self._part_size > 0 or not part_digests):
+            part_digests.append(self._part.digest())
+        others = {name: other.hexdigest() for name, other in self._others.items()}
+        return AssetDigest(self.chunk_size, self.size, self._md5.hexdigest(), part_digests, **others)
+
+
+class HashingReader:
+    """
+    Read-only file wrapper that feeds the bytes read through it into a
+    DigestBuilder, so that the digest of a file can be calculated from the
+    same reads that send it to S3.
+
+    Uploaders may seek backwards to retry a request; bytes are only hashed
+    the first time they are read, so that the digest stays correct. If the
+    reader is moved past the bytes hashed so far, the digest is incomplete
+    and "result" returns None.
+    """
+
+    def __init__(self, fileobj, builder):
+        self._fileobj = fileobj
+        self._builder = builder
+        self._position = fileobj.tell()
+        self._hashed = self._position
+        self._gap = False
 
-        md5s = []
-        with open(self.local_path, 'rb') as handle:
-            if chunk_size < GB:
-                for data in chunked(handle, chunk_size):
-                    md5s.append(hashlib.md5(data))
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        end = self._position + len(data)
+        if end > self._hashed:
+            if self._position > self._hashed:
+                self._gap = True
             else:
-                # Python doesn't like reading more than 1GB of bytes from a file at a time.
-                # To get around this, we read 1GB at a time and assemble those portions into
-                # the final md5sum.
-                if chunk_size % GB != 0:
-                    raise ConfigException('Chunk sizes >1GB must be multiples of 1GB')
-                portions_per_chunk = chunk_size // GB
-                md5sum = None
-                for i, data in enumerate(chunked(handle, GB), 1):
-                    if md5sum is None:
-                        md5sum = hashlib.md5()
-                    md5sum.update(data)
-                    if i % portions_per_chunk == 0:
-                        md5s.append(md5sum)
-                        md5sum = None
-                else:
-                    # check to see if we have a pending md5sum
-                    # after the last iteration of the loop
-                    if md5sum is not None:
-                        md5s.append(md5sum)
-
-        if len(md5s) == 1:
-            return md5s[0].hexdigest()
-        else:
-            digests = hashlib.md5(b''.join(m.digest() for m in md5s))
-            return f'{digests.hexdigest()}-{len(md5s)}'
+                self._builder.update(memoryview(data)[self._hashed - self._position:])
+            self._hashed = end
+        self._position = end
+        return data
+
+    def seek(self, offset, whence=0):
+        self._position = self._fileobj.seek(offset, whence)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        # The uploader closes the files it reads, but the wrapped file is
+        # owned, and closed, by the caller
+        pass
+
+    def result(self, expected_size=None):
+        """
+        Return the AssetDigest of the bytes read, or None if the reader did not
+        see every byte (or exactly expected_size bytes, if given).
+        """
+        if self._gap or (expected_size is not None and self._builder.size != expected_size):
+            return None
+        return self._builder.result()
+
+
+def calculate_digest(path, chunk_size=None, block_size=None, algorithms=(), executor=None):
+    """
+    Calculate the AssetDigest of the file at the given path in a single pass
+    (see DigestBuilder).
+    """
+    builder = DigestBuilder(chunk_size, algorithms, executor)
+    with open_for_hashing(path) as handle:
+        for data in read_blocks(handle, block_size):
+            builder.update(data)
+    return builder.result()
+
+
+def open_for_hashing(path):
+    """
+    Open a file to be read once from start to end, without Python's buffering
+    (the reads are as large as its buffer), advising the OS that it is read
+    sequentially, so that it reads ahead.
+    """
+    handle = open(path, 'rb', buffering=0)
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(handle.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    return handle
 
 
-def chunked(handle, chunk_size):
-    # based on https://stackoverflow.com/a/54989668/5124907
-    return iter(lambda: handle.read(chunk_size), b'')
+def read_blocks(handle, block_size=None):
+    """
+    Generate the contents of a binary file in blocks of block_size bytes (by
+    default, READ_BLOCK_SIZE), read into a single buffer with readinto, so
+    that the memory used is the same whatever the size of the file, and no
+    new bytes objects are allocated.
+
+    The blocks are memoryviews of the buffer, which is overwritten by the
+    next read: they must be used (for example, hashed) before the next block
+    is requested, and not kept.
+    """
+    buffer = bytearray(block_size or READ_BLOCK_SIZE)
+    view = memoryview(buffer)
+    while True:
+        size = handle.readinto(buffer)
+        if not size:
+            break
+        yield view[:size]
@@ -0,0 +1,216 @@
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+from .exceptions import ConfigException
+
+UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+UNLIMITED = 'unlimited'
+
+# Minimum number of seconds between checks of the schedule and control file
+REFRESH_INTERVAL = 5
+
+
+def parse_rate(rate_string):
+    """
+    Return the rate in bytes per second for a human-readable rate (such as
+    "10MB" or "500KB/s"), or None for "unlimited" or 0.
+    """
+    if rate_string is None:
+        return None
+    rate_string = str(rate_string).strip().upper()
+    if rate_string in (UNLIMITED.upper(), '0', ''):
+        return None
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*(KB|MB|GB)(?:/S)?', rate_string)
+    if match is None:
+        raise ConfigException(f'Bandwidth must be given in KB, MB or GB (per second), or "{UNLIMITED}": '
+                              f'{rate_string}')
+    return int(float(match.group(1)) * UNITS[match.group(2)])
+
+
+def parse_time(time_string):
+    """
+    Return the minutes since midnight for a time given as HH:MM.
+    """
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', time_string.strip())
+    if match is None or int(match.group(1)) > 24 or int(match.group(2)) > 59:
+        raise ConfigException(f'Times must be given as HH:MM: {time_string}')
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+def parse_schedule(schedule):
+    """
+    Parse a bandwidth schedule, given as a list of, or a comma-separated
+    string of, "HH:MM-HH:MM=RATE" entries. Returns a list of (start, end,
+    rate) tuples, with times in minutes since midnight. A period whose end is
+    before its start runs past midnight.
+    """
+    if not schedule:
+        return []
+    if isinstance(schedule, str):
+        schedule = schedule.split(',')
+    periods = []
+    for entry in schedule:
+        try:
+            times, rate = entry.split('=')
+            start, end = times.split('-')
+        except ValueError:
+            raise ConfigException(f'Schedule entries must be given as HH:MM-HH:MM=RATE: {entry}')
+        periods.append((parse_time(start), parse_time(end), parse_rate(rate)))
+    return periods
+
+
+def format_rate(rate):
+    return UNLIMITED if rate is None else f'{rate} bytes/s'
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Threads call "consume" with the number of bytes
+    they are about to send, and are made to wait long enough to keep the total
+    rate across all of them at or below the rate (in bytes per second),
+    allowing bursts of up to one second's worth of bytes. A rate of None
+    means unlimited.
+
+    Instances may be shared between threads.
+    """
+
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+        self.rate = rate
+        self._tokens = rate or 0
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            if rate is not None:
+                self._tokens = min(self._tokens, rate)
+
+    def consume(self, amount):
+        """
+        Wait until the given number of bytes may be sent.
+        """
+        if amount <= 0:
+            return
+        with self._lock:
+            self._refill()
+            if self.rate is None:
+                return
+            # Tokens may go negative; later callers then wait for the debt
+            # to be repaid as well, so that waiting threads are served in turn
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+class BandwidthGovernor(TokenBucket):
+    """
+    Token bucket whose rate can be changed while a deposit is running. The
+    rate is taken, in order of preference, from:
+
+    * the control file, if it exists and is not empty (it contains a rate
+      such as "10MB", or "unlimited")
+    * the period of the schedule (see "parse_schedule") covering the current
+      time of day
+    * the default rate
+
+    The rate is checked every REFRESH_INTERVAL seconds, and immediately after
+    a SIGHUP (see "install_signal_handler").
+    """
+
+    def __init__(self, rate=None, schedule=None, control_file=None):
+        self.default_rate = rate
+        self.schedule = schedule or []
+        self.control_file = control_file
+        self._control_rate = None
+        self._control_mtime = None
+        self._next_refresh = 0
+        super().__init__(self.current_rate())
+
+    @classmethod
+    def from_config(cls, rate=None, schedule=None, control_file=None):
+        """
+        Returns a governor for the given human-readable rate and schedule, or
+        None if no limit or control file is configured.
+        """
+        schedule = parse_schedule(schedule)
+        rate = parse_rate(rate)
+        if rate is None and not schedule and not control_file:
+            return None
+        return cls(rate, schedule, control_file)
+
+    def install_signal_handler(self):
+        """
+        Re-read the control file and schedule when the process receives a
+        SIGHUP. Must be called from the main thread.
+        """
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.request_refresh())
+
+    def request_refresh(self):
+        self._next_refresh = 0
+
+    def consume(self, amount):
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+        super().consume(amount)
+
+    def refresh(self):
+        """
+        Update the rate from the control file and the schedule.
+        """
+        self._next_refresh = time.monotonic() + REFRESH_INTERVAL
+        rate = self.current_rate()
+        if rate != self.rate:
+            self.set_rate(rate)
+            sys.stdout.write(f'\n  Bandwidth limit set to {format_rate(rate)}\n')
+
+    def current_rate(self):
+        if self.control_file is not None:
+            self._read_control_file()
+            if self._control_mtime is not None:
+                return self._control_rate
+        return self.scheduled_rate(datetime.now())
+
+    def scheduled_rate(self, now):
+        """
+        Returns the rate from the schedule for the given time, or the default
+        rate if no period of the schedule covers it.
+        """
+        minutes = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            if start <= minutes < end or (end < start and (minutes >= start or minutes < end)):
+                return rate
+        return self.default_rate
+
+    def _read_control_file(self):
+        try:
+            mtime = os.stat(self.control_file).st_mtime_ns
+        except FileNotFoundError:
+            self._control_mtime = None
+            return
+        if mtime == self._control_mtime:
+            return
+        with open(self.control_file) as control_file:
+            contents = control_file.read().strip()
+        if not contents:
+            self._control_mtime = None
+            return
+        try:
+            self._control_rate = parse_rate(contents)
+            self._control_mtime = mtime
+        except ConfigException as e:
+            print(f'Ignoring {self.control_file}: {e}', file=sys.stderr)
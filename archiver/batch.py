@@ -1,61 +1,50 @@
 import csv
+import itertools
 import json
 import os
+import queue
 import sys
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Any, Optional
 
-import boto3
 from boto3.exceptions import S3UploadFailedError
 from boto3.s3.transfer import TransferConfig
-from botocore.exceptions import ClientError, ProfileNotFound
+from botocore.exceptions import ClientError
 
 from enum import Enum, unique
 
-from .asset import Asset
-from .exceptions import ConfigException, PathOutOfScopeException, FailureException
-from .utils import calculate_relative_path
+from .asset import Asset, DigestBuilder, HashingReader, GB, MB
+from .bandwidth import TokenBucket, format_rate, parse_rate
+from .budget import DepositBudget
+from .clients import DEFAULT_POOL_CONNECTIONS, DEFAULT_TCP_KEEPALIVE, S3ClientFactory, connections_needed
+from .fake_s3 import FakeS3
+from .packing import Packer, DEFAULT_PACK_SIZE, PACK_FIELDS
+from .metrics import PhaseMetrics, PHASE_ETAG, PHASE_HASH, PHASE_STAT, PHASE_UPLOAD, PHASE_VERIFY
+from .progress import ProgressReporter, ShardedCounter, UploadCallback
+from .tracing import RequestTracer, TRACE_FILENAME
+from .exceptions import ConfigException, PathOutOfScopeException
+from .results import ResultsIndex
+from .utils import calculate_relative_path, get_csv_fieldnames
+from .verify import (
+    UploadResponseCapture, needs_head_request, DEFAULT_VERIFY_POLICY, DEFAULT_VERIFY_SAMPLE_RATE,
+    DEFAULT_VERIFY_THREADS, VERIFY_HEAD, VERIFY_POLICIES, VERIFY_RESPONSE, VERIFY_SAMPLE
+)
 
 
-def get_s3_client(profile_name, dry_run=False):
+def get_s3_client(profile_name, dry_run=False, max_pool_connections=DEFAULT_POOL_CONNECTIONS,
+                  tcp_keepalive=DEFAULT_TCP_KEEPALIVE):
     """
-    Set up a session with specified authentication profile.
+    Set up a session with specified authentication profile, and a client
+    with a pool of max_pool_connections connections. For a dry run, the
+    client's requests are answered by a FakeS3 instead of AWS. To share a
+    client between deposits, use an S3ClientFactory.
     """
-    if dry_run:
-        from unittest.mock import MagicMock
-        mock_s3_client = MagicMock()
-        response = {'ResponseMetadata': {'HTTPHeaders': {'etag': 'DRY_RUN'}}}
-        mock_s3_client.head_object = MagicMock(return_value=response)
-
-        return mock_s3_client
-    else:
-        try:
-            session = boto3.session.Session(profile_name=profile_name)
-        except ProfileNotFound as e:
-            print(e, file=sys.stderr)
-            raise FailureException from e
-        return session.resource('s3').meta.client
-
-
-class ProgressPercentage:
-    """Display upload progress using callbacks."""
-
-    def __init__(self, asset, batch):
-        self.asset = asset
-        self.batch = batch
-        self._seen_so_far = 0
-        self._lock = threading.Lock()
-
-    def __call__(self, bytes_amount):
-        with self._lock:
-            self._seen_so_far += bytes_amount
-            self.batch.stats['asset_bytes_transmitted'] += bytes_amount
-            pct = (self._seen_so_far / self.asset.bytes) * 100
-            sys.stdout.write(
-                f'\r  {self.asset.filename} -> ' +
-                f'{self._seen_so_far}/{self.asset.bytes} ({pct:.2f}%)'
-            )
-            sys.stdout.flush()
+    factory = S3ClientFactory(profile_name, max_pool_connections, tcp_keepalive, FakeS3() if dry_run else None)
+    return factory.client()
 
 
 def calculate_chunk_bytes(chunk_string):
@@ -71,11 +60,242 @@ def calculate_chunk_bytes(chunk_string):
 
 
 DEFAULT_CHUNK_SIZE = '4GB'
+# Chunk size that chooses the part size of each asset from its size
+AUTO_CHUNK_SIZE = 'auto'
+DEFAULT_TARGET_PARTS = 100
 DEFAULT_STORAGE_CLASS = 'DEEP_ARCHIVE'
+# The additional checksum sent with uploads, when enabled
+CHECKSUM_ALGORITHM = 'SHA256'
 DEFAULT_MAX_THREADS = 10
+DEFAULT_MAX_ASSETS = 1
+DEFAULT_HASH_WORKERS = 4
 DEFAULT_LOG_DIR = 'logs'
 DEFAULT_MANIFEST_FILENAME = 'manifest.txt'
 
+# Limits on the parts of a multipart upload imposed by S3
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * GB
+MAX_PARTS = 10000
+
+# Minimum number of seconds between progress updates
+PROGRESS_INTERVAL = 1
+
+# Maximum number of keys returned by a ListObjectsV2 request
+LIST_PAGE_SIZE = 1000
+
+# When streaming, the number of assets read ahead of the uploads, per worker
+STREAM_QUEUE_FACTOR = 2
+
+# Marks the end of the assets in a streaming deposit
+END_OF_STREAM = object()
+
+
+class RemoteListing:
+    """
+    Lazily lists the objects in a bucket, one key prefix at a time, using
+    paginated ListObjectsV2 requests. May be shared between threads.
+    """
+
+    def __init__(self, s3_client, bucket):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self._prefixes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key_prefix, key):
+        """
+        Returns a (size, ETag) tuple for the object with the given key, which
+        must start with key_prefix + '/', or None if there is no such object.
+        """
+        with self._lock:
+            if key_prefix not in self._prefixes:
+                self._prefixes[key_prefix] = list_objects(self.s3_client, self.bucket, f'{key_prefix}/')
+            return self._prefixes[key_prefix].get(key)
+
+
+def list_objects(s3_client, bucket, prefix):
+    """
+    Returns a dictionary mapping the key of each object in the bucket under the
+    given prefix to a (size, ETag) tuple.
+    """
+    sys.stdout.write(f'Listing objects in {bucket}/{prefix} ...\n')
+    objects = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix, PaginationConfig={'PageSize': LIST_PAGE_SIZE}):
+        for obj in page.get('Contents', []):
+            objects[obj['Key']] = (obj['Size'], obj['ETag'].replace('"', ''))
+    sys.stdout.write(f'  Found {len(objects)} objects in {bucket}/{prefix}\n')
+    return objects
+
+
+def choose_part_size(size, target_parts):
+    """
+    Returns the part size for uploading a file of the given size in about
+    target_parts parts, rounded up to a whole number of MB, and within the
+    limits on the size and number of parts of a multipart upload.
+    """
+    part_size = max(-(-size // target_parts), -(-size // MAX_PARTS), MIN_PART_SIZE)
+    part_size = -(-part_size // MB) * MB
+    return min(part_size, MAX_PART_SIZE)
+
+
+@dataclass
+class PartSizing:
+    """
+    How the part size of each asset is chosen: either a fixed chunk_bytes, or,
+    if that is None, automatically from the size of the asset (aiming for
+    target_parts parts, and at least one part per upload thread).
+
+    The same part size is used for the upload and the expected ETag, and is
+    also the size at or above which an asset is uploaded in parts.
+    """
+    chunk_bytes: Optional[int] = None
+    target_parts: int = DEFAULT_TARGET_PARTS
+    max_threads: int = DEFAULT_MAX_THREADS
+
+    def __post_init__(self):
+        self._transfer_configs = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_chunk_size(cls, chunk_size, max_threads=DEFAULT_MAX_THREADS, target_parts=DEFAULT_TARGET_PARTS):
+        """
+        Returns the PartSizing for a chunk size given in MB or GB, or "auto".
+        """
+        if chunk_size == AUTO_CHUNK_SIZE:
+            return cls(target_parts=target_parts, max_threads=max_threads)
+        chunk_bytes = calculate_chunk_bytes(chunk_size)
+        if not MIN_PART_SIZE <= chunk_bytes <= MAX_PART_SIZE:
+            raise ConfigException(f'Chunk size must be between {MIN_PART_SIZE // MB}MB and {MAX_PART_SIZE // GB}GB')
+        return cls(chunk_bytes=chunk_bytes, max_threads=max_threads)
+
+    def __str__(self):
+        if self.auto:
+            return f'about {max(self.target_parts, self.max_threads)} parts per asset'
+        return f'{self.chunk_bytes} bytes'
+
+    @property
+    def auto(self):
+        return self.chunk_bytes is None
+
+    def part_size(self, size):
+        """
+        Returns the part size for an asset of the given size.
+        """
+        if self.chunk_bytes is not None:
+            return self.chunk_bytes
+        return choose_part_size(size, max(self.target_parts, self.max_threads))
+
+    def container_part_size(self, size):
+        """
+        Returns the part size for a container of packed assets of the given
+        size. A container is generated as it is read, so S3 buffers each part
+        of it in memory (see archiver.packing.ContainerReader); its part size
+        is chosen from its size as with "auto", and is at most the part size
+        of an asset. Its ETag is calculated as it is sent, so it does not need
+        to match a fixed chunk size.
+        """
+        return min(self.part_size(size), choose_part_size(size, max(self.target_parts, self.max_threads)))
+
+    def upload_threads(self, size, part_size):
+        """
+        Returns the number of threads used to upload an asset of the given
+        size, in parts of part_size.
+        """
+        if size < part_size:
+            return 1
+        return min(self.max_threads, -(-size // part_size))
+
+    def known_etag(self, asset):
+        """
+        Returns the expected ETag of the asset from the manifest, or None if
+        it is not given. ETags in manifests are calculated with a fixed chunk
+        size, so they are not used when choosing part sizes automatically.
+        """
+        if self.auto:
+            return None
+        return asset.etag or None
+
+    def transfer_config(self, part_size, threads=None):
+        """
+        Returns the AWS transfer configuration for uploading with the given
+        part size and number of threads (by default max_threads); this
+        governs the parts of a single asset.
+        """
+        threads = threads or self.max_threads
+        with self._lock:
+            config = self._transfer_configs.get((part_size, threads))
+            if config is None:
+                config = TransferConfig(
+                    multipart_threshold=part_size,
+                    max_concurrency=threads,
+                    multipart_chunksize=part_size,
+                    use_threads=(threads > 1)
+                )
+                # When hashing on upload, the parts are read into memory (see
+                # HashingReader), so limit them to the number of upload threads
+                config.max_in_memory_upload_chunks = threads
+                self._transfer_configs[(part_size, threads)] = config
+            return config
+
+
+def needs_hashing(asset, part_sizing):
+    """
+    True if reading the asset is required to get its MD5 or expected ETag.
+    """
+    part_size = part_sizing.part_size(asset.bytes)
+    if asset.digest is not None and asset.digest.chunk_size == part_size:
+        return False
+    return not asset.md5_known or (not part_sizing.known_etag(asset) and asset.bytes >= part_size)
+
+
+def hash_asset(asset, part_sizing, metrics):
+    """
+    Calculate the MD5 and, if it is not known, the expected ETag of the asset.
+    """
+    if not part_sizing.known_etag(asset):
+        return digest_asset(asset, part_sizing.part_size(asset.bytes), metrics)
+    elif asset.md5_known:
+        return asset.md5
+    with metrics.timed(PHASE_HASH, asset.bytes):
+        return asset.md5
+
+
+def digest_asset(asset, part_size, metrics):
+    """
+    Returns the AssetDigest of the asset for the given part size. Its
+    calculation is timed as the "hash" phase, or as the "etag" phase if the
+    MD5 of the asset was already known.
+    """
+    if asset.digest is not None and asset.digest.chunk_size == part_size:
+        return asset.digest
+    with metrics.timed(PHASE_ETAG if asset.md5_known else PHASE_HASH, asset.bytes):
+        return asset.calculate_digest(chunk_size=part_size)
+
+
+@dataclass
+class DepositContext:
+    """
+    Settings and shared resources used by the workers of a single deposit.
+    """
+    s3_client: Any
+    part_sizing: PartSizing
+    budget: DepositBudget
+    limiters: tuple
+    progress: ProgressReporter
+    bytes_counter: ShardedCounter
+    storage_class: str
+    checksum_algorithm: Optional[str]
+    hash_on_upload: bool
+    writer: Any
+    results_index: Any
+    remote_listing: Any
+    upload_responses: UploadResponseCapture
+    verify_executor: ThreadPoolExecutor
+    verify_policy: str
+    verify_sample_rate: float
+    json_log: Any
+
 
 @unique
 class ManifestFileType(Enum):
@@ -92,13 +312,14 @@ class Batch:
     and an AWS configuration where they will be archived.
     """
 
-    def __init__(self, manifest, bucket, asset_root, name=None, log_dir=None):
+    def __init__(self, manifest, bucket, asset_root, name=None, log_dir=None, hash_cache=None):
         """
         Set up a batch of assets to be loaded. Any assets whose local paths don't exist are omitted from the batch.
         """
         self.manifest = manifest
         self.overridden_name = name
         self.bucket = bucket
+        self.hash_cache = hash_cache
 
         if asset_root is None:
             self.asset_root = None
@@ -114,6 +335,11 @@ class Batch:
         self.results_filename = os.path.join(self.log_dir, 'results.csv')
         self.manifest_filename = None
         self.contents = []
+        self._lock = threading.Lock()
+        self.metrics = PhaseMetrics()
+        self._bytes_counter = None
+        # The key prefixes of the assets deposited so far, see "owns_key"
+        self._key_prefixes = set()
 
         self.stats = {
             'batch_name': self.overridden_name,
@@ -121,8 +347,10 @@ class Batch:
             'assets_found': 0,
             'assets_missing': 0,
             'assets_ignored': 0,
+            'assets_skipped': 0,
             'assets_transmitted': 0,
             'asset_bytes_transmitted': 0,
+            'head_requests': 0,
             'successful_deposits': 0,
             'failed_deposits': 0,
             'deposit_begin': '',
@@ -130,39 +358,251 @@ class Batch:
             'deposit_time': 0
         }
 
-    def add_asset(self, path, batch_name=None, md5=None, relpath=None, manifest_row=None, etag=None):
+    def create_asset(self, path, batch_name=None, md5=None, relpath=None, manifest_row=None, etag=None):
+        """
+        Create an Asset for the batch, updating the stats. Returns None if the
+        file is missing, or is outside the asset root.
+        """
         try:
-            self.stats['total_assets'] += 1
+            self.increment_stat('total_assets')
             if (self.asset_root is not None) and (relpath is None):
                 relpath = calculate_relative_path(self.asset_root, path)
 
-            asset = Asset(path, batch_name=batch_name, md5=md5, relpath=relpath, manifest_row=manifest_row, etag=etag)
-            self.contents.append(asset)
-            self.stats['assets_found'] += 1
+            with self.metrics.timed(PHASE_STAT):
+                asset = Asset(path, batch_name=batch_name, md5=md5, relpath=relpath, manifest_row=manifest_row,
+                              etag=etag, hash_cache=self.hash_cache)
+            self.increment_stat('assets_found')
+            return asset
         except FileNotFoundError as e:
-            self.stats['assets_missing'] += 1
+            self.increment_stat('assets_missing')
             print(f'Skipping {path}: {e}', file=sys.stderr)
         except PathOutOfScopeException as e:
-            self.stats['assets_ignored'] += 1
+            self.increment_stat('assets_ignored')
             print(f'Skipping {path}: {e}', file=sys.stderr)
+        return None
 
-    def deposit(self, profile_name, chunk_size=None, storage_class=None, max_threads=None, dry_run=False):
-        s3_client = get_s3_client(profile_name, dry_run)
+    def add_asset(self, path, batch_name=None, md5=None, relpath=None, manifest_row=None, etag=None):
+        asset = self.create_asset(path, batch_name=batch_name, md5=md5, relpath=relpath, manifest_row=manifest_row,
+                                  etag=etag)
+        if asset is not None:
+            self.contents.append(asset)
 
+    def stream_manifest(self, etag_exists=False):
+        """
+        Lazily create the assets listed in the manifest that are not in the
+        results file, without adding them to the batch contents. The result
+        can be passed to "deposit" as its "assets", so that uploads start
+        before the whole manifest has been read.
+        """
+        for asset_args in self.manifest.iter_assets(self.results_filename, etag_exists=etag_exists):
+            asset = self.create_asset(**asset_args)
+            if asset is not None:
+                yield asset
+
+    def hash_assets(self, part_sizing, max_workers=DEFAULT_HASH_WORKERS, min_bytes=0):
+        """
+        Calculate the digests of the assets in the batch that need them,
+        using a pool of worker threads. Assets smaller than min_bytes are
+        left alone. Assets whose files disappear before they can be hashed are
+        removed from the batch, and counted as missing.
+        """
+        pending = [asset for asset in self.contents
+                   if asset.bytes >= min_bytes and needs_hashing(asset, part_sizing)]
+        if not pending:
+            return
+
+        total_bytes = sum(asset.bytes for asset in pending)
+        hashed_bytes = 0
+        missing = set()
+        sys.stdout.write(f'Hashing {len(pending)} assets ({total_bytes} bytes) with {max_workers} workers ...\n')
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hash') as executor:
+            futures = {executor.submit(hash_asset, asset, part_sizing, self.metrics): asset for asset in pending}
+            last_update = 0
+            for n, future in enumerate(as_completed(futures), 1):
+                asset = futures[future]
+                try:
+                    future.result()
+                    hashed_bytes += asset.bytes
+                except FileNotFoundError as e:
+                    missing.add(id(asset))
+                    print(f'Skipping {asset.local_path}: {e}', file=sys.stderr)
+
+                now = time.monotonic()
+                if now - last_update >= PROGRESS_INTERVAL or n == len(pending):
+                    last_update = now
+                    sys.stdout.write(f'\r  Hashed {n}/{len(pending)} assets ({hashed_bytes}/{total_bytes} bytes)')
+                    sys.stdout.flush()
+        sys.stdout.write('\n\n')
+
+        if missing:
+            self.contents = [asset for asset in self.contents if id(asset) not in missing]
+            self.stats['assets_found'] -= len(missing)
+            self.stats['assets_missing'] += len(missing)
+
+    def prefetch_assets(self, assets, part_sizing, hash_workers, queue_size, min_bytes=0):
+        """
+        Pull assets from the given iterable on a background thread, hashing
+        those that need it (and are at least min_bytes in size) with a pool of
+        hash_workers threads, and yield them in order. At most queue_size assets are read ahead of the consumer.
+        Assets whose files disappear before they can be hashed are counted as
+        missing and skipped.
+
+        If the consumer stops early, or the generator is closed, the
+        background thread stops reading the assets, and closes the iterable
+        if it is a generator, so that the manifest file is closed.
+        """
+        pipeline = queue.Queue(maxsize=queue_size)
+        executor = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix='hash') if hash_workers else None
+        stopped = threading.Event()
+
+        def produce():
+            try:
+                for asset in assets:
+                    if stopped.is_set():
+                        return
+                    future = None
+                    if executor is not None and asset.bytes >= min_bytes and needs_hashing(asset, part_sizing):
+                        future = executor.submit(hash_asset, asset, part_sizing, self.metrics)
+                    pipeline.put((asset, future))
+                pipeline.put(END_OF_STREAM)
+            except Exception as e:
+                if not stopped.is_set():
+                    pipeline.put(e)
+            finally:
+                close = getattr(assets, 'close', None)
+                if close is not None:
+                    close()
+
+        producer = threading.Thread(target=produce, name='manifest-reader', daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = pipeline.get()
+                if item is END_OF_STREAM:
+                    break
+                elif isinstance(item, Exception):
+                    raise item
+                asset, future = item
+                if future is not None:
+                    try:
+                        future.result()
+                    except FileNotFoundError as e:
+                        self.increment_stat('assets_found', -1)
+                        self.increment_stat('assets_missing')
+                        print(f'Skipping {asset.local_path}: {e}', file=sys.stderr)
+                        continue
+                yield asset
+        finally:
+            # Release the producer if it is waiting for room in the queue; it
+            # then sees that it has been stopped before reading another asset
+            stopped.set()
+            while True:
+                try:
+                    item = pipeline.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, tuple) and item[1] is not None:
+                    item[1].cancel()
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def deposit(self, profile_name, chunk_size=None, storage_class=None, max_threads=None, max_assets=None,
+                hash_on_upload=False, hash_workers=None, preflight=False, verify_policy=None, verify_sample_rate=None,
+                verify_threads=None, target_parts=None, budget=None, max_bandwidth=None, governor=None,
+                progress=None, trace_requests=False, dry_run=False, assets=None, s3_client=None, pack_threshold=None,
+                pack_size=None, checksum_sha256=False):
+        """
+        Upload the assets and verify them. By default the batch contents are
+        deposited; alternatively, an iterable of assets (such as the result of
+        "stream_manifest") may be given, which is consumed as the deposit runs.
+
+        With preflight, the objects already in the bucket under the key prefix
+        of the batch are listed, and assets that are there with the expected
+        size and ETag are skipped.
+
+        Uploaded assets are verified by a separate pool of verify_threads
+        workers, according to the verify_policy (see archiver.verify).
+
+        If chunk_size is "auto", the part size of each asset is chosen from its
+        size, aiming for target_parts parts (see PartSizing).
+
+        A DepositBudget may be given to share limits on the upload threads and
+        bytes in flight with other deposits running at the same time.
+
+        The upload rate of this deposit is limited to max_bandwidth (such as
+        "10MB", per second), and by the BandwidthGovernor, if one is given,
+        which may be shared with other deposits.
+
+        Progress is reported by the given ProgressReporter, which may also be
+        shared, or else by a reporter in the default mode.
+
+        With trace_requests, the S3 requests made are traced (see
+        archiver.tracing), and summarized in "requests.json" in the log
+        directory.
+
+        An S3 client may be given instead of a profile name, such as the
+        shared client of an archiver.clients.S3ClientFactory, or a client
+        answered by archiver.fake_s3.FakeS3. Otherwise, a client is created
+        with a connection pool for the uploads and verifications this deposit
+        may make at once.
+
+        With a pack_threshold (such as "16MB"), the assets smaller than it are
+        packed into tar containers of about pack_size (see archiver.packing),
+        instead of being uploaded one by one, and the location of each asset
+        in its container is recorded in the results file. Packed assets are
+        not checked by the preflight.
+
+        With checksum_sha256, a SHA256 checksum of each upload request is sent
+        to S3, which rejects the request if the data it received does not
+        match. botocore calculates it from the bytes as they are sent, and
+        sends it after them, so the files are not read again.
+        """
         if chunk_size is None:
             chunk_size = DEFAULT_CHUNK_SIZE
-        chunk_bytes = calculate_chunk_bytes(chunk_size)
         storage_class = storage_class if storage_class is not None else DEFAULT_STORAGE_CLASS
         max_threads = int(max_threads if max_threads is not None else DEFAULT_MAX_THREADS)
+        target_parts = int(target_parts if target_parts is not None else DEFAULT_TARGET_PARTS)
+        part_sizing = PartSizing.from_chunk_size(chunk_size, max_threads, target_parts)
+        budget = budget if budget is not None else DepositBudget()
+        bandwidth = parse_rate(max_bandwidth)
+        limiters = (governor,) if governor is not None else ()
+        if bandwidth is not None:
+            limiters += (TokenBucket(bandwidth),)
+        max_assets = int(max_assets if max_assets is not None else DEFAULT_MAX_ASSETS)
+        verify_policy = verify_policy if verify_policy is not None else DEFAULT_VERIFY_POLICY
+        if verify_policy not in VERIFY_POLICIES:
+            raise ConfigException(f'Verify policy must be one of: {", ".join(VERIFY_POLICIES)}')
+        verify_sample_rate = float(verify_sample_rate if verify_sample_rate is not None else DEFAULT_VERIFY_SAMPLE_RATE)
+        verify_threads = int(verify_threads if verify_threads is not None else DEFAULT_VERIFY_THREADS)
+        verify_description = verify_policy
+        if verify_policy == VERIFY_SAMPLE:
+            verify_description += f' ({verify_sample_rate:.0%})'
         use_threads = (max_threads > 1)
-
-        # Set up the AWS transfer configuration for the deposit
-        aws_config = TransferConfig(
-            multipart_threshold=chunk_bytes,
-            max_concurrency=max_threads,
-            multipart_chunksize=chunk_bytes,
-            use_threads=use_threads
-        )
+        # The part sizes are needed to calculate the ETags again, so they
+        # cannot be left out of the results
+        existing_fields = get_csv_fieldnames(self.results_filename) if self.manifest.manifest_filename else None
+        if existing_fields is not None and 'PARTSIZE' not in existing_fields:
+            raise ConfigException(f'{self.results_filename} has no PARTSIZE column, as it was written by an '
+                                  f'earlier version of this tool; use a new log directory')
+        if s3_client is None:
+            s3_client = get_s3_client(profile_name, dry_run, connections_needed(
+                max_assets * max_threads, verify_threads, budget.max_threads
+            ))
+        tracer = RequestTracer(accepts=self.owns_key) if trace_requests else None
+        if tracer is not None:
+            tracer.register(s3_client)
+        begin = datetime.now()
+        if pack_threshold is not None:
+            packer = Packer(calculate_chunk_bytes(pack_threshold),
+                            calculate_chunk_bytes(pack_size if pack_size is not None else DEFAULT_PACK_SIZE),
+                            begin.strftime('%Y%m%dT%H%M%S'))
+            pack_description = f'assets under {pack_threshold} into containers of {packer.target_size} bytes'
+            if existing_fields is not None and not set(PACK_FIELDS).issubset(existing_fields):
+                raise ConfigException(f'{self.results_filename} has no columns for the locations of packed '
+                                      f'assets; use a new log directory to pack assets')
+        else:
+            packer = None
+            pack_description = 'no'
 
         # Display batch configuration information to the user
         sys.stdout.write(
@@ -170,148 +610,579 @@ class Batch:
             f'  - Target Bucket: {self.bucket}\n'
             f'  - Local Asset Root: {self.asset_root}\n'
             f'  - Storage Class: {storage_class}\n'
-            f'  - Chunk Size: {chunk_size} ({chunk_bytes} bytes)\n'
+            f'  - SHA256 Checksums: {checksum_sha256}\n'
+            f'  - Chunk Size: {chunk_size} ({part_sizing})\n'
             f'  - Use Threads: {use_threads}\n'
             f'  - Max Threads: {max_threads}\n'
+            f'  - Max Assets: {max_assets}\n'
+            f'  - Hash On Upload: {hash_on_upload}\n'
+            f'  - Hash Workers: {hash_workers}\n'
+            f'  - Preflight: {preflight}\n'
+            f'  - Pack: {pack_description}\n'
+            f'  - Verify: {verify_description} with {verify_threads} threads\n'
+            f'  - Max Bandwidth: {format_rate(bandwidth)}' +
+            (f' (and a shared limit of {format_rate(governor.rate)})' if governor is not None else '') + '\n' +
+            f'  - Trace Requests: {trace_requests}\n'
             f'  - AWS Profile: {profile_name}\n'
             f'  - Dry Run: {dry_run}\n\n'
         )
 
-        begin = datetime.now()
         self.stats['deposit_begin'] = begin.isoformat()
+        owns_progress = progress is None
+        if owns_progress:
+            progress = ProgressReporter()
+        bytes_counter = self._bytes_counter = progress.counter()
+
+        if assets is None:
+            # Hash the assets up front in parallel, unless the hashes are to be
+            # calculated from the uploads themselves
+            if hash_workers and not hash_on_upload:
+                self.hash_assets(part_sizing, hash_workers, min_bytes=packer.threshold if packer else 0)
+            sys.stdout.write(f'Depositing {len(self.contents)} assets ...\n')
+            progress.add_expected(len(self.contents), sum(asset.bytes for asset in self.contents))
+            streaming = False
+            assets = iter(self.contents)
+        else:
+            # Hash the assets in a pipeline stage while they are loaded
+            sys.stdout.write(f'Depositing assets as they are loaded ...\n')
+            hash_workers = hash_workers if not hash_on_upload else 0
+            streaming = True
+            assets = self.prefetch_assets(assets, part_sizing, hash_workers,
+                                          queue_size=STREAM_QUEUE_FACTOR * (max_assets + (hash_workers or 0)),
+                                          min_bytes=packer.threshold if packer else 0)
+
+        progress.start()
+
+        # Look at the first asset for the fields of its manifest row
+        first_asset = next(assets, None)
+        if first_asset is not None:
+            assets = itertools.chain([first_asset], assets)
 
         if self.manifest.manifest_filename:
-            results_file_exists = os.path.exists(self.results_filename)
+            # Keep the columns of an existing results file, which may have
+            # been written by a version of this tool without some of them
+            existing_fields = get_csv_fieldnames(self.results_filename)
             results_file = open(self.results_filename, 'a')
             fieldnames = ['ID']
             # Include fields from the manifest in the results file
-            if (len(self.contents) > 0):
-                first_asset = self.contents[0]
+            if first_asset is not None:
                 manifest_row = first_asset.manifest_row
                 if manifest_row:
                     fieldnames.extend(manifest_row.keys())
-            fieldnames.extend(['KEYPATH', 'ETAG', 'RESULT', 'STORAGEPROVIDER', 'STORAGELOCATION'])
-            writer = csv.DictWriter(results_file, fieldnames=fieldnames)
-            if not results_file_exists:
+            fieldnames.extend(['KEYPATH', 'ETAG', 'PARTSIZE', 'RESULT', 'STORAGEPROVIDER', 'STORAGELOCATION'])
+            if packer is not None:
+                fieldnames.extend(PACK_FIELDS)
+            writer = csv.DictWriter(results_file, fieldnames=existing_fields or fieldnames, extrasaction='ignore')
+            if existing_fields is None:
                 writer.writeheader()
+            results_index = ResultsIndex(self.results_filename)
         else:
             results_file = None
             writer = None
+            results_index = None
 
-        # Process and transfer each asset in the batch contents
-        sys.stdout.write(f'Depositing {len(self.contents)} assets ...\n')
-
-        with open(os.path.join(self.log_dir, 'assets.json'), 'w') as json_log:
-            for n, asset in enumerate(self.contents, 1):
-                header = f'({n}) {asset.filename.upper()}'
-                if self.overridden_name is not None:
-                    print(f'using overridden name {self.overridden_name}')
-                    key_path = f'{self.overridden_name}/{asset.relpath}'
-                elif asset.batch_name is not None and asset.batch_name != '':
-                    print(f'Using batch name from the row {asset.batch_name}')
-                    key_path = f'{asset.batch_name}/{asset.relpath}'
-                else:
-                    print(f'Using the manifestpath {self.manifest.manifest_path}')
-                    key_path = f'{self.manifest.manifest_path}/{asset.relpath}'
+        with open(os.path.join(self.log_dir, 'assets.json'), 'w') as json_log, \
+                ThreadPoolExecutor(max_workers=verify_threads, thread_name_prefix='verify') as verify_executor:
+            deposit_context = DepositContext(
+                s3_client=s3_client,
+                part_sizing=part_sizing,
+                budget=budget,
+                limiters=limiters,
+                progress=progress,
+                bytes_counter=bytes_counter,
+                storage_class=storage_class,
+                checksum_algorithm=CHECKSUM_ALGORITHM if checksum_sha256 else None,
+                hash_on_upload=hash_on_upload,
+                writer=writer,
+                results_index=results_index,
+                remote_listing=RemoteListing(s3_client, self.bucket) if preflight else None,
+                upload_responses=UploadResponseCapture.for_client(s3_client),
+                verify_executor=verify_executor,
+                verify_policy=verify_policy,
+                verify_sample_rate=verify_sample_rate,
+                json_log=json_log
+            )
+            # Bound the number of submitted-but-unfinished assets, so that
+            # only a window of the batch is queued up in the executor
+            slots = threading.BoundedSemaphore(max_assets * 2)
+            with ThreadPoolExecutor(max_workers=max_assets, thread_name_prefix='deposit') as executor:
+                def submit(function, *args):
+                    slots.acquire()
+                    future = executor.submit(function, *args)
+                    future.add_done_callback(lambda f: slots.release())
 
-                # Check if ETAG exists
-                if asset.etag is not None and asset.etag != '':
-                    expected_etag = asset.etag
-                else:
-                    expected_etag = asset.calculate_etag(chunk_size=chunk_bytes)
-
-                # Prepare custom metadata to attach to the asset
-                asset.extra_args = {
-                    'StorageClass': storage_class,
-                    'Metadata': {
-                        'md5': asset.md5,
-                        'bytes': str(asset.bytes)
-                    }
-                }
-
-                # Display Asset information to the user
-                sys.stdout.write(
-                    f'\n{header}\n{"=" * len(header)}\n'
-                    f'    FILE: {asset.local_path}\n'
-                    f' KEYPATH: {key_path}\n'
-                    f'     EXT: {asset.extension}\n'
-                    f'   MTIME: {asset.mtime}\n'
-                    f'   BYTES: {asset.bytes}\n'
-                    f'     MD5: {asset.md5}\n'
-                    f'    ETAG: {expected_etag}\n\n'
-                )
+                for n, asset in enumerate(assets, 1):
+                    if streaming:
+                        progress.add_expected(1, asset.bytes)
+                    if packer is not None and packer.accepts(asset):
+                        container = packer.add(n, asset, self.get_key_prefix(asset), asset.relpath,
+                                               self.get_key_path(asset))
+                        if container is not None:
+                            submit(self.deposit_container, container, deposit_context)
+                    else:
+                        submit(self.deposit_asset, n, asset, deposit_context)
+                if packer is not None:
+                    for container in packer.flush():
+                        submit(self.deposit_container, container, deposit_context)
 
-                # Send the file, optionally in multipart, multithreaded mode
-                progress_tracker = ProgressPercentage(asset, self)
-                self.stats['assets_transmitted'] += 1
-                try:
+        if results_file is not None:
+            results_file.close()
+            results_index.close()
+        self.stats['asset_bytes_transmitted'] += bytes_counter.value
+        self._bytes_counter = None
+        if tracer is not None:
+            tracer.unregister(s3_client)
+            self.write_trace(tracer)
+        if owns_progress:
+            progress.stop()
+
+        end = datetime.now()
+        self.stats['deposit_end'] = end.isoformat()
+        self.stats['deposit_time'] = (end - begin).total_seconds()
+        self.stats.update(self.metrics.stats())
+
+    def write_trace(self, tracer):
+        """
+        Write the summary of the traced requests to the log directory, and
+        display it.
+        """
+        trace_filename = os.path.join(self.log_dir, TRACE_FILENAME)
+        tracer.write(trace_filename)
+        lines = [f'\nS3 requests (see {trace_filename}):\n']
+        for name, summary in tracer.summary().items():
+            lines.append(
+                f"  {name}: {summary['calls']} calls, {summary['errors']} errors, {summary['retries']} retries, "
+                f"{summary['throttles']} throttled, p50 {summary['latency']['p50']}s, "
+                f"p99 {summary['latency']['p99']}s\n"
+            )
+        sys.stdout.write(''.join(lines))
+
+    @property
+    def label(self):
+        """
+        Name identifying the batch in metrics.
+        """
+        return self.overridden_name or os.path.basename(os.path.normpath(self.manifest.manifest_path))
+
+    def current_stats(self):
+        """
+        Returns a copy of the batch stats, including the bytes sent and the
+        phase metrics so far, while a deposit is running.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        bytes_counter = self._bytes_counter
+        if bytes_counter is not None:
+            stats['asset_bytes_transmitted'] += bytes_counter.value
+        stats.update(self.metrics.stats())
+        return stats
+
+    def increment_stat(self, name, amount=1):
+        """
+        Thread-safe update of one of the batch statistics counters.
+        """
+        with self._lock:
+            self.stats[name] += amount
+
+    def upload_and_hash(self, s3_client, asset, key_path, part_size, threads, extra_args, context, progress_tracker):
+        """
+        Upload the asset through a HashingReader, and return the AssetDigest of
+        the bytes that were sent. Falls back to reading the file again if the
+        uploader did not read it exactly once from start to end.
+        """
+        with open(asset.local_path, 'rb') as handle:
+            reader = HashingReader(handle, DigestBuilder(part_size))
+            s3_client.upload_fileobj(
+                reader,
+                self.bucket,
+                key_path,
+                ExtraArgs=extra_args,
+                Config=context.part_sizing.transfer_config(part_size, threads),
+                Callback=progress_tracker
+            )
+        digest = reader.result(expected_size=asset.bytes)
+        if digest is None:
+            digest = digest_asset(asset, part_size, self.metrics)
+        return digest
+
+    def get_key_prefix(self, asset):
+        """
+        Returns the part of the S3 key for the given asset before its relpath.
+        """
+        if self.overridden_name is not None:
+            key_prefix = self.overridden_name
+        elif asset.batch_name is not None and asset.batch_name != '':
+            key_prefix = asset.batch_name
+        else:
+            key_prefix = self.manifest.manifest_path
+        if key_prefix not in self._key_prefixes:
+            with self._lock:
+                self._key_prefixes.add(key_prefix)
+        return key_prefix
+
+    def owns_key(self, bucket, key):
+        """
+        True if the key (or key prefix) in the bucket is below the key prefix
+        of an asset of the batch, so that the requests of a batch can be told
+        apart from those of other batches using the same S3 client.
+        """
+        if bucket != self.bucket:
+            return False
+        with self._lock:
+            key_prefixes = tuple(self._key_prefixes)
+        return any(key.startswith(f'{key_prefix}/') for key_prefix in key_prefixes)
+
+    def get_key_path(self, asset):
+        """
+        Returns the S3 key for the given asset.
+        """
+        return f'{self.get_key_prefix(asset)}/{asset.relpath}'
+
+    def deposit_asset(self, n, asset, context):
+        """
+        Transfer a single asset and verify it, recording the outcome in the
+        batch stats and log files. Called concurrently from the deposit workers.
+        """
+        try:
+            self._deposit_asset(n, asset, context)
+        except Exception as e:
+            self.increment_stat('failed_deposits')
+            # Forget the response to an upload that completed before the error
+            context.upload_responses.pop(self.bucket, self.get_key_path(asset))
+            print(f'Unexpected error depositing {asset.local_path}: {e}', file=sys.stderr)
+            print('Continuing with the next asset', file=sys.stderr)
+        finally:
+            context.progress.asset_done(asset)
+
+    def _deposit_asset(self, n, asset, context):
+        s3_client = context.s3_client
+        header = f'({n}) {asset.filename.upper()}'
+        key_path = self.get_key_path(asset)
+
+        part_size = context.part_sizing.part_size(asset.bytes)
+        if -(-asset.bytes // part_size) > MAX_PARTS:
+            self.increment_stat('failed_deposits')
+            print(f'Cannot upload {asset.local_path} in at most {MAX_PARTS} parts of {part_size} bytes; '
+                  f'use a larger chunk size', file=sys.stderr)
+            print('Continuing with the next asset', file=sys.stderr)
+            return
+
+        # Check if ETAG exists; otherwise calculate it in the same pass over
+        # the file as the MD5, if that is not known either. When hashing on
+        # upload, the calculation is deferred until the file has been sent.
+        known_etag = context.part_sizing.known_etag(asset)
+        if known_etag is not None:
+            expected_etag = known_etag
+            hash_on_upload = False
+        elif context.hash_on_upload:
+            expected_etag = None
+            hash_on_upload = True
+        else:
+            expected_etag = digest_asset(asset, part_size, self.metrics).etag
+            hash_on_upload = False
+
+        # Skip assets that are already in the bucket with the expected ETag
+        if context.remote_listing is not None:
+            remote = context.remote_listing.get(self.get_key_prefix(asset), key_path)
+            if remote is not None and remote[0] == asset.bytes:
+                if expected_etag is None:
+                    expected_etag = digest_asset(asset, part_size, self.metrics).etag
+                if remote[1] == expected_etag:
+                    self.increment_stat('assets_skipped')
+                    sys.stdout.write(f'\n{header}\n  {self.bucket}/{key_path} already exists with ETag '
+                                     f'{expected_etag}, skipping\n')
+                    self.write_result(n, asset, key_path, remote[1], part_size, 'skipped', context)
+                    return
+
+        # Prepare custom metadata to attach to the asset; when hashing on
+        # upload, the MD5 can only be included if it was provided
+        metadata = {'bytes': str(asset.bytes)}
+        if not hash_on_upload or asset.md5_known:
+            metadata['md5'] = asset.md5
+        extra_args = {
+            'StorageClass': context.storage_class,
+            'Metadata': metadata
+        }
+        if context.checksum_algorithm is not None:
+            extra_args['ChecksumAlgorithm'] = context.checksum_algorithm
+
+        # Display Asset information to the user
+        sys.stdout.write(
+            f'\n{header}\n{"=" * len(header)}\n'
+            f'    FILE: {asset.local_path}\n'
+            f' KEYPATH: {key_path}\n'
+            f'     EXT: {asset.extension}\n'
+            f'   MTIME: {asset.mtime}\n'
+            f'   BYTES: {asset.bytes}\n'
+            f'     MD5: {metadata.get("md5", "(calculated on upload)")}\n'
+            f'    ETAG: {expected_etag or "(calculated on upload)"}\n'
+            f'PARTSIZE: {part_size}\n\n'
+        )
+
+        # Send the file, optionally in multipart, multithreaded mode
+        progress_tracker = UploadCallback(context.bytes_counter, context.limiters)
+        upload_threads = context.part_sizing.upload_threads(asset.bytes, part_size)
+        try:
+            # Wait for the upload threads and bytes to be available, when the
+            # budget is shared with other deposits
+            with context.budget.reserve(upload_threads, asset.bytes) as threads, \
+                    context.progress.uploading(asset), self.metrics.timed(PHASE_UPLOAD, asset.bytes):
+                self.increment_stat('assets_transmitted')
+                if hash_on_upload:
+                    digest = self.upload_and_hash(
+                        s3_client, asset, key_path, part_size, threads, extra_args, context, progress_tracker
+                    )
+                else:
                     s3_client.upload_file(
                         asset.local_path,
                         self.bucket,
                         key_path,
-                        ExtraArgs=asset.extra_args,
-                        Config=aws_config,
+                        ExtraArgs=extra_args,
+                        Config=context.part_sizing.transfer_config(part_size, threads),
                         Callback=progress_tracker
                     )
-                except S3UploadFailedError as e:
-                    self.stats['failed_deposits'] += 1
-                    print(e, file=sys.stderr)
-                    print('Continuing with the next asset', file=sys.stderr)
-                    return
+        except S3UploadFailedError as e:
+            self.increment_stat('failed_deposits')
+            context.upload_responses.pop(self.bucket, key_path)
+            print(e, file=sys.stderr)
+            print('Continuing with the next asset', file=sys.stderr)
+            return
 
-                # Validate the upload with a head request to get the remote Etag
-                sys.stdout.write('\n\n  Upload complete! Verifying...\n')
-                try:
-                    response = s3_client.head_object(Bucket=self.bucket, Key=key_path)
-                except ClientError as e:
-                    self.stats['failed_deposits'] += 1
-                    print(f'Error verifying {self.bucket}/{key_path}: {e}', file=sys.stderr)
-                    print('Continuing with the next asset', file=sys.stderr)
-                    return
+        sys.stdout.write(f'\n\n  Upload of {key_path} complete!\n')
+        fixity_error = False
+        if hash_on_upload:
+            expected_etag = digest.etag
+            if asset.md5_known and asset.md5 != digest.md5:
+                # The bytes that were sent do not match the manifest
+                fixity_error = True
+                print(f'MD5 mismatch for {asset.local_path}: expected {asset.md5}, read {digest.md5}',
+                      file=sys.stderr)
+            asset.digest = digest
+            asset.md5 = asset.md5 if asset.md5_known else digest.md5
+
+        # Hand the asset over to the verification stage, so that this worker
+        # can move on to the next upload
+        upload_response = context.upload_responses.pop(self.bucket, key_path)
+        context.verify_executor.submit(
+            self.verify_asset, n, asset, key_path, expected_etag, part_size, fixity_error, upload_response, context
+        )
 
-                # Write response metadata to a line-oriented JSON file
-                # See also: http://jsonlines.org/
-                json.dump(
-                    {'asset': f'{self.bucket}/{key_path}', 'response': response['ResponseMetadata']},
-                    json_log
+    def verify_asset(self, n, asset, key_path, expected_etag, part_size, fixity_error, upload_response, context):
+        """
+        Verify an uploaded asset against the ETag from the response to the
+        upload, or from a HEAD request, according to the verification policy,
+        and record the outcome. Called concurrently from the verify workers.
+        """
+        try:
+            with self.metrics.timed(PHASE_VERIFY):
+                self._verify_asset(
+                    n, asset, key_path, expected_etag, part_size, fixity_error, upload_response, context
                 )
-                json_log.write('\n')
+        except Exception as e:
+            self.increment_stat('failed_deposits')
+            print(f'Unexpected error verifying {self.bucket}/{key_path}: {e}', file=sys.stderr)
 
-                # Pull the AWS etag from the response and strip quotes
-                headers = response['ResponseMetadata']['HTTPHeaders']
-                remote_etag = headers['etag'].replace('"', '')
-                sys.stdout.write(f'    -> Local:  {expected_etag}\n')
-                sys.stdout.write(f'    -> Remote: {remote_etag}\n\n')
+    def _verify_asset(self, n, asset, key_path, expected_etag, part_size, fixity_error, upload_response, context):
+        if needs_head_request(context.verify_policy, context.verify_sample_rate, upload_response):
+            # Validate the upload with a head request to get the remote Etag
+            try:
+                response = context.s3_client.head_object(Bucket=self.bucket, Key=key_path)
+            except ClientError as e:
+                self.increment_stat('failed_deposits')
+                print(f'Error verifying {self.bucket}/{key_path}: {e}', file=sys.stderr)
+                return
+            self.increment_stat('head_requests')
+            remote_etag = response['ResponseMetadata']['HTTPHeaders']['etag']
+            verified_by = VERIFY_HEAD
+        else:
+            response = upload_response
+            remote_etag = upload_response['ETag']
+            verified_by = VERIFY_RESPONSE
 
-                if dry_run:
-                    expected_etag = remote_etag
+        # Strip the quotes from the AWS etag
+        remote_etag = remote_etag.replace('"', '')
 
-                if remote_etag == expected_etag:
-                    self.stats['successful_deposits'] += 1
-                    sys.stdout.write(f'  ETag match! Transfer success!\n')
-                    result = 'success'
-                else:
-                    self.stats['failed_deposits'] += 1
-                    sys.stdout.write(f'  Something went wrong.\n')
-                    result = 'failed'
-
-                row = {
-                    'ID': n,
-                    'KEYPATH': key_path,
-                    'ETAG': remote_etag,
-                    'RESULT': result,
-                    'STORAGEPROVIDER': 'AWS',
-                    'STORAGELOCATION': f'{self.bucket}/{key_path}'
-                }
-                if asset.manifest_row:
-                    row.update(asset.manifest_row)
-
-                if writer is not None:
-                    writer.writerow(row)
+        if remote_etag == expected_etag and not fixity_error:
+            self.increment_stat('successful_deposits')
+            result = 'success'
+        else:
+            self.increment_stat('failed_deposits')
+            result = 'failed'
 
-        if results_file is not None:
-            results_file.close()
+        # Report the verification as a single write, so that the output of
+        # concurrent workers does not get interleaved
+        sys.stdout.write(
+            f'\n  Verified {key_path} (by {verified_by}):\n'
+            f'    -> Local:  {expected_etag}\n'
+            f'    -> Remote: {remote_etag}\n\n' +
+            (f'  ETag match! Transfer success!\n' if result == 'success' else f'  Something went wrong.\n')
+        )
 
-        end = datetime.now()
-        self.stats['deposit_end'] = end.isoformat()
-        self.stats['deposit_time'] = (end - begin).total_seconds()
+        self.write_result(
+            n, asset, key_path, remote_etag, part_size, result, context, response.get('ResponseMetadata', {}),
+            verified_by
+        )
+
+    def deposit_container(self, container, context):
+        """
+        Upload a container of packed assets and verify it, recording the
+        outcome for each of its members. Called concurrently from the deposit
+        workers.
+        """
+        try:
+            self._deposit_container(container, context)
+        except Exception as e:
+            self.increment_stat('failed_deposits', len(container.members))
+            print(f'Unexpected error depositing container {container.key_path}: {e}', file=sys.stderr)
+            print('Continuing with the next asset', file=sys.stderr)
+        finally:
+            for member in container.members:
+                context.progress.asset_done(member.asset)
+
+    def _deposit_container(self, container, context):
+        key_path = container.key_path
+        part_size = context.part_sizing.container_part_size(container.bytes)
+        header = f'({container.members[0].n}-{container.members[-1].n}) {container.filename.upper()}'
+        sys.stdout.write(
+            f'\n{header}\n{"=" * len(header)}\n'
+            f' KEYPATH: {key_path}\n'
+            f' MEMBERS: {len(container.members)}\n'
+            f'   BYTES: {container.bytes}\n'
+            f'PARTSIZE: {part_size}\n\n'
+        )
+        extra_args = {
+            'StorageClass': context.storage_class,
+            'Metadata': {'bytes': str(container.bytes), 'members': str(len(container.members))}
+        }
+        if context.checksum_algorithm is not None:
+            extra_args['ChecksumAlgorithm'] = context.checksum_algorithm
+
+        # The tar file is generated as it is sent, and hashed on the way
+        reader = container.open(part_size)
+        progress_tracker = UploadCallback(context.bytes_counter, context.limiters)
+        upload_threads = context.part_sizing.upload_threads(container.bytes, part_size)
+        try:
+            with context.budget.reserve(upload_threads, container.bytes) as threads, \
+                    context.progress.uploading(container), self.metrics.timed(PHASE_UPLOAD, container.bytes):
+                self.increment_stat('assets_transmitted', len(container.members))
+                context.s3_client.upload_fileobj(
+                    reader,
+                    self.bucket,
+                    key_path,
+                    ExtraArgs=extra_args,
+                    Config=context.part_sizing.transfer_config(part_size, threads),
+                    Callback=progress_tracker
+                )
+        except S3UploadFailedError as e:
+            self.increment_stat('failed_deposits', len(container.members))
+            context.upload_responses.pop(self.bucket, key_path)
+            print(e, file=sys.stderr)
+            print('Continuing with the next asset', file=sys.stderr)
+            return
+
+        sys.stdout.write(f'\n\n  Upload of {key_path} complete!\n')
+        for member in container.members:
+            asset = member.asset
+            if asset.md5_known and asset.md5 != member.md5 and member.error is None:
+                member.error = f'MD5 mismatch for {asset.local_path}: expected {asset.md5}, read {member.md5}'
+            if member.error is not None:
+                print(member.error, file=sys.stderr)
+            if not asset.md5_known:
+                asset.md5 = member.md5
+
+        upload_response = context.upload_responses.pop(self.bucket, key_path)
+        context.verify_executor.submit(
+            self.verify_container, container, reader.result().etag, part_size, upload_response, context
+        )
+
+    def verify_container(self, container, expected_etag, part_size, upload_response, context):
+        """
+        Verify an uploaded container like an asset (see "verify_asset"), and
+        record the outcome for each of its members. Called concurrently from
+        the verify workers.
+        """
+        try:
+            with self.metrics.timed(PHASE_VERIFY):
+                self._verify_container(container, expected_etag, part_size, upload_response, context)
+        except Exception as e:
+            self.increment_stat('failed_deposits', len(container.members))
+            print(f'Unexpected error verifying {self.bucket}/{container.key_path}: {e}', file=sys.stderr)
+
+    def _verify_container(self, container, expected_etag, part_size, upload_response, context):
+        key_path = container.key_path
+        if needs_head_request(context.verify_policy, context.verify_sample_rate, upload_response):
+            try:
+                response = context.s3_client.head_object(Bucket=self.bucket, Key=key_path)
+            except ClientError as e:
+                self.increment_stat('failed_deposits', len(container.members))
+                print(f'Error verifying {self.bucket}/{key_path}: {e}', file=sys.stderr)
+                return
+            self.increment_stat('head_requests')
+            remote_etag = response['ResponseMetadata']['HTTPHeaders']['etag']
+            verified_by = VERIFY_HEAD
+        else:
+            response = upload_response
+            remote_etag = upload_response['ETag']
+            verified_by = VERIFY_RESPONSE
+        remote_etag = remote_etag.replace('"', '')
+
+        failed = sum(1 for member in container.members if remote_etag != expected_etag or member.error)
+        self.increment_stat('successful_deposits', len(container.members) - failed)
+        self.increment_stat('failed_deposits', failed)
+        sys.stdout.write(
+            f'\n  Verified {key_path} (by {verified_by}):\n'
+            f'    -> Local:  {expected_etag}\n'
+            f'    -> Remote: {remote_etag}\n\n' +
+            (f'  ETag match! Transfer success!\n' if remote_etag == expected_etag else f'  Something went wrong.\n') +
+            (f'  {failed} of {len(container.members)} packed assets failed\n' if failed else '')
+        )
+
+        with self._lock:
+            self.log_response(key_path, response.get('ResponseMetadata', {}), verified_by, context)
+        for member in container.members:
+            result = 'success' if remote_etag == expected_etag and not member.error else 'failed'
+            self.write_result(member.n, member.asset, member.key_path, remote_etag, part_size, result, context,
+                              pack_index=member.index(key_path))
+
+    def log_response(self, key_path, response_metadata, verified_by, context):
+        """
+        Write the response metadata for an object to the line-oriented JSON
+        log (see http://jsonlines.org/). Must be called holding the batch lock.
+        """
+        entry = {'asset': f'{self.bucket}/{key_path}', 'response': response_metadata}
+        if verified_by is not None:
+            entry['verified_by'] = verified_by
+        json.dump(entry, context.json_log)
+        context.json_log.write('\n')
+
+    def write_result(self, n, asset, key_path, etag, part_size, result, context, response_metadata=None,
+                     verified_by=None, pack_index=None):
+        """
+        Record the outcome for an asset in the results file and, if there was
+        a response from S3, in the JSON log, along with the kind of request
+        (verified_by) it was a response to. For a packed asset, pack_index
+        gives its location in its container, which is also its storage
+        location.
+        """
+        row = {
+            'ID': n,
+            'KEYPATH': key_path,
+            'ETAG': etag,
+            'PARTSIZE': part_size,
+            'RESULT': result,
+            'STORAGEPROVIDER': 'AWS',
+            'STORAGELOCATION': f'{self.bucket}/{key_path}'
+        }
+        if pack_index is not None:
+            row.update(pack_index)
+            row['STORAGELOCATION'] = f'{self.bucket}/{pack_index["CONTAINER"]}'
+        if asset.manifest_row:
+            row.update(asset.manifest_row)
+
+        with self._lock:
+            if response_metadata is not None:
+                self.log_response(key_path, response_metadata, verified_by, context)
+
+            if context.writer is not None:
+                context.writer.writerow(row)
+                context.results_index.add(asset.md5, asset.local_path)
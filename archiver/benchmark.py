@@ -0,0 +1,348 @@
+"""
+Benchmarks of hashing, manifest loading, and deposits, run against synthetic
+trees of files:
+
+* "small": many small files
+* "huge": a few large files
+* "sparse": a few large files that are mostly holes
+
+Deposits are made to a local stand-in for S3 (see archiver.fake_s3), so the
+deposit benchmarks measure the archiver's own overhead, not the network.
+
+The results are written as JSON, and can be compared with the results of an
+earlier run, to catch regressions between releases:
+
+    python -m archiver.benchmark -o baseline.json
+    python -m archiver.benchmark -o current.json --compare baseline.json
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from . import version
+from .asset import Asset, MB, READ_BLOCK_SIZE
+from .batch import Batch
+from .fake_s3 import FakeS3
+from .manifests.manifest_factory import ManifestFactory
+from .progress import PROGRESS_QUIET, ProgressReporter
+
+# Number of files and file size in each synthetic tree, at a scale of 1
+TREES = {
+    'small': (2000, 16 * 1024),
+    'huge': (2, 256 * MB),
+    'sparse': (2, 512 * MB),
+}
+
+# The manifest formats recognized by ManifestFactory
+MANIFEST_FORMATS = ('inventory', 'md5sum', 'patsy')
+
+BENCHMARKS = ('md5', 'etag', 'manifest', 'deposit')
+
+DEFAULT_CHUNK_SIZE = '16MB'
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.25
+
+BUCKET = 'benchmark'
+
+
+class SyntheticFile:
+    __slots__ = ('path', 'relpath', 'size', 'md5')
+
+    def __init__(self, path, relpath, size, md5):
+        self.path = path
+        self.relpath = relpath
+        self.size = size
+        self.md5 = md5
+
+
+def generate_tree(root, name, count, size):
+    """
+    Write a tree of "count" files of "size" bytes under root/name, and return
+    a list of SyntheticFile. The files of the "sparse" tree only have data in
+    their first and last MB.
+    """
+    tree_dir = os.path.join(root, name)
+    block = os.urandom(MB)
+    files = []
+    for n in range(count):
+        # Spread the files over subdirectories, as in a real collection
+        relpath = os.path.join(f'dir{n // 1000:03}', f'file{n:06}.bin')
+        path = os.path.join(tree_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        md5 = hashlib.md5()
+        with open(path, 'wb') as handle:
+            if name == 'sparse':
+                write_sparse(handle, size, block, md5)
+            else:
+                # Vary the data between files, so that they have different MD5s
+                header = n.to_bytes(8, 'big')
+                remaining = size
+                while remaining > 0:
+                    data = (header + block)[:remaining]
+                    handle.write(data)
+                    md5.update(data)
+                    remaining -= len(data)
+        files.append(SyntheticFile(path, relpath, size, md5.hexdigest()))
+    return files
+
+
+def write_sparse(handle, size, block, md5):
+    head = block[:min(size, MB)]
+    tail = block[:min(size - len(head), MB)]
+    hole = size - len(head) - len(tail)
+    handle.write(head)
+    handle.seek(hole, os.SEEK_CUR)
+    handle.write(tail)
+    md5.update(head)
+    zeros = bytes(MB)
+    while hole > 0:
+        md5.update(zeros[:hole])
+        hole -= MB
+    md5.update(tail)
+
+
+def write_manifest(path, manifest_format, files):
+    """
+    Write a manifest listing the files, in one of MANIFEST_FORMATS.
+    """
+    with open(path, 'w', newline='') as manifest_file:
+        if manifest_format == 'md5sum':
+            for synthetic_file in files:
+                manifest_file.write(f'{synthetic_file.md5}  {synthetic_file.path}\n')
+        elif manifest_format == 'patsy':
+            writer = csv.writer(manifest_file)
+            writer.writerow(['md5', 'filepath', 'relpath'])
+            for synthetic_file in files:
+                writer.writerow([synthetic_file.md5, synthetic_file.path, synthetic_file.relpath])
+        else:
+            writer = csv.writer(manifest_file)
+            writer.writerow(['BATCH', 'PATH', 'DIRECTORY', 'RELPATH', 'FILENAME', 'EXTENSION', 'BYTES', 'MTIME',
+                             'MODDATE', 'MD5', 'SHA1', 'SHA256'])
+            for synthetic_file in files:
+                writer.writerow([
+                    'BENCHMARK', synthetic_file.path, os.path.dirname(synthetic_file.path), synthetic_file.relpath,
+                    os.path.basename(synthetic_file.path), 'BIN', synthetic_file.size, 0, '', synthetic_file.md5,
+                    '', ''
+                ])
+
+
+def best_of(repeat, function):
+    """
+    Run the function "repeat" times, and return the shortest time taken.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def result(benchmark, case, seconds, files):
+    nbytes = sum(synthetic_file.size for synthetic_file in files)
+    return {
+        'benchmark': benchmark,
+        'case': case,
+        'seconds': round(seconds, 6),
+        'bytes': nbytes,
+        'files': len(files),
+        'throughput': round(nbytes / seconds) if seconds > 0 else None,
+        'files_per_second': round(len(files) / seconds, 1) if seconds > 0 else None,
+    }
+
+
+def benchmark_md5(files, repeat, block_size=None):
+    def run():
+        for synthetic_file in files:
+            Asset(synthetic_file.path).calculate_md5(block_size)
+    return best_of(repeat, run)
+
+
+def benchmark_etag(files, chunk_bytes, repeat, block_size=None):
+    def run():
+        for synthetic_file in files:
+            Asset(synthetic_file.path, md5=synthetic_file.md5).calculate_etag(chunk_bytes, block_size)
+    return best_of(repeat, run)
+
+
+def benchmark_manifest(work_dir, manifest_format, files, repeat):
+    manifest_dir = os.path.join(work_dir, f'manifest-{manifest_format}')
+    os.makedirs(manifest_dir, exist_ok=True)
+    manifest_filename = os.path.join(manifest_dir, 'manifest.csv')
+    write_manifest(manifest_filename, manifest_format, files)
+
+    def run():
+        manifest = ManifestFactory.create(manifest_filename)
+        batch = Batch(manifest, bucket=BUCKET, asset_root=os.path.dirname(files[0].path), name='benchmark')
+        manifest.load_manifest(batch.results_filename, batch)
+        if len(batch.contents) != len(files):
+            raise RuntimeError(f'{manifest_format} manifest loaded {len(batch.contents)} of {len(files)} assets')
+    return best_of(repeat, run)
+
+
+def benchmark_deposit(work_dir, tree_dir, name, files, chunk_size, threads, repeat):
+    deposit_dir = os.path.join(work_dir, f'deposit-{name}')
+    os.makedirs(deposit_dir, exist_ok=True)
+    manifest_filename = os.path.join(deposit_dir, 'manifest.txt')
+    write_manifest(manifest_filename, 'md5sum', files)
+    runs = []
+
+    def run():
+        # A new log directory for each run, so that no assets are skipped as
+        # already deposited
+        log_dir = f'logs{len(runs)}'
+        manifest = ManifestFactory.create(manifest_filename)
+        batch = Batch(manifest, bucket=BUCKET, asset_root=tree_dir, name=name, log_dir=log_dir)
+        manifest.load_manifest(batch.results_filename, batch)
+        s3_client = FakeS3().client()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            batch.deposit(
+                profile_name=None,
+                chunk_size=chunk_size,
+                max_threads=threads,
+                progress=ProgressReporter(PROGRESS_QUIET),
+                s3_client=s3_client,
+            )
+        runs.append(batch.stats)
+        if batch.stats['successful_deposits'] != len(files):
+            raise RuntimeError(f'{batch.stats["failed_deposits"]} of {len(files)} assets failed to deposit')
+    return best_of(repeat, run)
+
+
+def run_benchmarks(work_dir, scale=1.0, benchmarks=BENCHMARKS, chunk_size=DEFAULT_CHUNK_SIZE, threads=None,
+                   repeat=DEFAULT_REPEAT, read_block_size=None):
+    """
+    Generate the synthetic trees in work_dir, and return the results of the
+    benchmarks as a list of dicts, with the time taken by each (the shortest
+    of "repeat" runs), and the bytes and files processed. The hashing
+    benchmarks read the files in blocks of read_block_size bytes (by default,
+    archiver.asset.READ_BLOCK_SIZE).
+    """
+    chunk_bytes = int(chunk_size[:-2]) * MB
+    trees = {}
+    for name, (count, size) in TREES.items():
+        count = max(1, round(count * scale)) if name == 'small' else count
+        size = size if name == 'small' else max(MB, round(size * scale))
+        trees[name] = generate_tree(work_dir, name, count, size)
+
+    results = []
+    for name, files in trees.items():
+        if 'md5' in benchmarks:
+            results.append(result('md5', name, benchmark_md5(files, repeat, read_block_size), files))
+        if 'etag' in benchmarks:
+            results.append(result('etag', name, benchmark_etag(files, chunk_bytes, repeat, read_block_size), files))
+    if 'manifest' in benchmarks:
+        for manifest_format in MANIFEST_FORMATS:
+            seconds = benchmark_manifest(work_dir, manifest_format, trees['small'], repeat)
+            results.append(result('manifest', manifest_format, seconds, trees['small']))
+    if 'deposit' in benchmarks:
+        for name, files in trees.items():
+            seconds = benchmark_deposit(work_dir, os.path.join(work_dir, name), name, files, chunk_size, threads,
+                                        repeat)
+            results.append(result('deposit', name, seconds, files))
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns a list of messages for the results that are slower than the same
+    benchmark in the baseline by more than the tolerance (a fraction of the
+    baseline time).
+    """
+    baseline_seconds = {(entry['benchmark'], entry['case']): entry['seconds'] for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        previous = baseline_seconds.get((entry['benchmark'], entry['case']))
+        if previous and entry['seconds'] > previous * (1 + tolerance):
+            regressions.append(
+                f'{entry["benchmark"]}/{entry["case"]}: {entry["seconds"]:.3f}s, '
+                f'was {previous:.3f}s (+{(entry["seconds"] / previous - 1) * 100:.0f}%)'
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m archiver.benchmark',
+        description='Benchmark hashing, manifest loading and deposits against synthetic trees of files'
+    )
+    parser.add_argument('-o', '--output', help='File to write the results to, as JSON (default: stdout)')
+    parser.add_argument('-d', '--dir', help='Directory to create the synthetic trees in (default: a temporary '
+                                            'directory, which is removed afterwards)')
+    parser.add_argument('-s', '--scale', type=float, default=1.0,
+                        help='Factor applied to the number of small files and the size of the large files')
+    parser.add_argument('-b', '--benchmark', action='append', choices=BENCHMARKS, dest='benchmarks',
+                        help='Benchmark to run; may be repeated (default: all)')
+    parser.add_argument('-c', '--chunk', default=DEFAULT_CHUNK_SIZE,
+                        help=f'Chunk size for ETags and multipart uploads, in MB (default: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('-t', '--threads', type=int, help='Maximum number of upload threads for deposits')
+    parser.add_argument('--read-block-size', type=int,
+                        help=f'Size in KB of the blocks read by the hashing benchmarks '
+                             f'(default: {READ_BLOCK_SIZE // 1024})')
+    parser.add_argument('-r', '--repeat', type=int, default=DEFAULT_REPEAT,
+                        help=f'Number of runs of each benchmark, of which the fastest is reported '
+                             f'(default: {DEFAULT_REPEAT})')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='Results of an earlier run to compare with; the exit status is 1 if any benchmark is '
+                             'slower')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'Fraction by which a benchmark may be slower than the baseline '
+                             f'(default: {DEFAULT_TOLERANCE})')
+    args = parser.parse_args(argv)
+
+    if not args.chunk.endswith('MB'):
+        parser.error('The chunk size must be given in MB')
+
+    work_dir = args.dir if args.dir is not None else tempfile.mkdtemp(prefix='archiver-benchmark-')
+    try:
+        results = run_benchmarks(
+            work_dir,
+            scale=args.scale,
+            benchmarks=args.benchmarks or BENCHMARKS,
+            chunk_size=args.chunk,
+            threads=args.threads,
+            repeat=args.repeat,
+            read_block_size=args.read_block_size * 1024 if args.read_block_size else None,
+        )
+    finally:
+        if args.dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'version': version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'scale': args.scale,
+        'chunk_size': args.chunk,
+        'repeat': args.repeat,
+        'read_block_size': args.read_block_size * 1024 if args.read_block_size else READ_BLOCK_SIZE,
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
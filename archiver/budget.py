@@ -0,0 +1,50 @@
+import threading
+from contextlib import contextmanager
+
+
+class DepositBudget:
+    """
+    Global limits on the number of upload threads in use, and the number of
+    bytes being uploaded, shared by concurrent deposits. Either limit may be
+    None, meaning unlimited.
+
+    Instances may be shared between threads.
+    """
+
+    def __init__(self, max_threads=None, max_bytes=None):
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.threads_in_use = 0
+        self.bytes_in_flight = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, threads, nbytes):
+        """
+        Context manager that waits until the given number of threads and bytes
+        are available, and holds them until it exits. A request larger than a
+        limit is reduced to the limit, so that it can run on its own. Yields
+        the number of threads reserved, which the upload should not exceed.
+        """
+        if self.max_threads is not None:
+            threads = min(threads, self.max_threads)
+        if self.max_bytes is not None:
+            nbytes = min(nbytes, self.max_bytes)
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._fits(threads, nbytes))
+            self.threads_in_use += threads
+            self.bytes_in_flight += nbytes
+        try:
+            yield threads
+        finally:
+            with self._condition:
+                self.threads_in_use -= threads
+                self.bytes_in_flight -= nbytes
+                self._condition.notify_all()
+
+    def _fits(self, threads, nbytes):
+        return (
+            (self.max_threads is None or self.threads_in_use + threads <= self.max_threads) and
+            (self.max_bytes is None or self.bytes_in_flight + nbytes <= self.max_bytes)
+        )
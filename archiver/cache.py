@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import threading
+import time
+
+from .asset import AssetDigest
+
+# Default location of the hash cache, when enabled without a filename
+DEFAULT_HASH_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'aws-archiver', 'hashes.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    md5 TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parts (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    chunk_size INTEGER NOT NULL,
+    part_digests BLOB NOT NULL,
+    PRIMARY KEY (path, chunk_size)
+);
+'''
+
+
+class HashCache:
+    """
+    Persistent cache of file digests, stored in an SQLite database.
+
+    Entries are keyed by the absolute path of the file, and are only used if
+    the device, inode, size and modification time of the file still match the
+    values recorded when it was hashed; otherwise they are discarded. For each
+    file, the MD5 and the part digests for any number of chunk sizes are
+    stored, so that the ETag for each chunk size can be reconstructed.
+
+    Instances may be shared between threads.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or DEFAULT_HASH_CACHE
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.filename, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('PRAGMA foreign_keys=ON')
+        self._connection.executescript(SCHEMA)
+
+    def get(self, path, stat_result, chunk_size=None):
+        """
+        Return the cached AssetDigest of the file for the given chunk size, or
+        None if it is not cached or the file has changed since it was hashed.
+        """
+        path = os.path.abspath(path)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT device, inode, size, mtime_ns, md5 FROM files WHERE path = ?', (path,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[:4] != stat_identity(stat_result):
+                self._connection.execute('DELETE FROM files WHERE path = ?', (path,))
+                return None
+
+            md5 = row[4]
+            part_digests = []
+            if chunk_size is not None:
+                parts = self._connection.execute(
+                    'SELECT part_digests FROM parts WHERE path = ? AND chunk_size = ?', (path, chunk_size)
+                ).fetchone()
+                if parts is not None:
+                    part_digests = split_digests(parts[0])
+                elif stat_result.st_size >= chunk_size:
+                    return None
+
+            self._connection.execute('UPDATE files SET last_used = ? WHERE path = ?', (time.time(), path))
+        return AssetDigest(chunk_size, stat_result.st_size, md5, part_digests)
+
+    def put(self, path, stat_result, digest):
+        """
+        Store the digest of the file, as it was when stat_result was taken.
+        """
+        path = os.path.abspath(path)
+        identity = stat_identity(stat_result)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT device, inode, size, mtime_ns, md5 FROM files WHERE path = ?', (path,)
+            ).fetchone()
+            if row is None or row != (*identity, digest.md5):
+                self._connection.execute('DELETE FROM files WHERE path = ?', (path,))
+                self._connection.execute(
+                    'INSERT INTO files (path, device, inode, size, mtime_ns, md5, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (path, *identity, digest.md5, time.time())
+                )
+            if digest.chunk_size is not None and digest.part_digests:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO parts (path, chunk_size, part_digests) VALUES (?, ?, ?)',
+                    (path, digest.chunk_size, b''.join(digest.part_digests))
+                )
+
+    def prune(self, max_age=None, remove_missing=False):
+        """
+        Remove entries not used within the last max_age seconds and, if
+        remove_missing is True, entries for files that no longer exist.
+        Returns the number of files removed from the cache.
+        """
+        removed = 0
+        with self._lock, self._connection:
+            if max_age is not None:
+                cursor = self._connection.execute('DELETE FROM files WHERE last_used < ?', (time.time() - max_age,))
+                removed += cursor.rowcount
+            if remove_missing:
+                paths = [row[0] for row in self._connection.execute('SELECT path FROM files')]
+                missing = [(path,) for path in paths if not os.path.exists(path)]
+                self._connection.executemany('DELETE FROM files WHERE path = ?', missing)
+                removed += len(missing)
+        with self._lock:
+            self._connection.execute('VACUUM')
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def stat_identity(stat_result):
+    """
+    Return the values from an os.stat() result that identify a version of a file.
+    """
+    return stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+def split_digests(data, digest_size=16):
+    return [data[i:i + digest_size] for i in range(0, len(data), digest_size)]
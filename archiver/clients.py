@@ -0,0 +1,78 @@
+import sys
+import threading
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ProfileNotFound
+
+from .exceptions import FailureException
+
+# The size of the connection pool of a botocore client, unless configured
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_TCP_KEEPALIVE = True
+
+# Connections added to a pool beyond the requests expected at once, for
+# requests made outside of the worker threads, such as preflight listings
+POOL_HEADROOM = 2
+
+
+def connections_needed(upload_threads, other_threads=0, max_upload_threads=None):
+    """
+    Returns the size of the connection pool for a run making up to
+    upload_threads upload requests at once (no more than max_upload_threads,
+    if given, as when a DepositBudget limits them), and other_threads other
+    requests, such as HEAD requests verifying uploads.
+    """
+    if max_upload_threads is not None:
+        upload_threads = min(upload_threads, max_upload_threads)
+    return max(DEFAULT_POOL_CONNECTIONS, upload_threads + other_threads + POOL_HEADROOM)
+
+
+class S3ClientFactory:
+    """
+    Creates the S3 client of a run, once, on first use, and then returns the
+    same client, so that the session and credentials are set up only once,
+    and connections are reused by all the batches of the run. boto3 clients
+    may be shared between threads, but sessions may not, so the session is
+    only used to create the client.
+
+    The client's connection pool holds max_pool_connections connections (see
+    "connections_needed"), so that requests do not wait for a connection
+    when many assets and parts are uploaded at once. With tcp_keepalive, TCP
+    keep-alive packets are sent on idle connections, so that they are not
+    dropped by firewalls during long uploads.
+
+    If a FakeS3 is given, the client's requests are answered by it, and no
+    AWS profile is used.
+
+    Instances may be shared between threads.
+    """
+
+    def __init__(self, profile_name=None, max_pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 tcp_keepalive=DEFAULT_TCP_KEEPALIVE, fake_s3=None):
+        self.profile_name = profile_name
+        self.max_pool_connections = max_pool_connections
+        self.tcp_keepalive = tcp_keepalive
+        self.fake_s3 = fake_s3
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return Config(max_pool_connections=self.max_pool_connections, tcp_keepalive=self.tcp_keepalive)
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._create_client()
+            return self._client
+
+    def _create_client(self):
+        if self.fake_s3 is not None:
+            return self.fake_s3.client(self.config)
+        try:
+            session = boto3.session.Session(profile_name=self.profile_name)
+        except ProfileNotFound as e:
+            print(e, file=sys.stderr)
+            raise FailureException from e
+        return session.client('s3', config=self.config)
@@ -1,13 +1,27 @@
 import csv
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
 import yaml
 
-from .batch import Batch, DEFAULT_MANIFEST_FILENAME
+from .batch import (
+    Batch, PartSizing, calculate_chunk_bytes, DEFAULT_CHUNK_SIZE, DEFAULT_HASH_WORKERS, DEFAULT_MANIFEST_FILENAME,
+    DEFAULT_MAX_ASSETS, DEFAULT_MAX_THREADS, DEFAULT_TARGET_PARTS
+)
+from .bandwidth import BandwidthGovernor
+from .budget import DepositBudget
+from .clients import DEFAULT_TCP_KEEPALIVE, S3ClientFactory, connections_needed
+from .metrics import MetricsExporter, STATS_FIELDS as METRICS_FIELDS
+from .progress import ProgressReporter
+from .cache import HashCache
 from .exceptions import ConfigException, FailureException
+from .fake_s3 import FakeS3
 from .manifests.manifest_factory import ManifestFactory
-from .utils import get_first_line
+from .utils import get_csv_fieldnames, get_first_line
+from .verify import DEFAULT_VERIFY_THREADS
 
 
 def check_etag(manifest_filename: str) -> bool:
@@ -25,23 +39,56 @@ def check_etag(manifest_filename: str) -> bool:
     return False
 
 
+def create_fake_s3(args):
+    """
+    Returns the FakeS3 for a dry run, or None if this is not a dry run.
+    """
+    if not args.dry_run:
+        return None
+    return FakeS3.from_config(
+        root=args.dry_run_dir, latency=args.dry_run_latency, bandwidth=args.dry_run_bandwidth,
+        error_rate=args.dry_run_error_rate
+    )
+
+
 def deposit(args):
     """Deposit a set of files into AWS."""
+    hash_cache = HashCache(args.hash_cache) if args.hash_cache else None
+    with hash_cache or nullcontext():
+        _deposit(args, hash_cache)
+
+
+def _deposit(args, hash_cache):
     try:
         load_single_asset = args.mapfile is None
         manifest = ManifestFactory.create(args.mapfile)
         etag_exists = check_etag(args.mapfile)
+        governor = BandwidthGovernor.from_config(
+            args.max_bandwidth, args.bandwidth_schedule, args.bandwidth_control_file
+        )
+        if governor is not None:
+            governor.install_signal_handler()
+        client_factory = S3ClientFactory(
+            args.profile,
+            max_pool_connections=connections_needed(args.max_assets * args.threads, args.verify_threads),
+            tcp_keepalive=args.tcp_keepalive,
+            fake_s3=create_fake_s3(args)
+        )
 
         batch = Batch(
             manifest,
             name=args.name,
             bucket=args.bucket,
             asset_root=args.root,
-            log_dir=args.logs
+            log_dir=args.logs,
+            hash_cache=hash_cache
         )
 
+        assets = None
         if load_single_asset:
             batch.add_asset(args.asset)
+        elif args.stream:
+            assets = batch.stream_manifest(etag_exists=etag_exists)
         else:
             manifest.load_manifest(batch.results_filename, batch, etag_exists=etag_exists)
 
@@ -49,66 +96,254 @@ def deposit(args):
         print(e, file=sys.stderr)
         raise FailureException from e
 
-    # Do the actual deposit to AWS
-    batch.deposit(
-        profile_name=args.profile,
-        chunk_size=args.chunk,
-        storage_class=args.storage,
-        max_threads=args.threads,
-        dry_run=args.dry_run
-    )
+    # Do the actual deposit to AWS; the progress reporter is started by the
+    # deposit, once the assets are ready
+    progress = ProgressReporter(args.progress)
+    exporter = MetricsExporter(args.metrics_file) if args.metrics_file else None
+    if exporter is not None:
+        exporter.add(batch)
+        exporter.start()
+    try:
+        batch.deposit(
+            profile_name=args.profile,
+            chunk_size=args.chunk,
+            storage_class=args.storage,
+            checksum_sha256=args.checksum_sha256,
+            max_threads=args.threads,
+            max_assets=args.max_assets,
+            hash_on_upload=args.hash_on_upload,
+            hash_workers=args.hash_workers,
+            preflight=args.preflight,
+            pack_threshold=args.pack_threshold,
+            pack_size=args.pack_size,
+            verify_policy=args.verify,
+            verify_sample_rate=args.verify_sample_rate,
+            verify_threads=args.verify_threads,
+            target_parts=args.target_parts,
+            governor=governor,
+            progress=progress,
+            trace_requests=args.trace_requests,
+            dry_run=args.dry_run,
+            assets=assets,
+            s3_client=client_factory.client()
+        )
+    finally:
+        progress.stop()
+        if exporter is not None:
+            exporter.stop()
 
 
 STATS_FIELDS = (
     'batch_name',
-    'total_assets', 'assets_found', 'assets_missing', 'assets_ignored', 'assets_transmitted', 'asset_bytes_transmitted',
-    'successful_deposits', 'failed_deposits', 'deposit_begin', 'deposit_end', 'deposit_time'
+    'total_assets', 'assets_found', 'assets_missing', 'assets_ignored', 'assets_skipped', 'assets_transmitted',
+    'asset_bytes_transmitted', 'head_requests',
+    'successful_deposits', 'failed_deposits', 'deposit_begin', 'deposit_end', 'deposit_time',
+    *METRICS_FIELDS
 )
 # symbolic constant for use with open()
 LINE_BUFFERING = 1
 
+# Number of batches deposited at the same time by batch-deposit
+DEFAULT_MAX_BATCHES = 1
+
+
+def run_connections(batch_configs, max_batches, max_total_threads=None):
+    """
+    Returns the size of the connection pool shared by the batches of a
+    batch-deposit: enough for the uploads and verify requests of the
+    max_batches batches that can make the most requests at once, with the
+    uploads limited to max_total_threads, if given.
+    """
+    uploads = []
+    verifies = []
+    for config in batch_configs:
+        uploads.append(int(config.get('max_assets') or DEFAULT_MAX_ASSETS) *
+                       int(config.get('max_threads') or DEFAULT_MAX_THREADS))
+        verifies.append(int(config.get('verify_threads') or DEFAULT_VERIFY_THREADS))
+    return connections_needed(
+        sum(sorted(uploads, reverse=True)[:max_batches]), sum(sorted(verifies, reverse=True)[:max_batches]),
+        int(max_total_threads) if max_total_threads else None
+    )
+
 
 def batch_deposit(args):
+    """
+    Deposit the batches listed in a YAML file. Up to "max_batches" batches are
+    deposited at the same time, sharing a DepositBudget, while the following
+    batches are prepared (their manifests loaded and assets hashed). All the
+    batches use the same S3 client, whose connection pool is sized for the
+    batches running at once (see "run_connections").
+    """
     batches_filename = args.batches_file
     with open(batches_filename, 'r') as batches_file:
         batch_configs = yaml.safe_load(batches_file)
+    hash_cache = HashCache(batch_configs['hash_cache']) if batch_configs.get('hash_cache') else None
+    with hash_cache or nullcontext():
+        _batch_deposit(args, batches_filename, batch_configs, hash_cache)
+
+
+def _batch_deposit(args, batches_filename, batch_configs, hash_cache):
     batches_dir = batch_configs['batches_dir'] or os.path.curdir
+    max_batches = int(batch_configs.get('max_batches') or DEFAULT_MAX_BATCHES)
+    try:
+        max_total_threads = batch_configs.get('max_total_threads')
+        max_bytes_in_flight = batch_configs.get('max_bytes_in_flight')
+        # A size without a unit is a number of bytes
+        if max_bytes_in_flight and str(max_bytes_in_flight).isdigit():
+            max_bytes_in_flight = int(max_bytes_in_flight)
+        elif max_bytes_in_flight:
+            max_bytes_in_flight = calculate_chunk_bytes(str(max_bytes_in_flight))
+        budget = DepositBudget(
+            max_threads=int(max_total_threads) if max_total_threads else None,
+            max_bytes=max_bytes_in_flight or None
+        )
+        # The bandwidth limit shared by all the batches
+        governor = BandwidthGovernor.from_config(
+            batch_configs.get('max_bandwidth'), batch_configs.get('bandwidth_schedule'),
+            batch_configs.get('bandwidth_control_file')
+        )
+        if governor is not None:
+            governor.install_signal_handler()
+        # The batches share one client (answered by a single FakeS3, for a
+        # dry run)
+        client_factory = S3ClientFactory(
+            args.profile,
+            max_pool_connections=run_connections(batch_configs['batches'], max_batches, max_total_threads),
+            tcp_keepalive=batch_configs.get('tcp_keepalive', DEFAULT_TCP_KEEPALIVE),
+            fake_s3=create_fake_s3(args)
+        )
+    except ConfigException as e:
+        print(e, file=sys.stderr)
+        raise FailureException from e
+    s3_client = client_factory.client()
 
     stats_filename = os.path.join(os.path.dirname(batches_filename), 'stats.csv')
-    stats_file_is_new = not os.path.exists(stats_filename)
+    # Keep the columns of an existing stats file, which may have been written
+    # by a version of this tool with fewer statistics
+    existing_fields = get_csv_fieldnames(stats_filename)
     with open(stats_filename, mode='a', buffering=LINE_BUFFERING) as stats_file:
-        writer = csv.DictWriter(stats_file, fieldnames=STATS_FIELDS)
-        if stats_file_is_new:
+        writer = csv.DictWriter(stats_file, fieldnames=existing_fields or STATS_FIELDS, extrasaction='ignore')
+        if existing_fields is None:
             writer.writeheader()
+        stats_lock = threading.Lock()
+
+        # Batches are prepared at most max_batches ahead of those being
+        # deposited, so that only a few of them are held in memory
+        ahead = threading.BoundedSemaphore(max_batches)
+        failed = threading.Event()
 
-        for config in batch_configs['batches']:
+        def run_batch(prepared):
             try:
-                manifest_filename = os.path.join(batches_dir, config.get('path'),
-                                                 config.get('manifest', DEFAULT_MANIFEST_FILENAME))
-                manifest = ManifestFactory.create(manifest_filename)
-                etag_exists = check_etag(args.mapfile)
-
-                batch = Batch(
-                    manifest,
-                    bucket=config.get('bucket'),
-                    asset_root=config.get('asset_root'),
-                    name=config.get('name'),
-                    log_dir=config.get('logs')
+                try:
+                    batch, config, assets = prepared.result()
+                finally:
+                    ahead.release()
+                if exporter is not None:
+                    exporter.add(batch)
+                print()
+                batch.deposit(
+                    profile_name=args.profile,
+                    chunk_size=config.get('chunk_size'),
+                    storage_class=config.get('storage_class'),
+                    checksum_sha256=config.get('checksum_sha256', False),
+                    max_threads=config.get('max_threads'),
+                    max_assets=config.get('max_assets'),
+                    hash_on_upload=config.get('hash_on_upload', False),
+                    hash_workers=config.get('hash_workers', DEFAULT_HASH_WORKERS),
+                    preflight=config.get('preflight', False),
+                    pack_threshold=config.get('pack_threshold'),
+                    pack_size=config.get('pack_size'),
+                    verify_policy=config.get('verify'),
+                    verify_sample_rate=config.get('verify_sample_rate'),
+                    verify_threads=config.get('verify_threads'),
+                    target_parts=config.get('target_parts'),
+                    budget=budget,
+                    max_bandwidth=config.get('max_bandwidth'),
+                    governor=governor,
+                    progress=progress,
+                    trace_requests=config.get('trace_requests', False),
+                    dry_run=args.dry_run,
+                    assets=assets,
+                    s3_client=s3_client
                 )
-                manifest.load_manifest(config.get('manifest', DEFAULT_MANIFEST_FILENAME), batch,
-                                       etag_exists=etag_exists)
-            except ConfigException as e:
+            except Exception:
+                # Stop starting new batches; those already running finish
+                failed.set()
+                raise
+            with stats_lock:
+                writer.writerow(batch.stats)
+                sys.stdout.write(
+                    f'\nBatch {config.get("path")} finished:\n' +
+                    ''.join(f"    {key.replace('_', ' ').title()}: {value}\n" for key, value in batch.stats.items())
+                )
+
+        # Report the progress and metrics of all the batches together
+        exporter = MetricsExporter(batch_configs['metrics_file']) if batch_configs.get('metrics_file') else None
+        with ProgressReporter(args.progress) as progress, exporter or nullcontext(), \
+                ThreadPoolExecutor(max_workers=max_batches, thread_name_prefix='prepare') as prepare_executor, \
+                ThreadPoolExecutor(max_workers=max_batches, thread_name_prefix='batch') as batch_executor:
+            futures = []
+            for config in batch_configs['batches']:
+                ahead.acquire()
+                if failed.is_set():
+                    break
+                prepared = prepare_executor.submit(prepare_batch, config, batches_dir, hash_cache)
+                futures.append(batch_executor.submit(run_batch, prepared))
+
+        for future in futures:
+            e = future.exception()
+            if isinstance(e, ConfigException):
                 print(e, file=sys.stderr)
-                raise FailureException from e
-
-            print()
-            batch.deposit(
-                profile_name=args.profile,
-                chunk_size=config.get('chunk_size'),
-                storage_class=config.get('storage_class'),
-                max_threads=config.get('max_threads'),
-                dry_run=args.dry_run
-            )
-            writer.writerow(batch.stats)
-            for key, value in batch.stats.items():
-                print(f"    {key.replace('_', ' ').title()}: {value}")
+            elif e is not None and not isinstance(e, FailureException):
+                raise e
+        if failed.is_set():
+            raise FailureException
+
+
+def prepare_batch(config, batches_dir, hash_cache=None):
+    """
+    Create the Batch for an entry in a batches file and load its manifest, or
+    for a streaming batch, the iterator of its assets. Unless the assets are
+    to be hashed on upload, they are also hashed here, so that a batch can be
+    prepared while others are being deposited. Returns the batch, its config,
+    and the assets iterator (or None).
+    """
+    manifest_filename = os.path.join(batches_dir, config.get('path'),
+                                     config.get('manifest', DEFAULT_MANIFEST_FILENAME))
+    manifest = ManifestFactory.create(manifest_filename)
+    etag_exists = check_etag(manifest_filename)
+
+    batch = Batch(
+        manifest,
+        bucket=config.get('bucket'),
+        asset_root=config.get('asset_root'),
+        name=config.get('name'),
+        log_dir=config.get('logs'),
+        hash_cache=hash_cache
+    )
+    if config.get('stream', False):
+        return batch, config, batch.stream_manifest(etag_exists=etag_exists)
+
+    manifest.load_manifest(batch.results_filename, batch, etag_exists=etag_exists)
+    hash_workers = config.get('hash_workers', DEFAULT_HASH_WORKERS)
+    if hash_workers and not config.get('hash_on_upload', False):
+        part_sizing = PartSizing.from_chunk_size(
+            config.get('chunk_size') or DEFAULT_CHUNK_SIZE,
+            int(config.get('max_threads') or DEFAULT_MAX_THREADS),
+            int(config.get('target_parts') or DEFAULT_TARGET_PARTS)
+        )
+        # Packed assets are hashed as their containers are uploaded
+        min_bytes = calculate_chunk_bytes(config['pack_threshold']) if config.get('pack_threshold') else 0
+        batch.hash_assets(part_sizing, hash_workers, min_bytes=min_bytes)
+    return batch, config, None
+
+
+def prune_cache(args):
+    """Remove old entries from the hash cache."""
+    if args.days is None and not args.missing:
+        print('Nothing to prune: specify --days and/or --missing', file=sys.stderr)
+        raise FailureException
+    max_age = args.days * 86400 if args.days is not None else None
+    with HashCache(args.cache_file) as hash_cache:
+        removed = hash_cache.prune(max_age=max_age, remove_missing=args.missing)
+    print(f'Removed {removed} files from {args.cache_file}')
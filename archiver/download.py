@@ -0,0 +1,133 @@
+import os
+from collections import deque
+from concurrent.futures import wait
+
+from botocore.exceptions import IncompleteReadError, ReadTimeoutError, ResponseStreamingError
+
+from .asset import DigestBuilder, MB
+
+# Largest range fetched by a single GET; the ranges never cross the
+# boundaries of the parts the object was uploaded in
+DEFAULT_BLOCK_SIZE = 16 * MB
+DEFAULT_PART_THREADS = 16
+
+# Number of times the GET of a range is made, when reading its body fails
+DOWNLOAD_ATTEMPTS = 3
+
+# Errors reading a response body, which botocore does not retry
+STREAM_ERRORS = (IncompleteReadError, ReadTimeoutError, ResponseStreamingError)
+
+
+def block_ranges(size, part_size=None, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Returns the (start, end) byte ranges an object of the given size is
+    downloaded in: the parts of part_size bytes it was uploaded in (or the
+    whole object, if part_size is None), split into blocks of at most
+    block_size bytes.
+    """
+    part_size = part_size or size
+    ranges = []
+    for part_start in range(0, size, part_size):
+        part_end = min(part_start + part_size, size)
+        ranges.extend((start, min(start + block_size, part_end)) for start in range(part_start, part_end, block_size))
+    return ranges
+
+
+def preallocate(fd, size):
+    """
+    Allocate the space for a file of the given size, so that blocks can be
+    written at any offset without fragmenting it.
+    """
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            # Not supported by every filesystem
+            pass
+    os.ftruncate(fd, size)
+
+
+def fetch_range(s3_client, bucket, key, etag, start, end, fd):
+    """
+    GET a range of an object, and write it at the same offset in the file.
+    The request only succeeds if the object still has the given ETag, so that
+    the ranges of a download all come from the same version of the object.
+    Returns the data.
+    """
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        try:
+            response = s3_client.get_object(
+                Bucket=bucket, Key=key, Range=f'bytes={start}-{end - 1}', IfMatch=f'"{etag}"'
+            )
+            data = response['Body'].read()
+            if len(data) != end - start:
+                raise IncompleteReadError(actual_bytes=len(data), expected_bytes=end - start)
+            break
+        except STREAM_ERRORS:
+            if attempt == DOWNLOAD_ATTEMPTS:
+                raise
+    view = memoryview(data)
+    written = 0
+    while written < len(view):
+        written += os.pwrite(fd, view[written:], start + written)
+    return data
+
+
+def download_object(s3_client, executor, bucket, key, path, part_size=None, block_size=DEFAULT_BLOCK_SIZE,
+                    window=2 * DEFAULT_PART_THREADS):
+    """
+    Download an object to a preallocated file, fetching its ranges (see
+    "block_ranges") in parallel on the executor, and writing each one at its
+    offset with a positional write.
+
+    The data is hashed in order as the ranges arrive, giving the MD5 of the
+    object and, if part_size is given, its multipart ETag. At most window
+    ranges are fetched ahead of the hashing, which bounds the memory used; it
+    should be larger than the number of threads of the executor. Returns the
+    AssetDigest and the HEAD response for the object.
+    """
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    etag = head['ETag'].strip('"')
+    builder = DigestBuilder(part_size)
+    pending = deque()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        preallocate(fd, head['ContentLength'])
+        for start, end in block_ranges(head['ContentLength'], part_size, block_size):
+            pending.append(executor.submit(fetch_range, s3_client, bucket, key, etag, start, end, fd))
+            if len(pending) >= window:
+                builder.update(pending.popleft().result())
+        while pending:
+            builder.update(pending.popleft().result())
+    finally:
+        # No writes may be made to the file once it is closed
+        for future in pending:
+            future.cancel()
+        wait(pending)
+        os.close(fd)
+    return builder.result(), head
+
+
+def verify_download(digest, head, part_size=None, expected_md5=None, expected_etag=None):
+    """
+    Returns a list of the fixity errors of a download: a size different from
+    the object's, an ETag different from the object's or the expected ETag
+    (when the part size is known), or an MD5 different from the object's md5
+    metadata or the expected MD5.
+    """
+    errors = []
+    if digest.size != head['ContentLength']:
+        errors.append(f'downloaded {digest.size} bytes of {head["ContentLength"]}')
+    if part_size is not None:
+        remote_etag = head['ETag'].strip('"')
+        if digest.etag != remote_etag:
+            errors.append(f'ETag {digest.etag} does not match the object ETag {remote_etag}')
+        if expected_etag and digest.etag != expected_etag:
+            errors.append(f'ETag {digest.etag} does not match the deposited ETag {expected_etag}')
+    metadata_md5 = head.get('Metadata', {}).get('md5')
+    if metadata_md5 and digest.md5 != metadata_md5:
+        errors.append(f'MD5 {digest.md5} does not match the md5 metadata {metadata_md5}')
+    if expected_md5 and digest.md5 != expected_md5:
+        errors.append(f'MD5 {digest.md5} does not match the deposited MD5 {expected_md5}')
+    return errors
@@ -0,0 +1,674 @@
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from email.utils import formatdate
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import boto3
+from botocore.awsrequest import AWSResponse, HeadersDict
+
+from .bandwidth import TokenBucket, parse_rate
+from .exceptions import ConfigException
+
+# Size of the blocks request bodies are read in
+READ_SIZE = 1024 ** 2
+
+# Subdirectories of the root directory of a filesystem-backed FakeS3, for the
+# object data, the object metadata, and the parts of multipart uploads
+OBJECTS_DIR = 'objects'
+METADATA_DIR = 'metadata'
+UPLOADS_DIR = 'uploads'
+
+# The injected errors, which botocore retries
+INJECTED_ERRORS = (
+    (503, 'SlowDown', 'Please reduce your request rate.'),
+    (500, 'InternalError', 'We encountered an internal error. Please try again.'),
+)
+
+# The headers of the SHA256 checksum of an upload, sent with the request or
+# as a trailer of an aws-chunked body, and of the stored object
+CHECKSUM_HEADER = 'x-amz-checksum-sha256'
+
+# Storage classes whose objects must be restored before they can be read
+ARCHIVE_STORAGE_CLASSES = ('GLACIER', 'DEEP_ARCHIVE')
+
+
+class FakeObject:
+    """
+    An object stored by FakeS3. For an object in an archive storage class,
+    restore_ready is the time a requested restore completes, and
+    restore_expiry the time the restored copy expires.
+    """
+    __slots__ = (
+        'size', 'etag', 'metadata', 'storage_class', 'last_modified', 'restore_ready', 'restore_expiry',
+        'checksum_sha256'
+    )
+
+    def __init__(self, size, etag, metadata, storage_class, last_modified=None, restore_ready=None,
+                 restore_expiry=None, checksum_sha256=None):
+        self.size = size
+        self.etag = etag
+        self.metadata = metadata
+        self.storage_class = storage_class
+        self.last_modified = last_modified if last_modified is not None else time.time()
+        self.restore_ready = restore_ready
+        self.restore_expiry = restore_expiry
+        self.checksum_sha256 = checksum_sha256
+
+    def restore_status(self, now):
+        """
+        Returns whether a restore of the object is in progress, and whether
+        it can be read.
+        """
+        if self.storage_class not in ARCHIVE_STORAGE_CLASSES:
+            return False, True
+        if self.restore_ready is None or self.restore_expiry <= now:
+            return False, False
+        return self.restore_ready > now, self.restore_ready <= now
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class FakeS3:
+    """
+    Local stand-in for S3, which answers the requests of real botocore clients
+    through a "before-send" event handler, so that nothing is sent over the
+    network. The request bodies are read, so upload progress callbacks are
+    made as they would be by a real upload, and ETags are calculated as S3
+    does, including those of multipart uploads. Bodies sent with the
+    aws-chunked encoding are decoded, and SHA256 checksums sent with uploads
+    (in a header or a trailer) are validated, and returned as S3 returns them.
+
+    Supports the operations used to deposit assets: PutObject, the multipart
+    upload operations, HeadObject and ListObjectsV2; and those used to
+    retrieve them: RestoreObject and GetObject (including ranged GETs, when
+    the objects are stored). Objects in the GLACIER and DEEP_ARCHIVE storage
+    classes can only be read once they have been restored, which takes
+    restore_time seconds.
+
+    If a root directory is given, the objects are stored under it, and are
+    still there for later instances using the same directory; otherwise only
+    their sizes, ETags and metadata are kept, in memory.
+
+    To behave more like S3 over a network, a FakeS3 can add a latency (in
+    seconds) to each request, limit the rate at which request bodies are read
+    across all requests (in bytes per second), and answer a fraction of the
+    requests (error_rate) with a 503 SlowDown or 500 InternalError, which
+    botocore retries.
+
+    Instances may be shared between threads and clients.
+    """
+
+    def __init__(self, root=None, latency=0, bandwidth=None, error_rate=0, seed=None, restore_time=0):
+        self.root = root
+        self.latency = latency
+        self.restore_time = restore_time
+        self.limiter = TokenBucket(bandwidth) if bandwidth is not None else None
+        self.error_rate = error_rate
+        self.objects = {}
+        self.uploads = {}
+        self.request_count = 0
+        self.errors_injected = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if root is not None:
+            self._load_objects()
+
+    @classmethod
+    def from_config(cls, root=None, latency=None, bandwidth=None, error_rate=None):
+        """
+        Returns a FakeS3 for the given options, with a human-readable bandwidth
+        (such as "10MB", per second).
+        """
+        latency = float(latency) if latency is not None else 0
+        error_rate = float(error_rate) if error_rate is not None else 0
+        if latency < 0:
+            raise ConfigException(f'The latency must not be negative: {latency}')
+        if not 0 <= error_rate < 1:
+            raise ConfigException(f'The error rate must be at least 0 and less than 1: {error_rate}')
+        return cls(root, latency, parse_rate(bandwidth), error_rate)
+
+    def client(self, config=None):
+        """
+        Returns a new S3 client whose requests are answered by this FakeS3,
+        with the given botocore Config, if any. No AWS credentials or
+        configuration are needed.
+        """
+        session = boto3.session.Session(
+            aws_access_key_id='fake-s3', aws_secret_access_key='fake-s3', region_name='us-east-1'
+        )
+        s3_client = session.client('s3', config=config)
+        self.register(s3_client)
+        return s3_client
+
+    def register(self, s3_client):
+        """
+        Answer the requests made by the client.
+        """
+        s3_client.meta.events.register('before-send.s3', self.handle, unique_id='archiver-fake-s3')
+
+    def handle(self, request, **kwargs):
+        operation = kwargs['event_name'].rsplit('.', 1)[-1]
+        with self._lock:
+            self.request_count += 1
+            injected_error = None
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors_injected += 1
+                injected_error = self._random.choice(INJECTED_ERRORS)
+        if self.latency:
+            time.sleep(self.latency)
+        if injected_error is not None:
+            return error_response(request, *injected_error)
+
+        handler = getattr(self, f'_{operation}', None)
+        if handler is None:
+            return error_response(request, 501, 'NotImplemented', f'{operation} is not supported by FakeS3')
+        bucket, key = parse_location(request.url)
+        query = {name: values[0] for name, values in parse_qs(urlsplit(request.url).query,
+                                                              keep_blank_values=True).items()}
+        return handler(request, bucket, key, query)
+
+    def _PutObject(self, request, bucket, key, query):
+        with self._open_output() as output:
+            size, md5, checksum = read_upload(request, output, self.limiter)
+        if checksum is False:
+            self._discard(output)
+            return checksum_error_response(request)
+        etag = md5.hexdigest()
+        stored = FakeObject(size, etag, get_metadata(request.headers),
+                            get_header(request.headers, 'x-amz-storage-class', 'STANDARD'),
+                            checksum_sha256=encode_checksum(checksum))
+        self._store(bucket, key, stored, output)
+        return response(request, 200, checksum_headers({'ETag': f'"{etag}"'}, stored.checksum_sha256))
+
+    def _CreateMultipartUpload(self, request, bucket, key, query):
+        upload_id = uuid.uuid4().hex
+        if self.root is not None:
+            os.makedirs(os.path.join(self.root, UPLOADS_DIR, upload_id))
+        with self._lock:
+            self.uploads[upload_id] = {
+                'metadata': get_metadata(request.headers),
+                'storage_class': get_header(request.headers, 'x-amz-storage-class', 'STANDARD'),
+                'checksum_algorithm': get_header(request.headers, 'x-amz-checksum-algorithm'),
+                'parts': {},
+            }
+        return response(request, 200, body=(
+            f'<InitiateMultipartUploadResult><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+            f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>'
+        ))
+
+    def _UploadPart(self, request, bucket, key, query):
+        upload_id = query.get('uploadId')
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None:
+            return error_response(request, 404, 'NoSuchUpload', 'The specified upload does not exist.')
+        part_number = int(query['partNumber'])
+        with self._open_output() as output:
+            size, md5, checksum = read_upload(request, output, self.limiter)
+        if checksum is False:
+            self._discard(output)
+            return checksum_error_response(request)
+        if output is not None:
+            os.replace(output.name, os.path.join(self.root, UPLOADS_DIR, upload_id, str(part_number)))
+        with self._lock:
+            upload['parts'][part_number] = (size, md5.digest(), checksum)
+        return response(request, 200, checksum_headers({'ETag': f'"{md5.hexdigest()}"'}, encode_checksum(checksum)))
+
+    def _CompleteMultipartUpload(self, request, bucket, key, query):
+        _, body = read_body(request.body, keep=True)
+        part_numbers = [int(element.text) for element in ElementTree.fromstring(body).iter()
+                        if element.tag.endswith('PartNumber')]
+        upload_id = query.get('uploadId')
+        with self._lock:
+            upload = self.uploads.pop(upload_id, None)
+        if upload is None or any(number not in upload['parts'] for number in part_numbers):
+            return error_response(request, 400, 'InvalidPart', 'One or more of the parts could not be found.')
+
+        # The ETag of a multipart upload is the MD5 of the MD5s of its parts,
+        # followed by the number of parts
+        parts = [upload['parts'][number] for number in part_numbers]
+        etag = f"{hashlib.md5(b''.join(digest for _, digest, _ in parts)).hexdigest()}-{len(parts)}"
+
+        # The checksum of a multipart upload is the checksum of the checksums
+        # of its parts, which must all have been sent
+        checksum_sha256 = None
+        if upload['checksum_algorithm'] == 'SHA256':
+            if any(checksum is None for _, _, checksum in parts):
+                return error_response(request, 400, 'InvalidRequest',
+                                      'The upload was created with a checksum algorithm, but a part has no checksum.')
+            combined = hashlib.sha256(b''.join(checksum for _, _, checksum in parts)).digest()
+            checksum_sha256 = f'{encode_checksum(combined)}-{len(parts)}'
+        stored = FakeObject(sum(size for size, _, _ in parts), etag, upload['metadata'], upload['storage_class'],
+                            checksum_sha256=checksum_sha256)
+        with self._open_output() as output:
+            if output is not None:
+                upload_dir = os.path.join(self.root, UPLOADS_DIR, upload_id)
+                for number in part_numbers:
+                    with open(os.path.join(upload_dir, str(number)), 'rb') as part_file:
+                        for block in iter(lambda: part_file.read(READ_SIZE), b''):
+                            output.write(block)
+        self._store(bucket, key, stored, output)
+        self._remove_upload(upload_id)
+        return response(request, 200, body=(
+            f'<CompleteMultipartUploadResult><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>'
+            f'<ETag>"{etag}"</ETag>' +
+            (f'<ChecksumSHA256>{checksum_sha256}</ChecksumSHA256>' if checksum_sha256 is not None else '') +
+            f'</CompleteMultipartUploadResult>'
+        ))
+
+    def _AbortMultipartUpload(self, request, bucket, key, query):
+        upload_id = query.get('uploadId')
+        with self._lock:
+            self.uploads.pop(upload_id, None)
+        self._remove_upload(upload_id)
+        return response(request, 204)
+
+    def _HeadObject(self, request, bucket, key, query):
+        with self._lock:
+            stored = self.objects.get((bucket, key))
+        if stored is None:
+            return response(request, 404)
+        headers = {
+            'ETag': f'"{stored.etag}"',
+            'Content-Length': str(stored.size),
+            'Last-Modified': formatdate(stored.last_modified, usegmt=True),
+            'x-amz-storage-class': stored.storage_class,
+        }
+        headers.update((f'x-amz-meta-{name}', value) for name, value in stored.metadata.items())
+        if get_header(request.headers, 'x-amz-checksum-mode') == 'ENABLED':
+            checksum_headers(headers, stored.checksum_sha256)
+        restoring, readable = stored.restore_status(time.time())
+        if restoring:
+            headers['x-amz-restore'] = 'ongoing-request="true"'
+        elif readable and stored.restore_ready is not None:
+            headers['x-amz-restore'] = (
+                f'ongoing-request="false", expiry-date="{formatdate(stored.restore_expiry, usegmt=True)}"'
+            )
+        return response(request, 200, headers)
+
+    def _RestoreObject(self, request, bucket, key, query):
+        _, body = read_body(request.body, keep=True)
+        days = int(next(element.text for element in ElementTree.fromstring(body).iter()
+                        if element.tag.endswith('Days')))
+        now = time.time()
+        with self._lock:
+            stored = self.objects.get((bucket, key))
+            if stored is None:
+                return error_response(request, 404, 'NoSuchKey', 'The specified key does not exist.')
+            if stored.storage_class not in ARCHIVE_STORAGE_CLASSES:
+                return error_response(request, 403, 'InvalidObjectState',
+                                      "Restore is not allowed for the object's current storage class")
+            restoring, restored = stored.restore_status(now)
+            if restoring:
+                return error_response(request, 409, 'RestoreAlreadyInProgress',
+                                      'Object restore is already in progress')
+            if not restored:
+                stored.restore_ready = now + self.restore_time
+            stored.restore_expiry = max(stored.restore_ready, now) + days * 86400
+        if self.root is not None:
+            self._save_metadata(bucket, key, stored)
+        return response(request, 200 if restored else 202)
+
+    def _GetObject(self, request, bucket, key, query):
+        with self._lock:
+            stored = self.objects.get((bucket, key))
+        if stored is None:
+            return error_response(request, 404, 'NoSuchKey', 'The specified key does not exist.')
+        if not stored.restore_status(time.time())[1]:
+            return error_response(request, 403, 'InvalidObjectState',
+                                  "The operation is not valid for the object's storage class")
+        if self.root is None:
+            return error_response(request, 501, 'NotImplemented', 'FakeS3 only stores objects with a root directory')
+        if_match = get_header(request.headers, 'If-Match')
+        if if_match is not None and if_match.strip('"') != stored.etag:
+            return error_response(request, 412, 'PreconditionFailed', 'At least one of the preconditions you '
+                                  'specified did not hold')
+
+        start, end = 0, stored.size - 1
+        byte_range = get_header(request.headers, 'Range')
+        if byte_range is not None:
+            first, _, last = byte_range[len('bytes='):].partition('-')
+            if first:
+                start, end = int(first), min(int(last), end) if last else end
+            else:
+                start = max(0, stored.size - int(last))
+            if start > end:
+                return error_response(request, 416, 'InvalidRange', 'The requested range is not satisfiable')
+        headers = {
+            'ETag': f'"{stored.etag}"',
+            'Content-Length': str(end - start + 1),
+            'Last-Modified': formatdate(stored.last_modified, usegmt=True),
+            'x-amz-storage-class': stored.storage_class,
+        }
+        headers.update((f'x-amz-meta-{name}', value) for name, value in stored.metadata.items())
+        if byte_range is not None:
+            headers['Content-Range'] = f'bytes {start}-{end}/{stored.size}'
+        data_file = open(self.object_path(bucket, key), 'rb')
+        data_file.seek(start)
+        return AWSResponse(request.url, 206 if byte_range is not None else 200, HeadersDict(headers),
+                           RawResponse(data_file, end - start + 1, self.limiter))
+
+    def _ListObjectsV2(self, request, bucket, key, query):
+        prefix = query.get('prefix', '')
+        max_keys = int(query.get('max-keys', 1000))
+        start_after = query.get('continuation-token') or query.get('start-after', '')
+        with self._lock:
+            keys = sorted(
+                (object_key, stored) for (object_bucket, object_key), stored in self.objects.items()
+                if object_bucket == bucket and object_key.startswith(prefix) and object_key > start_after
+            )
+        page = keys[:max_keys]
+        truncated = len(keys) > max_keys
+        contents = ''.join(
+            f'<Contents><Key>{escape(object_key)}</Key><LastModified>{format_iso(stored.last_modified)}'
+            f'</LastModified><ETag>"{stored.etag}"</ETag><Size>{stored.size}</Size>'
+            f'<StorageClass>{stored.storage_class}</StorageClass></Contents>'
+            for object_key, stored in page
+        )
+        next_token = f'<NextContinuationToken>{escape(page[-1][0])}</NextContinuationToken>' if truncated else ''
+        return response(request, 200, body=(
+            f'<ListBucketResult><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>'
+            f'<KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>'
+            f'<IsTruncated>{str(truncated).lower()}</IsTruncated>{contents}{next_token}</ListBucketResult>'
+        ))
+
+    def object_path(self, bucket, key):
+        """
+        Returns the path of the file holding the data of an object, when the
+        objects are stored under a root directory.
+        """
+        return os.path.join(self.root, OBJECTS_DIR, bucket, key_to_path(key))
+
+    def _metadata_path(self, bucket, key):
+        return os.path.join(self.root, METADATA_DIR, bucket, key_to_path(key)) + '.json'
+
+    def _open_output(self):
+        """
+        Returns a temporary file for the data of an object, or a context
+        manager yielding None if the objects are not stored.
+        """
+        if self.root is None:
+            return contextlib.nullcontext()
+        upload_dir = os.path.join(self.root, UPLOADS_DIR)
+        os.makedirs(upload_dir, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=upload_dir, prefix='.data-', delete=False)
+
+    def _store(self, bucket, key, stored, output):
+        if output is not None:
+            data_path = self.object_path(bucket, key)
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            os.makedirs(os.path.dirname(self._metadata_path(bucket, key)), exist_ok=True)
+            os.replace(output.name, data_path)
+            self._save_metadata(bucket, key, stored)
+        with self._lock:
+            self.objects[(bucket, key)] = stored
+
+    def _save_metadata(self, bucket, key, stored):
+        with open(self._metadata_path(bucket, key), 'w') as metadata_file:
+            json.dump(stored.to_dict(), metadata_file)
+
+    def _discard(self, output):
+        if output is not None:
+            os.remove(output.name)
+
+    def _remove_upload(self, upload_id):
+        if self.root is None:
+            return
+        upload_dir = os.path.join(self.root, UPLOADS_DIR, upload_id)
+        if os.path.isdir(upload_dir):
+            for name in os.listdir(upload_dir):
+                os.remove(os.path.join(upload_dir, name))
+            os.rmdir(upload_dir)
+
+    def _load_objects(self):
+        metadata_root = os.path.join(self.root, METADATA_DIR)
+        for directory, _, filenames in os.walk(metadata_root):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(directory, filename)
+                bucket, _, name = os.path.relpath(path, metadata_root)[:-len('.json')].partition(os.sep)
+                with open(path) as metadata_file:
+                    self.objects[(bucket, path_to_key(name))] = FakeObject(**json.load(metadata_file))
+
+
+class RawResponse:
+    """
+    The minimal interface of a urllib3 response needed by AWSResponse, and by
+    the StreamingBody of a GetObject response: a body of the given length,
+    read from a file object, no faster than the limiter allows.
+    """
+
+    def __init__(self, body_file, length, limiter=None):
+        self._file = body_file
+        self._remaining = length
+        self._limiter = limiter
+
+    def read(self, amt=None):
+        if amt is None or amt < 0 or amt > self._remaining:
+            amt = self._remaining
+        data = self._file.read(amt) if amt else b''
+        self._remaining -= len(data)
+        if self._limiter is not None:
+            self._limiter.consume(len(data))
+        if not data:
+            self.close()
+        return data
+
+    def stream(self, amt=READ_SIZE, decode_content=None):
+        for data in iter(lambda: self.read(amt), b''):
+            yield data
+
+    def close(self):
+        self._file.close()
+
+
+def response(request, status_code, headers=None, body=b''):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    response_headers = HeadersDict(headers or {})
+    response_headers.setdefault('x-amz-request-id', uuid.uuid4().hex[:16].upper())
+    return AWSResponse(request.url, status_code, response_headers, RawResponse(io.BytesIO(body), len(body)))
+
+
+def checksum_error_response(request):
+    return error_response(request, 400, 'BadDigest',
+                          'The SHA256 you specified did not match the calculated checksum.')
+
+
+def checksum_headers(headers, checksum_sha256):
+    """
+    Add the header with the SHA256 checksum of an object or part, if it has
+    one, to the headers of a response, and return them.
+    """
+    if checksum_sha256 is not None:
+        headers[CHECKSUM_HEADER] = checksum_sha256
+    return headers
+
+
+def encode_checksum(checksum):
+    return base64.b64encode(checksum).decode('ascii') if checksum is not None else None
+
+
+def error_response(request, status_code, code, message):
+    return response(request, status_code, body=(
+        f'<Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>'
+    ))
+
+
+def format_iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def parse_location(url):
+    """
+    Returns the bucket and key addressed by a virtual-hosted or path-style
+    S3 URL.
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ''
+    path = unquote(parts.path)
+    if '.s3.' in host or '.s3-' in host:
+        return host.split('.s3', 1)[0], path[1:]
+    bucket, _, key = path[1:].partition('/')
+    return bucket, key
+
+
+def key_to_path(key):
+    """
+    Returns the relative path under which an object is stored. Each segment
+    of the key is percent-encoded (with an empty segment stored as "%"), so
+    that keys such as "/a//b" or "../a" are stored under the root directory,
+    and as distinct paths.
+    """
+    return os.path.join(*(encode_segment(segment) for segment in key.split('/')))
+
+
+def encode_segment(segment):
+    if segment == '':
+        return '%'
+    encoded = quote(segment, safe='')
+    return encoded.replace('.', '%2E') if segment.strip('.') == '' else encoded
+
+
+def path_to_key(path):
+    return '/'.join('' if segment == '%' else unquote(segment) for segment in path.split(os.sep))
+
+
+def get_header(headers, name, default=None):
+    value = headers.get(name, default)
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def get_metadata(headers):
+    return {
+        name[len('x-amz-meta-'):]: get_header(headers, name) for name in headers
+        if name.lower().startswith('x-amz-meta-')
+    }
+
+
+def read_body(body, keep=False, output=None, limiter=None, sha256=None):
+    """
+    Read a request body, which may be bytes, a string, or a file-like object,
+    writing it to the output file, if one is given, and reading no faster than
+    the limiter allows. Returns its size and its MD5 (as a hashlib object),
+    or, if keep is True, its size and its content. The sha256 hashlib object,
+    if one is given, is updated with the body.
+    """
+    md5 = hashlib.md5()
+    content = []
+    size = 0
+    if body is None:
+        blocks = []
+    elif isinstance(body, (bytes, bytearray)):
+        blocks = [body]
+    elif isinstance(body, str):
+        blocks = [body.encode('utf-8')]
+    else:
+        blocks = iter(lambda: body.read(READ_SIZE), b'')
+    for block in blocks:
+        if limiter is not None:
+            limiter.consume(len(block))
+        size += len(block)
+        if keep:
+            content.append(block)
+        else:
+            md5.update(block)
+        if sha256 is not None:
+            sha256.update(block)
+        if output is not None:
+            output.write(block)
+    return size, b''.join(content) if keep else md5
+
+
+def read_upload(request, output=None, limiter=None):
+    """
+    Read the body of an upload request, as "read_body" does, decoding it if
+    it was sent with the aws-chunked encoding. Returns its size, its MD5 (as
+    a hashlib object), and the SHA256 digest of the data if a SHA256 checksum
+    was sent with it, in a header or a trailer, which is False if the
+    checksum did not match.
+    """
+    body = request.body
+    chunked = 'aws-chunked' in (get_header(request.headers, 'Content-Encoding') or '')
+    if chunked:
+        body = ChunkedBody(body)
+    expected = get_header(request.headers, CHECKSUM_HEADER)
+    sha256 = hashlib.sha256() if expected is not None or chunked else None
+    size, md5 = read_body(body, output=output, limiter=limiter, sha256=sha256)
+    if chunked:
+        expected = body.trailers.get(CHECKSUM_HEADER)
+    if expected is None:
+        return size, md5, None
+    checksum = sha256.digest()
+    return size, md5, checksum if encode_checksum(checksum) == expected else False
+
+
+class ChunkedBody:
+    """
+    Decodes a request body sent with the aws-chunked content encoding, as
+    botocore sends bodies with a checksum in a trailer: a series of chunks,
+    each preceded by its size in hexadecimal, ending with an empty chunk
+    followed by the trailing headers, which are collected in "trailers".
+    """
+
+    def __init__(self, body):
+        self._body = io.BytesIO(body) if isinstance(body, (bytes, bytearray)) else body
+        self._buffer = bytearray()
+        self._chunk_remaining = 0
+        self._done = False
+        self.trailers = {}
+
+    def read(self, size=READ_SIZE):
+        if self._done:
+            return b''
+        if self._chunk_remaining == 0:
+            self._chunk_remaining = int(self._readline().split(b';')[0], 16)
+            if self._chunk_remaining == 0:
+                self._read_trailers()
+                return b''
+        data = self._take(min(size, self._chunk_remaining))
+        self._chunk_remaining -= len(data)
+        if self._chunk_remaining == 0:
+            # The CRLF after the chunk
+            self._take(2)
+        return data
+
+    def _read_trailers(self):
+        self._done = True
+        for line in iter(self._readline, b''):
+            name, _, value = line.decode('utf-8').partition(':')
+            self.trailers[name.strip().lower()] = value.strip()
+
+    def _fill(self):
+        data = self._body.read(READ_SIZE)
+        if not data:
+            raise ValueError('Truncated aws-chunked body')
+        self._buffer += data
+
+    def _take(self, size):
+        while len(self._buffer) < size:
+            self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def _readline(self):
+        while b'\r\n' not in self._buffer:
+            self._fill()
+        line, _, _ = bytes(self._buffer).partition(b'\r\n')
+        del self._buffer[:len(line) + 2]
+        return line
@@ -0,0 +1,181 @@
+import csv
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from .asset import DIGEST_ALGORITHMS, calculate_digest
+from .batch import calculate_chunk_bytes, PROGRESS_INTERVAL
+from .exceptions import ConfigException, FailureException
+
+MD5_SUM_FORMAT = 'md5sum'
+INVENTORY_FORMAT = 'inventory'
+FORMATS = (MD5_SUM_FORMAT, INVENTORY_FORMAT)
+
+# The columns of an inventory manifest, as written by the "preserve" tool
+INVENTORY_FIELDS = (
+    'BATCH', 'PATH', 'DIRECTORY', 'RELPATH', 'FILENAME', 'EXTENSION', 'BYTES', 'MTIME', 'MODDATE', 'MD5', 'SHA1',
+    'SHA256'
+)
+
+DEFAULT_INVENTORY_WORKERS = 8
+
+# Number of files queued for hashing, per worker
+QUEUE_FACTOR = 4
+
+
+def scan_directory(path):
+    """
+    Returns the paths of the regular files and the subdirectories in the given
+    directory. Symbolic links are not followed.
+    """
+    files = []
+    directories = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry.path)
+    except OSError as e:
+        print(f'Skipping {path}: {e}', file=sys.stderr)
+    return files, directories
+
+
+def walk_files(root, executor):
+    """
+    Generates the paths of all the regular files below the given root, scanning
+    directories in parallel on the given executor. Files are generated in the
+    order their directories are scanned.
+    """
+    pending = {executor.submit(scan_directory, root)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            files, directories = future.result()
+            yield from files
+            pending.update(executor.submit(scan_directory, directory) for directory in directories)
+
+
+def inventory_file(path, root, batch_name, full, chunk_size=None, digest_executor=None):
+    """
+    Returns the inventory row for the file, reading it once to calculate all
+    of its digests, in parallel on the digest_executor, if one is given.
+    Unless full is True, only the MD5 is calculated.
+    """
+    stat_result = os.stat(path)
+    algorithms = DIGEST_ALGORITHMS if full else ()
+    digest = calculate_digest(path, chunk_size, algorithms=algorithms, executor=digest_executor)
+
+    filename = os.path.basename(path)
+    mtime = int(stat_result.st_mtime)
+    row = {
+        'BATCH': batch_name,
+        'PATH': path,
+        'DIRECTORY': os.path.dirname(path),
+        'RELPATH': os.path.relpath(path, root),
+        'FILENAME': filename,
+        'EXTENSION': os.path.splitext(filename)[1].lstrip('.').upper(),
+        'BYTES': stat_result.st_size,
+        'MTIME': mtime,
+        'MODDATE': datetime.fromtimestamp(mtime).isoformat(),
+        'MD5': digest.md5,
+    }
+    for name in algorithms:
+        row[name.upper()] = getattr(digest, name)
+    if chunk_size is not None:
+        row['ETAG'] = digest.etag
+    return row
+
+
+def write_inventory(root, output, output_format=MD5_SUM_FORMAT, batch_name=None, chunk_size=None,
+                    workers=DEFAULT_INVENTORY_WORKERS, parallel_digests=False):
+    """
+    Walk the directory tree under root, and write a manifest of all the files
+    in it to the output file, in either the "md5sum" or the "inventory" format.
+    For the inventory format, an ETAG column for the given chunk size (in
+    bytes) is included if chunk_size is not None. Returns the number of files
+    listed in the manifest.
+
+    With parallel_digests, the MD5, SHA1 and SHA256 of each block of a file
+    are calculated at the same time on separate threads, which speeds up the
+    hashing of large files on machines with spare cores.
+    """
+    if output_format not in FORMATS:
+        raise ConfigException(f'Unknown manifest format: {output_format}')
+    full = (output_format == INVENTORY_FORMAT)
+    root = os.path.abspath(root)
+    if batch_name is None:
+        batch_name = os.path.basename(root)
+
+    fieldnames = INVENTORY_FIELDS + (('ETAG',) if chunk_size is not None else ())
+    if full:
+        writer = csv.DictWriter(output, fieldnames=fieldnames)
+        writer.writeheader()
+
+    count = 0
+    total_bytes = 0
+    last_update = 0
+
+    def write_row(future):
+        nonlocal count, total_bytes
+        try:
+            row = future.result()
+        except OSError as e:
+            print(f'Skipping {e.filename}: {e}', file=sys.stderr)
+            return
+        if full:
+            writer.writerow(row)
+        else:
+            output.write(f"{row['MD5']}  {row['PATH']}\n")
+        count += 1
+        total_bytes += row['BYTES']
+
+    # Enough digest threads for every hash worker to run all its digests at once
+    digest_threads = workers * (1 + len(DIGEST_ALGORITHMS)) if full and parallel_digests else 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan') as scan_executor, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash') as hash_executor, \
+            ThreadPoolExecutor(max_workers=max(digest_threads, 1), thread_name_prefix='digest') as digest_executor:
+        digest_executor = digest_executor if digest_threads else None
+        pending = set()
+        for path in walk_files(root, scan_executor):
+            if len(pending) >= workers * QUEUE_FACTOR:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write_row(future)
+            pending.add(hash_executor.submit(inventory_file, path, root, batch_name, full, chunk_size,
+                                             digest_executor))
+
+            now = time.monotonic()
+            if now - last_update >= PROGRESS_INTERVAL:
+                last_update = now
+                sys.stdout.write(f'\r  Listed {count} files ({total_bytes} bytes)')
+                sys.stdout.flush()
+
+        for future in pending:
+            write_row(future)
+
+    sys.stdout.write(f'\r  Listed {count} files ({total_bytes} bytes)\n')
+    return count
+
+
+def inventory(args):
+    """Write a manifest of the files in a directory tree."""
+    if not os.path.isdir(args.root):
+        print(f'{args.root} is not a directory', file=sys.stderr)
+        raise FailureException
+
+    try:
+        chunk_size = calculate_chunk_bytes(args.etag_chunk) if args.etag_chunk else None
+        if chunk_size is not None and args.format != INVENTORY_FORMAT:
+            raise ConfigException('ETags can only be included in the inventory format')
+
+        sys.stdout.write(f'Writing {args.format} manifest of {args.root} to {args.output} ...\n')
+        with open(args.output, 'w', newline='' if args.format == INVENTORY_FORMAT else None) as output:
+            write_inventory(args.root, output, output_format=args.format, batch_name=args.batch,
+                            chunk_size=chunk_size, workers=args.workers, parallel_digests=args.parallel_digests)
+    except ConfigException as e:
+        print(e, file=sys.stderr)
+        raise FailureException from e
@@ -11,15 +11,8 @@ class InventoryManifest(Manifest):
         self.manifest_filename = manifest_filename
         self.manifest_path = os.path.dirname(manifest_filename)
 
-    def load_manifest(self, results_filename, batch, etag_exists=False):
-        if os.path.isfile(results_filename):
-            with open(results_filename, 'r') as results_file:
-                results = csv.DictReader(results_file)
-                completed = set((row.get('MD5'), row.get('PATH')) for row in results)
-        else:
-            completed = set()
-
-        with open(self.manifest_filename) as manifest_file:
+    def iter_assets(self, results_filename, etag_exists=False):
+        with self.open_completed(results_filename) as completed, open(self.manifest_filename) as manifest_file:
             reader = csv.DictReader(manifest_file, delimiter=',')
             for row in reader:
                 etag = row['ETAG'] if etag_exists else None
@@ -28,4 +21,4 @@ class InventoryManifest(Manifest):
                 relpath = row['RELPATH']
                 batch_name = row['BATCH']
                 if (md5, path) not in completed:
-                    batch.add_asset(path, batch_name=batch_name, md5=md5, relpath=relpath, manifest_row=row, etag=etag)
+                    yield dict(path=path, batch_name=batch_name, md5=md5, relpath=relpath, manifest_row=row, etag=etag)
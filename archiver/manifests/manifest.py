@@ -1,4 +1,8 @@
 import abc
+import contextlib
+import os
+
+from ..results import ResultsIndex
 
 
 class Manifest(metaclass=abc.ABCMeta):
@@ -6,11 +10,33 @@ class Manifest(metaclass=abc.ABCMeta):
     An interface for manifests.
     """
 
-    @abc.abstractmethod
-    def load_manifest(self, results_filename, batch):
+    def load_manifest(self, results_filename, batch, etag_exists=False):
         """
         Loads the assets from the manifest into the given batch. If
         results_filename is provided, the file will be parsed and assets
         listed in the file will not be added to the batch
         """
+        for asset_args in self.iter_assets(results_filename, etag_exists=etag_exists):
+            batch.add_asset(**asset_args)
+
+    @abc.abstractmethod
+    def iter_assets(self, results_filename, etag_exists=False):
+        """
+        Lazily reads the manifest, yielding a dictionary of the keyword
+        arguments to Batch.add_asset for each asset that is not listed in
+        results_filename.
+        """
         raise NotImplementedError
+
+    @staticmethod
+    @contextlib.contextmanager
+    def open_completed(results_filename):
+        """
+        Context manager providing the collection of (MD5, PATH) tuples for the
+        assets listed in the given results file, for membership tests.
+        """
+        if os.path.isfile(results_filename):
+            with ResultsIndex(results_filename) as completed:
+                yield completed
+        else:
+            yield set()
@@ -11,8 +11,14 @@ class SingleAssetManifest(Manifest):
         self.manifest_filename = manifest_filename
         self.manifest_path = os.path.dirname(manifest_filename)
 
-    def load_manifest(self, results_filename, batch):
+    def load_manifest(self, results_filename, batch, etag_exists=False):
         """
         Does nothing. Asset must be added to Batch manually
         """
         pass
+
+    def iter_assets(self, results_filename, etag_exists=False):
+        """
+        Yields nothing. Asset must be added to Batch manually
+        """
+        return iter(())
@@ -0,0 +1,234 @@
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# The phases of depositing an asset that are timed: getting its size and
+# modification time, calculating its MD5 (and ETag, in the same pass),
+# calculating only its ETag (when the MD5 was known), uploading it, and
+# verifying the upload
+PHASE_STAT = 'stat'
+PHASE_HASH = 'hash'
+PHASE_ETAG = 'etag'
+PHASE_UPLOAD = 'upload'
+PHASE_VERIFY = 'verify'
+PHASES = (PHASE_STAT, PHASE_HASH, PHASE_ETAG, PHASE_UPLOAD, PHASE_VERIFY)
+
+PERCENTILES = (50, 95, 99)
+
+# Latencies are counted in buckets whose bounds grow by this factor, from
+# MIN_LATENCY, so percentiles are accurate to within about 10%
+BUCKET_FACTOR = 2 ** 0.125
+MIN_LATENCY = 0.0001
+
+# The statistics for each phase, as added to the batch stats
+STATS_FIELDS = tuple(
+    f'{phase}_{name}'
+    for phase in PHASES
+    for name in ('time', 'bytes', *(f'p{percentile}' for percentile in PERCENTILES))
+)
+
+# Minimum number of seconds between updates of the metrics file
+METRICS_INTERVAL = 15
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies in logarithmic buckets, from which percentiles can be
+    estimated without keeping every value.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        index = bucket_index(seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, percentile):
+        """
+        Returns the upper bound of the bucket containing the given percentile,
+        or None if there are no values.
+        """
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * percentile / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return bucket_bound(index)
+
+
+def bucket_index(seconds):
+    if seconds <= MIN_LATENCY:
+        return 0
+    return math.ceil(math.log(seconds / MIN_LATENCY, BUCKET_FACTOR))
+
+
+def bucket_bound(index):
+    return MIN_LATENCY * BUCKET_FACTOR ** index
+
+
+class PhaseMetrics:
+    """
+    The total time, bytes, and latency histogram of each phase, for the assets
+    of a batch.
+
+    Instances may be shared between threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {phase: LatencyHistogram() for phase in PHASES}
+        self.bytes = {phase: 0 for phase in PHASES}
+
+    def record(self, phase, seconds, nbytes=0):
+        with self._lock:
+            self.histograms[phase].add(seconds)
+            self.bytes[phase] += nbytes
+
+    @contextmanager
+    def timed(self, phase, nbytes=0):
+        """
+        Context manager recording the time taken by its body as one asset's
+        latency for the phase. Nothing is recorded if the body raises.
+        """
+        start = time.perf_counter()
+        yield
+        self.record(phase, time.perf_counter() - start, nbytes)
+
+    def stats(self):
+        """
+        Returns the statistics for each phase, as a dict with the keys in
+        STATS_FIELDS. The time of a phase is the sum of the latencies of the
+        assets, so phases that run on several threads can exceed the deposit
+        time. Percentiles are in seconds, and are empty if there are no values.
+        """
+        stats = {}
+        with self._lock:
+            for phase in PHASES:
+                histogram = self.histograms[phase]
+                stats[f'{phase}_time'] = round(histogram.total, 3)
+                stats[f'{phase}_bytes'] = self.bytes[phase]
+                for percentile in PERCENTILES:
+                    value = histogram.percentile(percentile)
+                    stats[f'{phase}_p{percentile}'] = round(value, 4) if value is not None else ''
+        return stats
+
+    def prometheus_samples(self, labels):
+        """
+        Returns the lines of the Prometheus text format for the
+        archiver_phase_seconds and archiver_phase_bytes_total metrics, as two
+        lists, with the given labels (a string such as 'batch="name"').
+        """
+        seconds = []
+        nbytes = []
+        with self._lock:
+            for phase in PHASES:
+                histogram = self.histograms[phase]
+                phase_labels = f'{labels},phase="{phase}"'
+                for percentile in PERCENTILES:
+                    value = histogram.percentile(percentile)
+                    if value is not None:
+                        seconds.append(
+                            f'archiver_phase_seconds{{{phase_labels},quantile="{percentile / 100}"}} {value:.6f}'
+                        )
+                seconds.append(f'archiver_phase_seconds_sum{{{phase_labels}}} {histogram.total:.6f}')
+                seconds.append(f'archiver_phase_seconds_count{{{phase_labels}}} {histogram.count}')
+                nbytes.append(f'archiver_phase_bytes_total{{{phase_labels}}} {self.bytes[phase]}')
+        return seconds, nbytes
+
+
+class MetricsExporter:
+    """
+    Writes the metrics and statistics of the batches being deposited to a
+    Prometheus node-exporter textfile, every METRICS_INTERVAL seconds while
+    running, and when stopped. The file is replaced atomically, so that the
+    node exporter never reads a partial file.
+    """
+
+    def __init__(self, filename, interval=METRICS_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+        self._batches = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, batch):
+        with self._lock:
+            self._batches.append(batch)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f'Unable to write {self.filename}: {e}', file=sys.stderr)
+
+    def write(self):
+        with self._lock:
+            batches = list(self._batches)
+
+        # The lines of each metric are grouped together, as the format requires
+        seconds = []
+        nbytes = []
+        stats = {}
+        for batch in batches:
+            labels = f'batch="{escape_label(batch.label)}"'
+            batch_seconds, batch_bytes = batch.metrics.prometheus_samples(labels)
+            seconds.extend(batch_seconds)
+            nbytes.extend(batch_bytes)
+            for name, value in batch.current_stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and name not in STATS_FIELDS:
+                    stats.setdefault(name, []).append(f'archiver_batch_{name}{{{labels}}} {value}')
+
+        lines = [
+            '# HELP archiver_phase_seconds Time taken by each asset in each phase of a deposit.',
+            '# TYPE archiver_phase_seconds summary',
+            *seconds,
+            '# HELP archiver_phase_bytes_total Bytes processed in each phase of a deposit.',
+            '# TYPE archiver_phase_bytes_total counter',
+            *nbytes,
+        ]
+        for name, values in stats.items():
+            lines.append(f'# TYPE archiver_batch_{name} gauge')
+            lines.extend(values)
+
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.archiver-', suffix='.prom.tmp',
+                                         delete=False) as tmp_file:
+            tmp_file.write('\n'.join(lines) + '\n')
+        os.chmod(tmp_file.name, 0o644)
+        os.replace(tmp_file.name, self.filename)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,248 @@
+import hashlib
+import os
+import tarfile
+
+from .asset import DigestBuilder, READ_BLOCK_SIZE
+
+# Default target size of a container
+DEFAULT_PACK_SIZE = '1GB'
+
+# The containers of a batch are uploaded under this prefix, below the key
+# prefix of the batch
+PACK_PREFIX = '_packed'
+
+# Columns of the results file giving the location of a packed asset: the key
+# of its container, and the offset, length and MD5 of its data within the
+# container
+PACK_FIELDS = ('CONTAINER', 'OFFSET', 'LENGTH', 'MEMBERMD5')
+
+
+class ContainerMember:
+    """
+    An asset packed into a container, and the position of its data in the
+    container. The MD5 of the data and any error reading it are set as the
+    container is read.
+    """
+    __slots__ = ('n', 'asset', 'key_path', 'info', 'header_offset', 'data_offset', 'md5', 'error')
+
+    def __init__(self, n, asset, key_path, info, header_offset, data_offset):
+        self.n = n
+        self.asset = asset
+        self.key_path = key_path
+        self.info = info
+        self.header_offset = header_offset
+        self.data_offset = data_offset
+        self.md5 = None
+        self.error = None
+
+    @property
+    def bytes(self):
+        return self.info.size
+
+    def index(self, container_key):
+        """
+        Returns the columns of the results file for the member.
+        """
+        return {
+            'CONTAINER': container_key,
+            'OFFSET': self.data_offset,
+            'LENGTH': self.info.size,
+            'MEMBERMD5': self.md5,
+        }
+
+
+class Container:
+    """
+    A tar file of assets, which is generated as it is uploaded (see "open"),
+    so that it never exists on disk. As the tar headers only depend on the
+    names, sizes and modification times of the assets, the size of the
+    container and the offset of each asset are known before it is read.
+    """
+
+    def __init__(self, key_path):
+        self.key_path = key_path
+        self.members = []
+        # Size of the headers and data of the members, with their padding
+        self.content_size = 0
+
+    def add(self, n, asset, name, key_path):
+        info = tarfile.TarInfo(name)
+        info.size = asset.bytes
+        info.mtime = asset.mtime
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='surrogateescape')
+        member = ContainerMember(n, asset, key_path, info, self.content_size, self.content_size + len(header))
+        self.members.append(member)
+        self.content_size += len(header) + padded(asset.bytes)
+        return member
+
+    @property
+    def bytes(self):
+        """
+        Size of the tar file: the members, two empty blocks marking the end
+        of the archive, and padding to a whole number of records, as written
+        by tarfile.
+        """
+        return -(-(self.content_size + 2 * tarfile.BLOCKSIZE) // tarfile.RECORDSIZE) * tarfile.RECORDSIZE
+
+    @property
+    def filename(self):
+        return os.path.basename(self.key_path)
+
+    def open(self, chunk_size=None):
+        """
+        Returns a ContainerReader for the tar file.
+        """
+        return ContainerReader(self, DigestBuilder(chunk_size))
+
+
+class ContainerReader:
+    """
+    Non-seekable file object generating the tar file of a container, which
+    feeds the bytes read through it into a DigestBuilder, for the ETag of the
+    container, and calculates the MD5 of each member.
+
+    As it cannot be seeked, S3 reads each part of the upload into memory, so
+    uploading a container holds up to one part more than the number of upload
+    threads in memory; the part size of a container is kept small for this
+    reason (see PartSizing.container_part_size).
+
+    If the file of a member is shorter than expected, the rest of its data is
+    filled with zeros, so that the offsets of the other members are correct;
+    if its size has changed in either direction, the member's error is set.
+    """
+
+    def __init__(self, container, builder):
+        self.container = container
+        self._builder = builder
+        self._chunks = self._generate()
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._buffer + b''.join(self._chunks)
+            self._buffer = b''
+            return data
+        pieces = [self._buffer]
+        length = len(self._buffer)
+        while length < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            pieces.append(chunk)
+            length += len(chunk)
+        # Only the last piece is split, so that the data is copied once
+        excess = max(length - size, 0)
+        if excess:
+            last = pieces[-1]
+            pieces[-1] = last[:len(last) - excess]
+            self._buffer = last[len(last) - excess:]
+        else:
+            self._buffer = b''
+        return b''.join(pieces)
+
+    def result(self):
+        """
+        Returns the AssetDigest of the tar file, once it has been read.
+        """
+        return self._builder.result()
+
+    def _generate(self):
+        for member in self.container.members:
+            yield self._hashed(member.info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8',
+                                                 errors='surrogateescape'))
+            yield from self._member_data(member)
+            padding = padded(member.info.size) - member.info.size
+            if padding:
+                yield self._hashed(bytes(padding))
+        trailer = self.container.bytes - self.container.content_size
+        yield self._hashed(bytes(trailer))
+
+    def _member_data(self, member):
+        md5 = hashlib.md5()
+        remaining = member.info.size
+        try:
+            with open(member.asset.local_path, 'rb') as handle:
+                while remaining > 0:
+                    data = handle.read(min(READ_BLOCK_SIZE, remaining))
+                    if not data:
+                        break
+                    md5.update(data)
+                    remaining -= len(data)
+                    yield self._hashed(data)
+                if remaining == 0 and os.fstat(handle.fileno()).st_size != member.info.size:
+                    member.error = f'the size of {member.asset.local_path} changed while it was packed'
+        except OSError as e:
+            member.error = f'unable to read {member.asset.local_path}: {e}'
+        if remaining > 0:
+            if member.error is None:
+                member.error = f'{member.asset.local_path} is shorter than expected'
+            while remaining > 0:
+                zeros = bytes(min(READ_BLOCK_SIZE, remaining))
+                remaining -= len(zeros)
+                yield self._hashed(zeros)
+        member.md5 = md5.hexdigest()
+
+    def _hashed(self, data):
+        self._builder.update(data)
+        return data
+
+
+class Packer:
+    """
+    Groups the assets smaller than the threshold into containers of about the
+    target size (in bytes), with a separate container for each key prefix.
+    Larger assets are not packed. The containers are named after the run_id,
+    so that those of different deposits of a batch do not overwrite each
+    other.
+    """
+
+    def __init__(self, threshold, target_size, run_id):
+        self.threshold = threshold
+        self.target_size = target_size
+        self.run_id = run_id
+        self._open = {}
+        self._count = 0
+
+    def accepts(self, asset):
+        return asset.bytes < self.threshold
+
+    def add(self, n, asset, key_prefix, name, key_path):
+        """
+        Add an asset to the open container for its key prefix, as a member
+        with the given name (its path in the tar file). Returns the container
+        if it has reached the target size, and so is ready to upload,
+        otherwise None.
+        """
+        container = self._open.get(key_prefix)
+        if container is None:
+            self._count += 1
+            container = self._open[key_prefix] = Container(
+                f'{key_prefix}/{PACK_PREFIX}/{self.run_id}-{self._count:05}.tar'
+            )
+        container.add(n, asset, name, key_path)
+        if container.bytes >= self.target_size:
+            del self._open[key_prefix]
+            return container
+        return None
+
+    def flush(self):
+        """
+        Returns the containers that have not reached the target size.
+        """
+        containers = list(self._open.values())
+        self._open.clear()
+        return containers
+
+
+def padded(size):
+    """
+    Returns the size rounded up to a whole number of tar blocks.
+    """
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
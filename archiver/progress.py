@@ -0,0 +1,228 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PROGRESS_TTY = 'tty'
+PROGRESS_QUIET = 'quiet'
+PROGRESS_JSON = 'json'
+PROGRESS_MODES = (PROGRESS_TTY, PROGRESS_QUIET, PROGRESS_JSON)
+DEFAULT_PROGRESS_MODE = PROGRESS_TTY
+
+# Number of seconds between progress updates, for each mode
+REFRESH_INTERVALS = {PROGRESS_TTY: 1, PROGRESS_JSON: 10}
+
+# Number of stripes of a ShardedCounter; a prime, as thread ids are aligned
+# addresses
+COUNTER_STRIPES = 31
+
+# Number of seconds over which the current throughput is averaged
+THROUGHPUT_WINDOW = 10
+
+
+class ShardedCounter:
+    """
+    Counter that can be incremented from many threads with little contention:
+    each thread adds to one of a fixed number of stripes, chosen from its
+    thread id, each with its own lock, and the stripes are summed when the
+    value is read. The number of stripes does not grow with the number of
+    threads, which s3transfer creates afresh for every upload.
+    """
+
+    def __init__(self, stripes=COUNTER_STRIPES):
+        self._stripes = [[0, threading.Lock()] for _ in range(stripes)]
+
+    def add(self, amount):
+        stripe = self._stripes[threading.get_ident() % len(self._stripes)]
+        with stripe[1]:
+            stripe[0] += amount
+
+    @property
+    def value(self):
+        return sum(stripe[0] for stripe in self._stripes)
+
+
+class UploadCallback:
+    """
+    The s3transfer progress callback for the upload of an asset. The callbacks
+    are made as the bytes are sent, many times per MB, so they only add to a
+    ShardedCounter; they are also where the upload is held back by any
+    bandwidth limiters (see archiver.bandwidth).
+    """
+
+    def __init__(self, counter, limiters=()):
+        self.counter = counter
+        self.limiters = limiters
+
+    def __call__(self, bytes_amount):
+        for limiter in self.limiters:
+            limiter.consume(bytes_amount)
+        self.counter.add(bytes_amount)
+
+
+class ProgressReporter:
+    """
+    Reports the aggregate progress of one or more deposits, at a fixed rate,
+    from a background thread: the bytes sent, the current throughput, the
+    assets being uploaded, and the bytes remaining and estimated time left
+    (for the assets that are known to be waiting).
+
+    In "tty" mode, a status line is redrawn every second; in "json" mode, a
+    JSON object is written to stderr every 10 seconds; in "quiet" mode,
+    nothing is written.
+    """
+
+    def __init__(self, mode=DEFAULT_PROGRESS_MODE, stream=None):
+        self.mode = mode
+        self.stream = stream
+        self.interval = REFRESH_INTERVALS.get(mode)
+        self._counters = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._samples = deque()
+        self.begin = time.monotonic()
+        self.total_assets = 0
+        self.total_bytes = 0
+        self.completed_assets = 0
+        self.completed_bytes = 0
+        self.uploading_assets = 0
+        self._uploaded_bytes = 0
+
+    def counter(self):
+        """
+        Returns a new ShardedCounter for the bytes sent by a deposit, which is
+        included in the bytes reported.
+        """
+        counter = ShardedCounter()
+        with self._lock:
+            self._counters.append(counter)
+        return counter
+
+    def add_expected(self, assets, nbytes):
+        """
+        Record assets waiting to be deposited, for the bytes remaining.
+        """
+        with self._lock:
+            self.total_assets += assets
+            self.total_bytes += nbytes
+
+    @contextmanager
+    def uploading(self, asset):
+        """
+        Context manager marking the asset as being uploaded.
+        """
+        with self._lock:
+            self.uploading_assets += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.uploading_assets -= 1
+                self._uploaded_bytes += asset.bytes
+
+    def asset_done(self, asset):
+        """
+        Record that an asset has been dealt with, whether it was uploaded,
+        skipped, or failed.
+        """
+        with self._lock:
+            self.completed_assets += 1
+            self.completed_bytes += asset.bytes
+
+    @property
+    def bytes_sent(self):
+        with self._lock:
+            counters = list(self._counters)
+        return sum(counter.value for counter in counters)
+
+    def snapshot(self):
+        """
+        Returns the current progress as a dict.
+        """
+        now = time.monotonic()
+        bytes_sent = self.bytes_sent
+        with self._lock:
+            self._samples.append((now, bytes_sent))
+            while len(self._samples) > 2 and now - self._samples[0][0] > THROUGHPUT_WINDOW:
+                self._samples.popleft()
+            start, start_bytes = self._samples[0]
+            throughput = (bytes_sent - start_bytes) / (now - start) if now > start else 0
+            # Bytes of assets being uploaded that have not been sent yet, or
+            # assets that are waiting
+            in_flight_sent = bytes_sent - self._uploaded_bytes
+            remaining = max(0, self.total_bytes - self.completed_bytes - max(0, in_flight_sent))
+            return {
+                'elapsed': round(now - self.begin, 1),
+                'bytes_sent': bytes_sent,
+                'throughput': round(throughput),
+                'assets_completed': self.completed_assets,
+                'assets_total': self.total_assets,
+                'assets_in_flight': self.uploading_assets,
+                'bytes_remaining': remaining,
+                'eta': round(remaining / throughput) if throughput > 0 else None,
+            }
+
+    def start(self):
+        """
+        Start reporting on a background thread.
+        """
+        if self.interval is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop reporting, and write the final progress.
+        """
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self.report(final=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def report(self, final=False):
+        progress = self.snapshot()
+        if self.mode == PROGRESS_JSON:
+            stream = self.stream or sys.stderr
+            stream.write(json.dumps(progress) + '\n')
+        elif self.mode == PROGRESS_TTY:
+            stream = self.stream or sys.stdout
+            eta = format_duration(progress['eta']) if progress['eta'] is not None else '--:--:--'
+            stream.write(
+                f'\r  [{progress["assets_completed"]}/{progress["assets_total"]} assets, '
+                f'{progress["assets_in_flight"]} uploading] '
+                f'{format_bytes(progress["bytes_sent"])} sent at {format_bytes(progress["throughput"])}/s, '
+                f'{format_bytes(progress["bytes_remaining"])} remaining, ETA {eta}' +
+                ('\n' if final else '')
+            )
+        else:
+            return
+        stream.flush()
+
+
+def format_bytes(nbytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(nbytes) < 1024:
+            return f'{nbytes:.1f}{unit}' if unit != 'B' else f'{nbytes}{unit}'
+        nbytes /= 1024
+    return f'{nbytes:.1f}TB'
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}'
@@ -0,0 +1,384 @@
+import csv
+import fnmatch
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from .bandwidth import TokenBucket
+from .batch import calculate_chunk_bytes
+from .clients import S3ClientFactory, connections_needed
+from .deposit import create_fake_s3
+from .download import DEFAULT_BLOCK_SIZE, DEFAULT_PART_THREADS, download_object, verify_download
+from .exceptions import ConfigException, FailureException
+from .fake_s3 import ARCHIVE_STORAGE_CLASSES
+
+RESTORE_TIERS = ('Bulk', 'Standard', 'Expedited')
+DEFAULT_RESTORE_TIER = 'Bulk'
+DEFAULT_RESTORE_DAYS = 7
+# Maximum number of restore requests made per second
+DEFAULT_REQUEST_RATE = 50
+DEFAULT_RESTORE_THREADS = 16
+# Seconds between checks of the restore status, when waiting for restores
+DEFAULT_POLL_INTERVAL = 900
+DEFAULT_RETRIEVE_THREADS = 4
+
+# Size of the blocks the data of packed assets is written in
+WRITE_BLOCK_SIZE = 1024 ** 2
+
+# The restore status of an object: in an archive storage class, with no
+# restore requested; being restored; restored, so that it can be downloaded;
+# not in an archive storage class, so that it can always be downloaded; or
+# not in the bucket
+STATUS_ARCHIVED = 'archived'
+STATUS_RESTORING = 'restoring'
+STATUS_RESTORED = 'restored'
+STATUS_AVAILABLE = 'available'
+STATUS_MISSING = 'missing'
+
+# The outcomes of a restore request, other than the statuses
+RESTORE_REQUESTED = 'requested'
+RESTORE_FAILED = 'failed'
+
+# Values of the RESULT column of the assets that are in the bucket
+DEPOSITED_RESULTS = ('success', 'skipped')
+
+# The outcomes of retrieving an asset
+RETRIEVED = 'retrieved'
+RETRIEVE_SKIPPED = 'skipped'
+RETRIEVE_NOT_RESTORED = 'not restored'
+RETRIEVE_FAILED = 'failed'
+
+
+class RetrievalItem:
+    """
+    An asset to retrieve, from a row of a results file: the object it is
+    stored in and, for a packed asset, the offset and length of its data in
+    that object (its container). The MD5, ETag and part size are those
+    recorded by the deposit, if any, for verifying the download.
+    """
+    __slots__ = ('key_path', 'bucket', 'key', 'offset', 'length', 'md5', 'etag', 'part_size')
+
+    def __init__(self, key_path, bucket, key, offset=None, length=None, md5=None, etag=None, part_size=None):
+        self.key_path = key_path
+        self.bucket = bucket
+        self.key = key
+        self.offset = offset
+        self.length = length
+        self.md5 = md5
+        self.etag = etag
+        self.part_size = part_size
+
+    @property
+    def packed(self):
+        return self.offset is not None
+
+    @property
+    def location(self):
+        return self.bucket, self.key
+
+    @classmethod
+    def from_row(cls, row):
+        bucket, _, key = row['STORAGELOCATION'].partition('/')
+        if not bucket or not key:
+            raise ConfigException(f'Invalid STORAGELOCATION for {row["KEYPATH"]}: {row["STORAGELOCATION"]}')
+        if row.get('CONTAINER'):
+            return cls(row['KEYPATH'], bucket, key, int(row['OFFSET']), int(row['LENGTH']), row.get('MEMBERMD5'))
+        part_size = int(row['PARTSIZE']) if row.get('PARTSIZE') else None
+        return cls(row['KEYPATH'], bucket, key, md5=row.get('MD5'), etag=row.get('ETAG'), part_size=part_size)
+
+
+def load_items(results_filenames, patterns=None):
+    """
+    Returns the RetrievalItems for the assets deposited (or found to be in
+    the bucket already) according to the results files, in the order they are listed. If an asset was
+    deposited more than once, the last deposit is used. If patterns are given,
+    only the assets whose KEYPATH matches one of them are included.
+    """
+    items = {}
+    for results_filename in results_filenames:
+        try:
+            with open(results_filename, newline='') as results_file:
+                reader = csv.DictReader(results_file)
+                missing = {'KEYPATH', 'RESULT', 'STORAGELOCATION'}.difference(reader.fieldnames or ())
+                if missing:
+                    raise ConfigException(f'{results_filename} is not a results file; it has no '
+                                          f'{", ".join(sorted(missing))} column')
+                for row in reader:
+                    if row['RESULT'] not in DEPOSITED_RESULTS:
+                        continue
+                    if patterns and not any(fnmatch.fnmatchcase(row['KEYPATH'], pattern) for pattern in patterns):
+                        continue
+                    items.pop(row['KEYPATH'], None)
+                    items[row['KEYPATH']] = RetrievalItem.from_row(row)
+        except OSError as e:
+            raise ConfigException(f'Unable to read {results_filename}: {e}') from e
+    return list(items.values())
+
+
+def unique_locations(items):
+    """
+    Returns the (bucket, key) of each object holding the items, once, as
+    packed assets share their containers.
+    """
+    return list(dict.fromkeys(item.location for item in items))
+
+
+def request_restore(s3_client, bucket, key, days, tier):
+    """
+    Request the restore of an object, returning the outcome: requested, or
+    the status of an object that cannot be restored (because it is being, or
+    has been, restored, is not archived, or is missing).
+    """
+    try:
+        response = s3_client.restore_object(
+            Bucket=bucket,
+            Key=key,
+            RestoreRequest={'Days': days, 'GlacierJobParameters': {'Tier': tier}}
+        )
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code == 'RestoreAlreadyInProgress':
+            return STATUS_RESTORING
+        if code == 'InvalidObjectState':
+            return STATUS_AVAILABLE
+        if code in ('NoSuchKey', '404'):
+            return STATUS_MISSING
+        raise
+    # A restored object has its expiry extended, and the response is 200
+    # rather than 202
+    return STATUS_RESTORED if response['ResponseMetadata']['HTTPStatusCode'] == 200 else RESTORE_REQUESTED
+
+
+def get_restore_status(s3_client, bucket, key):
+    """
+    Returns the restore status of an object, from a HEAD request.
+    """
+    try:
+        response = s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+            return STATUS_MISSING
+        raise
+    restore = response.get('Restore')
+    if restore is not None:
+        return STATUS_RESTORING if 'ongoing-request="true"' in restore else STATUS_RESTORED
+    if response.get('StorageClass', 'STANDARD') in ARCHIVE_STORAGE_CLASSES:
+        return STATUS_ARCHIVED
+    return STATUS_AVAILABLE
+
+
+def request_restores(s3_client, locations, days, tier, rate, threads):
+    """
+    Request the restore of the objects, from a pool of threads, making no more
+    than rate requests per second. Returns a dict of the outcome for each
+    location; the requests that fail are reported, and counted as failed.
+    """
+    limiter = TokenBucket(rate)
+
+    def restore_one(location):
+        limiter.consume(1)
+        try:
+            return request_restore(s3_client, *location, days, tier)
+        except ClientError as e:
+            print(f'Unable to request the restore of {"/".join(location)}: {e}', file=sys.stderr)
+            return RESTORE_FAILED
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='restore') as executor:
+        return dict(zip(locations, executor.map(restore_one, locations)))
+
+
+def poll_restores(s3_client, locations, threads):
+    """
+    Check the restore status of the objects with HEAD requests, from a pool
+    of threads. Returns a dict of the status for each location; the objects
+    whose status cannot be checked are reported, and left out.
+    """
+    def status_one(location):
+        try:
+            return get_restore_status(s3_client, *location)
+        except ClientError as e:
+            print(f'Unable to check the restore status of {"/".join(location)}: {e}', file=sys.stderr)
+            return None
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='status') as executor:
+        return {
+            location: status for location, status in zip(locations, executor.map(status_one, locations))
+            if status is not None
+        }
+
+
+def wait_for_restores(s3_client, statuses, threads, poll_interval):
+    """
+    Poll the status of the objects being restored every poll_interval
+    seconds, until none are, updating the statuses. Objects are only polled
+    until they are restored.
+    """
+    while True:
+        restoring = [location for location, status in statuses.items() if status == STATUS_RESTORING]
+        if not restoring:
+            return
+        sys.stdout.write(f'{len(restoring)} objects are being restored; checking again in {poll_interval}s\n')
+        time.sleep(poll_interval)
+        statuses.update(poll_restores(s3_client, restoring, threads))
+
+
+def count_outcomes(outcomes):
+    counts = {}
+    for outcome in outcomes:
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return counts
+
+
+def print_counts(title, counts):
+    sys.stdout.write(f'{title}:\n' + ''.join(f'  {name.capitalize()}: {n}\n' for name, n in sorted(counts.items())))
+
+
+def destination_path(output_dir, key_path):
+    """
+    Returns the path an asset is retrieved to, below the output directory.
+    """
+    relpath = os.path.normpath(key_path.lstrip('/'))
+    if relpath == os.curdir or relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+        raise ConfigException(f'Unable to retrieve {key_path} below {output_dir}')
+    return os.path.join(output_dir, relpath)
+
+
+def retrieve_item(s3_client, executor, item, path, block_size=DEFAULT_BLOCK_SIZE, window=None):
+    """
+    Download an asset to the given path, and verify it: a whole object is
+    downloaded in parallel ranges on the executor (see
+    archiver.download.download_object), while the data of a packed asset is
+    fetched from its container with a single ranged GET. The data is written
+    to a ".part" file, which is renamed once it has been verified. Returns a
+    list of fixity errors, in which case the file is removed, as it is if the
+    download fails; a later retrieval starts the download again.
+    """
+    os.makedirs(os.path.dirname(path) or os.curdir, exist_ok=True)
+    partial_path = f'{path}.part'
+    try:
+        if item.packed:
+            md5 = hashlib.md5()
+            with open(partial_path, 'wb') as output:
+                if item.length:
+                    response = s3_client.get_object(
+                        Bucket=item.bucket, Key=item.key,
+                        Range=f'bytes={item.offset}-{item.offset + item.length - 1}'
+                    )
+                    for block in iter(lambda: response['Body'].read(WRITE_BLOCK_SIZE), b''):
+                        md5.update(block)
+                        output.write(block)
+                size = output.tell()
+            errors = []
+            if size != item.length:
+                errors.append(f'downloaded {size} bytes of {item.length}')
+            if item.md5 and md5.hexdigest() != item.md5:
+                errors.append(f'MD5 {md5.hexdigest()} does not match the deposited MD5 {item.md5}')
+        else:
+            digest, head = download_object(
+                s3_client, executor, item.bucket, item.key, partial_path, item.part_size, block_size,
+                window or 2 * DEFAULT_PART_THREADS
+            )
+            errors = verify_download(digest, head, item.part_size, item.md5, item.etag)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    if errors:
+        os.remove(partial_path)
+    else:
+        os.replace(partial_path, path)
+    return errors
+
+
+def retrieve_items(s3_client, items, output_dir, threads, overwrite=False, part_threads=DEFAULT_PART_THREADS,
+                   block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Download the items below the output directory, verifying their fixity,
+    from a pool of threads; the ranges of large objects are downloaded by a
+    second pool of part_threads, shared by all the items. Unless overwrite is
+    True, assets that have already been retrieved are skipped. Returns a dict
+    of the outcome for each item's KEYPATH.
+    """
+    lock = threading.Lock()
+
+    def retrieve_one(item):
+        try:
+            path = destination_path(output_dir, item.key_path)
+            if not overwrite and os.path.exists(path):
+                return RETRIEVE_SKIPPED
+            errors = retrieve_item(s3_client, range_executor, item, path, block_size, 2 * part_threads)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'InvalidObjectState':
+                return RETRIEVE_NOT_RESTORED
+            errors = [str(e)]
+        except (ConfigException, BotoCoreError, OSError) as e:
+            errors = [str(e)]
+        with lock:
+            if errors:
+                print(f'Unable to retrieve {item.key_path}: {"; ".join(errors)}', file=sys.stderr)
+                return RETRIEVE_FAILED
+            sys.stdout.write(f'Retrieved {item.key_path}\n')
+        return RETRIEVED
+
+    with ThreadPoolExecutor(max_workers=part_threads, thread_name_prefix='range') as range_executor, \
+            ThreadPoolExecutor(max_workers=threads, thread_name_prefix='retrieve') as executor:
+        return {item.key_path: outcome for item, outcome in zip(items, executor.map(retrieve_one, items))}
+
+
+def get_client(args, concurrency):
+    """
+    Returns the S3 client for the restore and retrieve subcommands, with a
+    connection pool for concurrency requests at once: for a dry run,
+    one answered by a FakeS3 (whose objects are those stored by a dry run
+    deposit with the same --dry-run-dir, restored immediately).
+    """
+    return S3ClientFactory(
+        args.profile, connections_needed(0, concurrency), fake_s3=create_fake_s3(args)
+    ).client()
+
+
+def restore(args):
+    """Request the restore of deposited assets from Glacier."""
+    try:
+        items = load_items(args.results, args.include)
+        s3_client = get_client(args, args.threads)
+    except ConfigException as e:
+        print(e, file=sys.stderr)
+        raise FailureException from e
+    locations = unique_locations(items)
+    sys.stdout.write(f'{len(items)} assets in {len(locations)} objects\n')
+
+    if args.status:
+        statuses = poll_restores(s3_client, locations, args.threads)
+    else:
+        outcomes = request_restores(s3_client, locations, args.days, args.tier, args.rate, args.threads)
+        print_counts('Restore requests', count_outcomes(outcomes.values()))
+        statuses = {location: STATUS_RESTORING if outcome == RESTORE_REQUESTED else outcome
+                    for location, outcome in outcomes.items() if outcome != RESTORE_FAILED}
+    if args.wait:
+        wait_for_restores(s3_client, statuses, args.threads, args.poll_interval)
+    print_counts('Restore status', count_outcomes(statuses.values()))
+    if len(statuses) < len(locations) or STATUS_MISSING in statuses.values():
+        raise FailureException
+
+
+def retrieve(args):
+    """Download deposited assets that have been restored."""
+    try:
+        items = load_items(args.results, args.include)
+        block_size = calculate_chunk_bytes(args.block_size)
+        s3_client = get_client(args, args.threads + args.part_threads)
+    except ConfigException as e:
+        print(e, file=sys.stderr)
+        raise FailureException from e
+    sys.stdout.write(f'Retrieving {len(items)} assets to {args.output}\n')
+    outcomes = retrieve_items(s3_client, items, args.output, args.threads, args.overwrite, args.part_threads,
+                              block_size)
+    print_counts('Retrieved assets', count_outcomes(outcomes.values()))
+    if RETRIEVE_FAILED in outcomes.values() or RETRIEVE_NOT_RESTORED in outcomes.values():
+        raise FailureException
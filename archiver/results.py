@@ -0,0 +1,123 @@
+import csv
+import os
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS completed (
+    md5 TEXT,
+    path TEXT,
+    PRIMARY KEY (md5, path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+'''
+
+# Number of assets added between commits to the database
+COMMIT_INTERVAL = 1000
+
+
+class ResultsIndex:
+    """
+    Index of the (MD5, PATH) pairs of the assets listed in a results.csv file,
+    stored in an SQLite database next to it, so that a resumed deposit can
+    check whether an asset has been deposited without reading the whole
+    results file.
+
+    The results file remains the record of the deposits. The index is updated
+    as assets are deposited (see "add"), and is rebuilt from the results file
+    whenever the file has changed in a way the index does not know about, for
+    example if it was written by an older version of this tool, or a deposit
+    was interrupted before the index was closed.
+
+    Instances may be shared between threads.
+    """
+
+    def __init__(self, results_filename):
+        self.results_filename = results_filename
+        self.filename = os.path.splitext(results_filename)[0] + '.sqlite'
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._added = False
+        self._connection = sqlite3.connect(self.filename, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(SCHEMA)
+        self.sync()
+
+    def sync(self):
+        """
+        Rebuild the index from the results file, if the size of the file is
+        not the size recorded when the index was last closed.
+        """
+        results_size = get_size(self.results_filename)
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = 'results_size'").fetchone()
+            if row is not None and row[0] == results_size:
+                return
+
+            self._connection.execute('DELETE FROM completed')
+            if results_size:
+                with open(self.results_filename, 'r') as results_file:
+                    self._connection.executemany(
+                        'INSERT OR IGNORE INTO completed (md5, path) VALUES (?, ?)',
+                        (result_key(row) for row in csv.DictReader(results_file))
+                    )
+            self._set_results_size(results_size)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._connection.execute(
+                'SELECT 1 FROM completed WHERE md5 = ? AND path = ?', key
+            ).fetchone() is not None
+
+    def add(self, md5, path):
+        """
+        Record that the asset with the given MD5 and path has been written to
+        the results file.
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR IGNORE INTO completed (md5, path) VALUES (?, ?)', (md5, path))
+            self._added = True
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_INTERVAL:
+                self._connection.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        """
+        Commit the index. If assets were added, the current size of the results
+        file is recorded as the size the index is up-to-date with.
+        """
+        with self._lock:
+            if self._added:
+                self._set_results_size(get_size(self.results_filename))
+            self._connection.commit()
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _set_results_size(self, results_size):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('results_size', ?)", (results_size,)
+        )
+
+
+def result_key(row):
+    """
+    Returns the (MD5, PATH) key for a row of a results file. Results of
+    deposits from patsy-db manifests use the names of its columns.
+    """
+    return row.get('MD5') or row.get('md5'), row.get('PATH') or row.get('filepath')
+
+
+def get_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except FileNotFoundError:
+        return 0
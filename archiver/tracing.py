@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+
+from .metrics import LatencyHistogram, PERCENTILES
+
+# Error codes of the responses S3 sends when requests are being throttled
+THROTTLE_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'ServiceUnavailable'}
+
+# Prefix of the key used to pass the start time of a request between the
+# event handlers of a tracer
+CONTEXT_KEY = 'archiver_trace_start'
+
+# The name of the file in the log directory the summary is written to
+TRACE_FILENAME = 'requests.json'
+
+
+class OperationStats:
+    """
+    Counts and latencies of the requests for one S3 operation.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.attempts = 0
+        self.throttles = 0
+        self.status_codes = {}
+        self.latency = LatencyHistogram()
+        self.max_latency = 0.0
+
+    def summary(self):
+        """
+        Returns the statistics as a dict. A call is a single API call made by
+        the client, while attempts include the retries made by botocore.
+        """
+        latency = {f'p{percentile}': self.latency.percentile(percentile) for percentile in PERCENTILES}
+        latency['mean'] = self.latency.total / self.latency.count if self.latency.count else None
+        latency['max'] = self.max_latency
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': max(0, self.attempts - self.calls),
+            'throttles': self.throttles,
+            'status_codes': self.status_codes,
+            'latency': {name: round(value, 4) if value is not None else None for name, value in latency.items()},
+        }
+
+
+class RequestTracer:
+    """
+    Records the S3 requests made by a client, using the botocore event
+    system: for each operation, the number of API calls, the latency of each
+    call (including any retries), the number of retries, the responses that
+    were throttled (such as 503 SlowDown), and the HTTP status codes.
+
+    Several tracers may be registered with the same client, such as the
+    client shared by concurrent batches. If a function "accepts" is given,
+    only the requests for which it returns True, given their Bucket and their
+    Key (or Prefix, for listings), are traced.
+
+    Instances may be shared between threads.
+    """
+
+    def __init__(self, accepts=None):
+        self.accepts = accepts
+        self.operations = {}
+        self._lock = threading.Lock()
+        self._context_key = f'{CONTEXT_KEY}_{id(self)}'
+        self._handlers = tuple(
+            (event_name, handler, f'archiver-trace-{name}-{id(self)}') for event_name, handler, name in (
+                ('before-parameter-build.s3', self._before_parameter_build, 'before-parameter-build'),
+                ('before-call.s3', self._before_call, 'before-call'),
+                ('response-received.s3', self._response_received, 'response-received'),
+                ('after-call.s3', self._after_call, 'after-call'),
+                ('after-call-error.s3', self._after_call_error, 'after-call-error'),
+            )
+        )
+
+    def register(self, s3_client):
+        """
+        Start tracing the requests made by the client.
+        """
+        for event_name, handler, unique_id in self._handlers:
+            s3_client.meta.events.register(event_name, handler, unique_id=unique_id)
+
+    def unregister(self, s3_client):
+        """
+        Stop tracing the requests made by the client.
+        """
+        for event_name, handler, unique_id in self._handlers:
+            s3_client.meta.events.unregister(event_name, handler, unique_id=unique_id)
+
+    def summary(self):
+        """
+        Returns a dict of the statistics of each operation, by name.
+        """
+        with self._lock:
+            return {name: stats.summary() for name, stats in sorted(self.operations.items())}
+
+    def write(self, filename):
+        """
+        Write the summary of each operation as a line of JSON.
+        """
+        with open(filename, 'w') as trace_file:
+            for name, summary in self.summary().items():
+                json.dump({'operation': name, **summary}, trace_file)
+                trace_file.write('\n')
+
+    def _stats(self, operation_name):
+        stats = self.operations.get(operation_name)
+        if stats is None:
+            stats = self.operations[operation_name] = OperationStats()
+        return stats
+
+    def _before_parameter_build(self, params, context, **kwargs):
+        # Mark the calls traced by this tracer
+        if self.accepts is None or self.accepts(params.get('Bucket'), params.get('Key', params.get('Prefix', ''))):
+            context[self._context_key] = None
+
+    def _before_call(self, model, context, **kwargs):
+        if self._context_key in context:
+            context[self._context_key] = time.perf_counter()
+
+    def _response_received(self, context, parsed_response=None, response_dict=None, exception=None, **kwargs):
+        if self._context_key not in context:
+            return
+        operation_name = kwargs['event_name'].rsplit('.', 1)[-1]
+        status_code = response_dict['status_code'] if response_dict is not None else None
+        error_code = parsed_response.get('Error', {}).get('Code') if parsed_response is not None else None
+        with self._lock:
+            stats = self._stats(operation_name)
+            stats.attempts += 1
+            if status_code is not None:
+                stats.status_codes[str(status_code)] = stats.status_codes.get(str(status_code), 0) + 1
+            if status_code == 503 or error_code in THROTTLE_CODES:
+                stats.throttles += 1
+
+    def _after_call(self, http_response, model, context, **kwargs):
+        self._finish(model.name, context, error=http_response.status_code >= 300)
+
+    def _after_call_error(self, context, **kwargs):
+        self._finish(kwargs['event_name'].rsplit('.', 1)[-1], context, error=True)
+
+    def _finish(self, operation_name, context, error):
+        if self._context_key not in context:
+            return
+        start = context.pop(self._context_key)
+        with self._lock:
+            stats = self._stats(operation_name)
+            stats.calls += 1
+            if error:
+                stats.errors += 1
+            if start is not None:
+                latency = time.perf_counter() - start
+                stats.latency.add(latency)
+                stats.max_latency = max(stats.max_latency, latency)
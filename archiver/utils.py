@@ -1,3 +1,4 @@
+import csv
 import re
 
 from .exceptions import PathOutOfScopeException
@@ -8,6 +9,18 @@ def get_first_line(filename):
         return file.readline().strip()
 
 
+def get_csv_fieldnames(filename):
+    """
+    Returns the column names from the header of the given CSV file, or None if
+    the file does not exist or is empty.
+    """
+    try:
+        with open(filename, newline='') as file:
+            return next(csv.reader(file), None)
+    except FileNotFoundError:
+        return None
+
+
 def calculate_relative_path(batch_root, local_path):
     """
     Returns the relative path, i.e., the given local_path with the
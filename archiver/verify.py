@@ -0,0 +1,89 @@
+import random
+import threading
+import weakref
+
+# Verification policies: use the ETag from the response to the upload, falling
+# back to a HEAD request if it was not captured; do that but also verify a
+# random sample of the assets with a HEAD request; or always use HEAD requests.
+VERIFY_RESPONSE = 'response'
+VERIFY_SAMPLE = 'sample'
+VERIFY_HEAD = 'head'
+VERIFY_POLICIES = (VERIFY_RESPONSE, VERIFY_SAMPLE, VERIFY_HEAD)
+
+DEFAULT_VERIFY_POLICY = VERIFY_RESPONSE
+DEFAULT_VERIFY_SAMPLE_RATE = 0.05
+DEFAULT_VERIFY_THREADS = 4
+
+# The operations whose responses give the ETag of a newly uploaded object
+UPLOAD_OPERATIONS = ('PutObject', 'CompleteMultipartUpload')
+
+# Key used to pass the object location between event handlers
+CONTEXT_KEY = 'archiver_upload_location'
+
+_captures = weakref.WeakKeyDictionary()
+_captures_lock = threading.Lock()
+
+
+class UploadResponseCapture:
+    """
+    Captures the responses to the requests that complete uploads (PutObject,
+    and CompleteMultipartUpload) made by an S3 client, using the botocore
+    event system, so that the ETag of an uploaded object can be verified
+    without a separate HEAD request. Use "for_client" to get the capture for
+    a client.
+    """
+
+    def __init__(self):
+        self._responses = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_client(cls, s3_client):
+        """
+        Returns the capture for the given client, registering it with the
+        client's events on first use.
+        """
+        with _captures_lock:
+            capture = _captures.get(s3_client)
+            if capture is None:
+                capture = cls()
+                for operation in UPLOAD_OPERATIONS:
+                    s3_client.meta.events.register(
+                        f'before-parameter-build.s3.{operation}', capture._before_parameter_build,
+                        unique_id=f'archiver-capture-params-{operation}'
+                    )
+                    s3_client.meta.events.register(
+                        f'after-call.s3.{operation}', capture._after_call,
+                        unique_id=f'archiver-capture-response-{operation}'
+                    )
+                _captures[s3_client] = capture
+            return capture
+
+    def pop(self, bucket, key):
+        """
+        Returns (and forgets) the parsed response to the last request that
+        completed the upload of the given object, or None if there is none.
+        """
+        with self._lock:
+            return self._responses.pop((bucket, key), None)
+
+    def _before_parameter_build(self, params, context, **kwargs):
+        context[CONTEXT_KEY] = (params.get('Bucket'), params.get('Key'))
+
+    def _after_call(self, parsed, context, **kwargs):
+        location = context.get(CONTEXT_KEY)
+        if location is not None and 'ETag' in parsed:
+            with self._lock:
+                self._responses[location] = parsed
+
+
+def needs_head_request(policy, sample_rate, upload_response):
+    """
+    Returns True if an upload should be verified with a HEAD request under the
+    given policy, based on whether the response to the upload was captured.
+    """
+    if policy == VERIFY_HEAD or upload_response is None:
+        return True
+    elif policy == VERIFY_SAMPLE:
+        return random.random() < sample_rate
+    return False
@@ -1,15 +1,7 @@
-#!/bin/bash -x
+#!/usr/bin/env bash
+# Deprecated: use "archiver retrieve" with the results files of the deposits,
+# for example: copyfromawstolocal.sh OUTPUT_DIR logs/batch/results.csv
+OUTPUT_DIR=$1
+shift
 
-MYDIR="$(dirname "$(realpath "$0")")"
-echo "Enter the name of the file you want to read from"
-read ndir
-INPUT=$MYDIR/$ndir
-IFS=','
-[ ! -f $INPUT ] && { echo "$INPUT file not found"; exit 99; }
-while read bucketname filelocation fileserverlocation
-do
-
-aws s3 cp "s3://$bucketname/$filelocation" "$fileserverlocation"
-
-done < $INPUT
-IFS=$OLDIFS
+exec archiver retrieve --output "$OUTPUT_DIR" --results "$@"
@@ -1,10 +1,6 @@
 #!/usr/bin/env bash
+# Deprecated: use "archiver inventory --format md5sum" directly
 ROOTDIR=$1
 OUTFILE=$2
 
-echo "Writing MD5 from $ROOTDIR to $OUTFILE ..."
-
-find "$ROOTDIR"  -type f | \
-while read filepath;
-    do md5sum "$filepath" >> "$OUTFILE"
-done
\ No newline at end of file
+exec archiver inventory --format md5sum --root "$ROOTDIR" --output "$OUTFILE"
@@ -1,9 +1,13 @@
+import hashlib
+import io
 import os
+import tempfile
+import tracemalloc
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 import archiver.asset
-from archiver.asset import Asset
-from archiver.exceptions import ConfigException
+from archiver.asset import Asset, DIGEST_ALGORITHMS, DigestBuilder, HashingReader, MB, calculate_digest, read_blocks
 
 
 class TestAsset(unittest.TestCase):
@@ -27,6 +31,20 @@ class TestAsset(unittest.TestCase):
         self.assertEqual(expected_bytes, asset.bytes)
         self.assertEqual(expected_mtime, asset.mtime)
 
+    def test_manifest_row_is_stored_compactly(self):
+        sample_file_path = 'tests/data/files/sample_file_1.txt'
+        rows = [
+            {'BATCH': 'batch_1', 'PATH': sample_file_path, 'MD5': f'md5_{i}'} for i in range(2)
+        ]
+        assets = [Asset(sample_file_path, manifest_row=row) for row in rows]
+
+        self.assertFalse(hasattr(assets[0], '__dict__'))
+        self.assertEqual(rows[0], assets[0].manifest_row)
+        self.assertEqual(rows[1], assets[1].manifest_row)
+        self.assertEqual(list(rows[0].keys()), list(assets[0].manifest_row.keys()))
+        self.assertIs(assets[0]._row_fields, assets[1]._row_fields)
+        self.assertIsNone(Asset(sample_file_path).manifest_row)
+
     def test_etag_for_zero_byte_file(self):
         zero_byte_file_path = 'tests/data/files/zero_byte_file.txt'
         asset = Asset(zero_byte_file_path)
@@ -66,18 +84,18 @@ class TestAsset(unittest.TestCase):
 
         self.assertEqual('0bbe9c3c497cd97da0754e9be0f7ed59-2', etag)
 
-    def test_raises_config_error_if_chunk_size_not_multiple_of_GB(self):
+    def test_etag_for_chunk_size_not_multiple_of_GB(self):
         file_path = 'tests/data/files/sample_file_1.txt'
         asset = Asset(file_path)
 
-        # chunk_size is larger than Asset.GB, and not a multiple
-        chunk_size = archiver.asset.GB + 1
+        # Reset archiver.asset.GB to 2 bytes, so that the chunk size is larger
+        # than it, and not a multiple of it
+        archiver.asset.GB = 2
 
-        # Report file size as 2 chunks
-        mock_file_size = chunk_size * 2
-        with unittest.mock.patch('os.path.getsize', return_value=mock_file_size):
-            with self.assertRaises(ConfigException):
-                etag = asset.calculate_etag(chunk_size)
+        etag = asset.calculate_etag(3)
+
+        part_md5s = hashlib.md5(b'ABC').digest() + hashlib.md5(b'\n').digest()
+        self.assertEqual(hashlib.md5(part_md5s).hexdigest() + '-2', etag)
 
     def test_skips_md5_calculation_for_unchunked_files(self):
         file_path = 'tests/data/files/sample_file_1.txt'
@@ -86,6 +104,115 @@ class TestAsset(unittest.TestCase):
         etag = asset.calculate_etag(10)
         self.assertEqual("MD5_FROM_ASSET", etag)
 
+    def test_digest_calculates_md5_and_etag_in_single_pass(self):
+        file_path = 'tests/data/files/sample_file_1.txt'
+        asset = Asset(file_path)
+
+        with patch('archiver.asset.open', wraps=open) as mock_open:
+            digest = asset.calculate_digest(2)
+            self.assertEqual('0bbe9c3c497cd97da0754e9be0f7ed59-2', digest.etag)
+            self.assertEqual('6d0b865b7d33c81b43fabaf044a35f76', asset.md5)
+            self.assertEqual(1, mock_open.call_count)
+
+        self.assertEqual([hashlib.md5(b'AB').hexdigest(), hashlib.md5(b'C\n').hexdigest()], digest.part_md5s)
+        self.assertIs(digest, asset.calculate_digest(2))
+
+    def test_digest_uses_multipart_etag_when_size_equals_chunk_size(self):
+        digest = Asset('tests/data/files/sample_file_1.txt').calculate_digest(4)
+        part_md5 = hashlib.md5(b'ABC\n').digest()
+        self.assertEqual(hashlib.md5(part_md5).hexdigest() + '-1', digest.etag)
+
+    def test_digest_is_independent_of_block_size(self):
+        data = os.urandom(3 * MB + 17)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            expected = calculate_digest(f.name, MB)
+            for block_size in (1000, 4096, MB, 4 * MB):
+                digest = calculate_digest(f.name, MB, block_size=block_size)
+                self.assertEqual(hashlib.md5(data).hexdigest(), digest.md5)
+                self.assertEqual(expected.etag, digest.etag)
+
+    def test_all_digests_in_one_pass(self):
+        data = os.urandom(3 * MB + 17)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            expected = calculate_digest(f.name, MB)
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                for executor in (None, executor):
+                    digest = calculate_digest(f.name, MB, block_size=MB // 2, algorithms=DIGEST_ALGORITHMS,
+                                              executor=executor)
+                    self.assertEqual(expected.md5, digest.md5)
+                    self.assertEqual(expected.etag, digest.etag)
+                    self.assertEqual(hashlib.sha1(data).hexdigest(), digest.sha1)
+                    self.assertEqual(hashlib.sha256(data).hexdigest(), digest.sha256)
+            self.assertIsNone(expected.sha256)
+            self.assertFalse(expected.includes(['sha256']))
+
+    def test_asset_checksums(self):
+        sample_file_path = 'tests/data/files/sample_file_1.txt'
+        with open(sample_file_path, 'rb') as f:
+            data = f.read()
+        asset = Asset(sample_file_path)
+        asset.calculate_digest(chunk_size=4)
+        with patch('archiver.asset.calculate_digest', wraps=archiver.asset.calculate_digest) as mock:
+            self.assertEqual(hashlib.sha256(data).hexdigest(), asset.sha256)
+            self.assertEqual(hashlib.sha1(data).hexdigest(), asset.sha1)
+            # A single pass, which keeps the part MD5s
+            mock.assert_called_once()
+        self.assertEqual(4, asset.digest.chunk_size)
+        self.assertEqual(hashlib.md5(data).hexdigest(), asset.md5)
+
+    def test_read_blocks_reuses_buffer(self):
+        blocks = list(block.obj for block in read_blocks(io.BytesIO(b'abcdefg'), block_size=3))
+        self.assertEqual(3, len(blocks))
+        self.assertTrue(all(block is blocks[0] for block in blocks))
+
+    def test_hashing_memory_is_bounded_by_block_size(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(os.urandom(16 * MB))
+            f.flush()
+            tracemalloc.start()
+            try:
+                calculate_digest(f.name, 4 * MB, block_size=MB)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        self.assertLess(peak, 2 * MB)
+
+    def test_digest_builder_splits_parts_across_updates(self):
+        builder = DigestBuilder(3)
+        for data in (b'a', b'bcdefg', b'', b'hi'):
+            builder.update(data)
+        digest = builder.result()
+        self.assertEqual(9, digest.size)
+        self.assertEqual(hashlib.md5(b'abcdefghi').hexdigest(), digest.md5)
+        self.assertEqual([hashlib.md5(p).hexdigest() for p in (b'abc', b'def', b'ghi')], digest.part_md5s)
+
+    def test_hashing_reader_ignores_reread_bytes(self):
+        reader = HashingReader(io.BytesIO(b'abcdefghi'), DigestBuilder(4))
+        self.assertEqual(b'abcde', reader.read(5))
+        # Simulate a retried request re-reading part of the data
+        reader.seek(2)
+        self.assertEqual(b'cdefg', reader.read(5))
+        self.assertEqual(b'hi', reader.read())
+
+        digest = reader.result(expected_size=9)
+        self.assertEqual(hashlib.md5(b'abcdefghi').hexdigest(), digest.md5)
+        self.assertEqual([hashlib.md5(p).hexdigest() for p in (b'abcd', b'efgh', b'i')], digest.part_md5s)
+
+    def test_hashing_reader_returns_none_for_incomplete_reads(self):
+        reader = HashingReader(io.BytesIO(b'abcdefghi'), DigestBuilder(4))
+        reader.read(2)
+        reader.seek(4)
+        reader.read()
+        self.assertIsNone(reader.result())
+
+        reader = HashingReader(io.BytesIO(b'abcdefghi'), DigestBuilder(4))
+        reader.read(5)
+        self.assertIsNone(reader.result(expected_size=9))
+
     def tearDown(self) -> None:
         # Restore the "archiver.asset.GB" to its original value,
         # in case it was modified in a test.
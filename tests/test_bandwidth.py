@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from archiver.bandwidth import BandwidthGovernor, TokenBucket, parse_rate, parse_schedule
+from archiver.exceptions import ConfigException
+
+
+class TestBandwidth(unittest.TestCase):
+    def test_parse_rate(self):
+        self.assertEqual(10 * 1024 ** 2, parse_rate('10MB'))
+        self.assertEqual(512 * 1024, parse_rate('512KB/s'))
+        self.assertEqual(1024 ** 3 // 2, parse_rate('0.5GB'))
+        self.assertIsNone(parse_rate('unlimited'))
+        self.assertIsNone(parse_rate(None))
+        with self.assertRaises(ConfigException):
+            parse_rate('10 bytes')
+
+    def test_scheduled_rate(self):
+        governor = BandwidthGovernor(rate=parse_rate('10MB'),
+                                     schedule=parse_schedule('22:00-06:00=100MB,12:00-13:00=unlimited'))
+        self.assertEqual(parse_rate('100MB'), governor.scheduled_rate(datetime(2020, 1, 1, 23, 30)))
+        self.assertEqual(parse_rate('100MB'), governor.scheduled_rate(datetime(2020, 1, 1, 5, 59)))
+        self.assertEqual(parse_rate('10MB'), governor.scheduled_rate(datetime(2020, 1, 1, 6, 0)))
+        self.assertIsNone(governor.scheduled_rate(datetime(2020, 1, 1, 12, 30)))
+
+    def test_control_file_overrides_rate(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            control_filename = os.path.join(tmp_dir, 'bandwidth')
+            governor = BandwidthGovernor(rate=parse_rate('10MB'), control_file=control_filename)
+            self.assertEqual(parse_rate('10MB'), governor.rate)
+
+            with open(control_filename, 'w') as control_file:
+                control_file.write('1MB\n')
+            governor.request_refresh()
+            governor.consume(1)
+            self.assertEqual(parse_rate('1MB'), governor.rate)
+
+            os.remove(control_filename)
+            governor.refresh()
+            self.assertEqual(parse_rate('10MB'), governor.rate)
+
+    def test_token_bucket_delays_consumers(self):
+        bucket = TokenBucket(1000)
+        with patch('archiver.bandwidth.time.sleep') as sleep:
+            # The first second's worth is available at once
+            bucket.consume(1000)
+            sleep.assert_not_called()
+            bucket.consume(500)
+            self.assertAlmostEqual(0.5, sleep.call_args.args[0], places=1)
+
+        unlimited = TokenBucket()
+        with patch('archiver.bandwidth.time.sleep') as sleep:
+            unlimited.consume(10 ** 9)
+            sleep.assert_not_called()
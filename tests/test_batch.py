@@ -1,6 +1,18 @@
+import csv
+import hashlib
 import os
+import tempfile
+import threading
 import unittest
-from archiver.batch import Batch
+from unittest.mock import MagicMock, patch
+
+import boto3
+from botocore.stub import Stubber
+
+from archiver.asset import Asset, GB, MB
+from archiver.batch import Batch, PartSizing, choose_part_size, MAX_PARTS, MAX_PART_SIZE, MIN_PART_SIZE
+from archiver.budget import DepositBudget
+from archiver.exceptions import ConfigException
 from archiver.manifests.manifest_factory import ManifestFactory
 
 
@@ -54,3 +66,271 @@ class TestBatch(unittest.TestCase):
         self.assertEqual(1, batch.stats['assets_found'])
         asset = batch.contents[0]
         self.assertEqual('test/specific/relpath/sample_file_1.txt', asset.relpath)
+
+    def create_md5sum_manifest(self, tmp_dir, count):
+        lines = []
+        for i in range(count):
+            path = os.path.join(tmp_dir, f'file_{i}.txt')
+            data = f'content {i}\n'.encode()
+            with open(path, 'wb') as f:
+                f.write(data)
+            lines.append(f'{hashlib.md5(data).hexdigest()}  {path}\n')
+        manifest_filename = os.path.join(tmp_dir, 'manifest.txt')
+        with open(manifest_filename, 'w') as f:
+            f.writelines(lines)
+        return manifest_filename
+
+    def test_concurrent_deposit_dry_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_filename = self.create_md5sum_manifest(tmp_dir, 10)
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, log_dir='logs')
+            manifest.load_manifest(batch.results_filename, batch)
+            batch.deposit(profile_name='default', max_threads=2, max_assets=4, dry_run=True)
+
+            self.assertEqual(10, batch.stats['assets_transmitted'])
+            self.assertEqual(10, batch.stats['successful_deposits'])
+            self.assertEqual(0, batch.stats['failed_deposits'])
+            with open(batch.results_filename) as results_file:
+                rows = list(csv.DictReader(results_file))
+            self.assertEqual(10, len(rows))
+            self.assertEqual(set(range(1, 11)), {int(row['ID']) for row in rows})
+            with open(os.path.join(batch.log_dir, 'assets.json')) as json_log:
+                self.assertEqual(10, len(json_log.readlines()))
+
+    def test_hash_on_upload_deposit_dry_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lines = []
+            contents = {'empty.bin': b'', 'single.bin': os.urandom(1000), 'multipart.bin': os.urandom(11 * MB)}
+            for name, data in contents.items():
+                path = os.path.join(tmp_dir, name)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                lines.append(f'{hashlib.md5(data).hexdigest()}  {path}\n')
+            manifest_filename = os.path.join(tmp_dir, 'manifest.txt')
+            with open(manifest_filename, 'w') as f:
+                f.writelines(lines)
+
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, name='batch',
+                          log_dir=os.path.join(tmp_dir, 'logs'))
+            manifest.load_manifest(batch.results_filename, batch)
+            batch.deposit(profile_name='default', chunk_size='5MB', max_assets=3, hash_on_upload=True, dry_run=True)
+
+            self.assertEqual(3, batch.stats['successful_deposits'])
+            self.assertEqual(0, batch.stats['failed_deposits'])
+            with open(batch.results_filename) as results_file:
+                rows = {row['KEYPATH']: row for row in csv.DictReader(results_file)}
+            self.assertEqual({f'batch/{name}' for name in contents}, set(rows))
+            self.assertTrue(rows['batch/multipart.bin']['ETAG'].endswith('-3'))
+            self.assertEqual(hashlib.md5(b'').hexdigest(), rows['batch/empty.bin']['ETAG'])
+
+    def test_hash_assets(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest = ManifestFactory.create(None)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, log_dir=tmp_dir)
+            for i in range(6):
+                path = os.path.join(tmp_dir, f'file_{i}.txt')
+                with open(path, 'wb') as f:
+                    f.write(b'x' * i)
+                batch.add_asset(path)
+            os.remove(os.path.join(tmp_dir, 'file_5.txt'))
+
+            batch.hash_assets(PartSizing(chunk_bytes=2), max_workers=3)
+
+            self.assertEqual(6, batch.stats['total_assets'])
+            self.assertEqual(5, batch.stats['assets_found'])
+            self.assertEqual(1, batch.stats['assets_missing'])
+            self.assertEqual(5, len(batch.contents))
+            for i, asset in enumerate(batch.contents):
+                self.assertEqual(hashlib.md5(b'x' * i).hexdigest(), asset.md5)
+                self.assertEqual(2, asset.digest.chunk_size)
+
+    def test_streaming_deposit_dry_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_filename = self.create_md5sum_manifest(tmp_dir, 10)
+            with open(manifest_filename, 'a') as f:
+                f.write(f'0123456789abcdef0123456789abcdef  {tmp_dir}/missing_file.txt\n')
+
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, log_dir='logs')
+            assets = batch.stream_manifest()
+            self.assertEqual(0, batch.stats['total_assets'])
+
+            batch.deposit(profile_name='default', max_assets=3, hash_workers=2, dry_run=True, assets=assets)
+
+            self.assertEqual([], batch.contents)
+            self.assertEqual(11, batch.stats['total_assets'])
+            self.assertEqual(10, batch.stats['assets_found'])
+            self.assertEqual(1, batch.stats['assets_missing'])
+            self.assertEqual(10, batch.stats['successful_deposits'])
+            with open(batch.results_filename) as results_file:
+                rows = list(csv.DictReader(results_file))
+            self.assertEqual(10, len(rows))
+            self.assertIn('MD5', rows[0])
+
+            # A second run skips the assets that have been deposited
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, log_dir='logs')
+            batch.deposit(profile_name='default', dry_run=True, assets=batch.stream_manifest())
+            self.assertEqual(1, batch.stats['total_assets'])
+            self.assertEqual(0, batch.stats['assets_transmitted'])
+
+    def test_prefetch_stops_when_consumer_stops(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_filename = self.create_md5sum_manifest(tmp_dir, 1)
+            batch = Batch(ManifestFactory.create(manifest_filename), bucket='test_bucket', asset_root=tmp_dir,
+                          log_dir=tmp_dir)
+            path = os.path.join(tmp_dir, 'file_0.txt')
+            read = []
+            closed = threading.Event()
+
+            def assets():
+                try:
+                    for i in range(1000):
+                        read.append(i)
+                        yield Asset(path)
+                finally:
+                    closed.set()
+
+            prefetched = batch.prefetch_assets(assets(), PartSizing(chunk_bytes=MB), hash_workers=2, queue_size=2)
+            next(prefetched)
+            prefetched.close()
+            self.assertTrue(closed.wait(5))
+            self.assertLess(len(read), 10)
+
+    def test_preflight_skips_assets_in_bucket(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_filename = self.create_md5sum_manifest(tmp_dir, 3)
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, name='batch', log_dir='logs')
+            manifest.load_manifest(batch.results_filename, batch)
+            contents = {asset.filename: asset for asset in batch.contents}
+
+            s3_client = MagicMock()
+            s3_client.get_paginator.return_value.paginate.return_value = [
+                {'Contents': [
+                    # Already deposited
+                    {'Key': 'batch/file_0.txt', 'Size': contents['file_0.txt'].bytes,
+                     'ETag': f'"{contents["file_0.txt"].md5}"'},
+                    # Different content
+                    {'Key': 'batch/file_1.txt', 'Size': contents['file_1.txt'].bytes, 'ETag': '"0000"'},
+                ]},
+                {'Contents': [{'Key': 'batch/other.txt', 'Size': 1, 'ETag': '"1111"'}]},
+            ]
+            s3_client.head_object.side_effect = lambda Bucket, Key: {
+                'ResponseMetadata': {'HTTPHeaders': {'etag': f'"{contents[os.path.basename(Key)].md5}"'}}
+            }
+            with patch('archiver.batch.get_s3_client', return_value=s3_client):
+                batch.deposit(profile_name='default', preflight=True)
+
+            s3_client.get_paginator.assert_called_once_with('list_objects_v2')
+            s3_client.get_paginator.return_value.paginate.assert_called_once_with(
+                Bucket='test_bucket', Prefix='batch/', PaginationConfig={'PageSize': 1000}
+            )
+            uploaded = sorted(call.args[2] for call in s3_client.upload_file.call_args_list)
+            self.assertEqual(['batch/file_1.txt', 'batch/file_2.txt'], uploaded)
+            self.assertEqual(1, batch.stats['assets_skipped'])
+            self.assertEqual(2, batch.stats['successful_deposits'])
+            with open(batch.results_filename) as results_file:
+                results = {row['KEYPATH']: row['RESULT'] for row in csv.DictReader(results_file)}
+            self.assertEqual('skipped', results['batch/file_0.txt'])
+
+    def test_deposit_verifies_upload_response(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_filename = self.create_md5sum_manifest(tmp_dir, 2)
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, name='batch', log_dir='logs')
+            manifest.load_manifest(batch.results_filename, batch)
+            contents = {asset.filename: asset for asset in batch.contents}
+
+            s3_client = boto3.client(
+                's3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test'
+            )
+            with Stubber(s3_client) as stubber:
+                # The second asset uploaded gets a mismatched ETag; no HEAD requests are expected
+                for etag in (contents['file_0.txt'].md5, '0000'):
+                    stubber.add_response('put_object', {'ETag': f'"{etag}"'})
+                with patch('archiver.batch.get_s3_client', return_value=s3_client):
+                    batch.deposit(profile_name='default', chunk_size='1GB')
+                stubber.assert_no_pending_responses()
+
+            self.assertEqual(0, batch.stats['head_requests'])
+            self.assertEqual(1, batch.stats['successful_deposits'])
+            self.assertEqual(1, batch.stats['failed_deposits'])
+
+    def test_choose_part_size(self):
+        # Small files use the minimum part size
+        self.assertEqual(MIN_PART_SIZE, choose_part_size(1, 100))
+        # Part sizes are rounded up to whole MB
+        self.assertEqual(11 * MB, choose_part_size(GB, 100))
+        # Limited to 10000 parts
+        self.assertEqual(52 * MB, choose_part_size(500 * GB, 1000000))
+        self.assertLessEqual(-(-500 * GB // choose_part_size(500 * GB, 1000000)), MAX_PARTS)
+        # Limited to 5GB parts
+        self.assertEqual(MAX_PART_SIZE, choose_part_size(5000 * GB, 100))
+
+    def test_part_sizing(self):
+        fixed = PartSizing(chunk_bytes=GB, max_threads=10)
+        self.assertEqual(GB, fixed.part_size(100))
+        self.assertIs(fixed.transfer_config(GB), fixed.transfer_config(GB))
+        self.assertEqual(GB, fixed.transfer_config(GB).multipart_chunksize)
+
+        # The thread budget sets the minimum number of parts
+        auto = PartSizing(target_parts=4, max_threads=10)
+        self.assertEqual(10 * MB, auto.part_size(100 * MB))
+        self.assertEqual(10 * MB, auto.transfer_config(10 * MB).multipart_threshold)
+        self.assertEqual(10, auto.transfer_config(10 * MB).max_concurrency)
+        self.assertEqual(2, auto.transfer_config(10 * MB, 2).max_concurrency)
+        self.assertEqual(2, auto.transfer_config(10 * MB, 2).max_in_memory_upload_chunks)
+
+    def test_upload_uses_reserved_threads(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'file.bin')
+            data = os.urandom(11 * MB)
+            with open(path, 'wb') as f:
+                f.write(data)
+            manifest_filename = os.path.join(tmp_dir, 'manifest.txt')
+            with open(manifest_filename, 'w') as f:
+                f.write(f'{hashlib.md5(data).hexdigest()}  {path}\n')
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, name='batch', log_dir='logs')
+            manifest.load_manifest(batch.results_filename, batch)
+
+            transfer_config = PartSizing.transfer_config
+            with patch.object(PartSizing, 'transfer_config', autospec=True,
+                              side_effect=transfer_config) as mock_transfer_config:
+                batch.deposit(profile_name='default', chunk_size='5MB', max_threads=10,
+                              budget=DepositBudget(max_threads=2), dry_run=True)
+
+            self.assertEqual(1, batch.stats['successful_deposits'])
+            self.assertEqual({2}, {call.args[2] for call in mock_transfer_config.call_args_list})
+
+    def test_auto_part_size_deposit_dry_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_filename = self.create_md5sum_manifest(tmp_dir, 2)
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, name='batch', log_dir='logs')
+            manifest.load_manifest(batch.results_filename, batch)
+            batch.deposit(profile_name='default', chunk_size='auto', dry_run=True)
+
+            self.assertEqual(2, batch.stats['successful_deposits'])
+            with open(batch.results_filename) as results_file:
+                part_sizes = {row['PARTSIZE'] for row in csv.DictReader(results_file)}
+            self.assertEqual({str(MIN_PART_SIZE)}, part_sizes)
+
+    def test_deposit_rejects_results_without_part_sizes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manifest_filename = self.create_md5sum_manifest(tmp_dir, 2)
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='test_bucket', asset_root=tmp_dir, name='batch', log_dir='logs')
+            with open(batch.results_filename, 'w') as results_file:
+                results_file.write('ID,MD5,FILEPATH,KEYPATH,ETAG,RESULT,STORAGEPROVIDER,STORAGELOCATION\n')
+            manifest.load_manifest(batch.results_filename, batch)
+            with self.assertRaises(ConfigException):
+                batch.deposit(profile_name='default', dry_run=True)
+
+    def test_deposit_rejects_invalid_chunk_size(self):
+        manifest = ManifestFactory.create('tests/data/manifests/sample_md5sum_manifest.txt')
+        batch = Batch(manifest, bucket='test_bucket', asset_root='/', log_dir='/tmp')
+        with self.assertRaises(ConfigException):
+            batch.deposit(profile_name='default', chunk_size='1MB', dry_run=True)
@@ -0,0 +1,23 @@
+import json
+import os
+import tempfile
+import unittest
+
+from archiver.benchmark import BENCHMARKS, MANIFEST_FORMATS, TREES, compare, main
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_and_compare(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'results.json')
+            self.assertEqual(0, main(['-o', output, '-s', '0.005', '-r', '1', '-d', os.path.join(tmp_dir, 'trees')]))
+            with open(output) as results_file:
+                report = json.load(results_file)
+
+        cases = {(entry['benchmark'], entry['case']) for entry in report['results']}
+        self.assertEqual(len(TREES) * 3 + len(MANIFEST_FORMATS), len(cases))
+        self.assertEqual(set(BENCHMARKS), {benchmark for benchmark, _ in cases})
+
+        slower = [dict(entry, seconds=entry['seconds'] * 2 + 1) for entry in report['results']]
+        self.assertEqual(len(slower), len(compare(slower, report, tolerance=0.25)))
+        self.assertEqual([], compare(report['results'], report, tolerance=0.25))
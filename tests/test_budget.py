@@ -0,0 +1,34 @@
+import threading
+import unittest
+
+from archiver.budget import DepositBudget
+
+
+class TestDepositBudget(unittest.TestCase):
+    def test_reserve_waits_for_bytes(self):
+        budget = DepositBudget(max_threads=4, max_bytes=100)
+        reserved = threading.Event()
+
+        def reserve():
+            with budget.reserve(1, 60):
+                reserved.set()
+
+        with budget.reserve(2, 60):
+            thread = threading.Thread(target=reserve)
+            thread.start()
+            self.assertFalse(reserved.wait(0.1))
+            self.assertEqual((2, 60), (budget.threads_in_use, budget.bytes_in_flight))
+        thread.join()
+        self.assertTrue(reserved.is_set())
+        self.assertEqual((0, 0), (budget.threads_in_use, budget.bytes_in_flight))
+
+    def test_reserve_reduces_requests_to_the_limits(self):
+        budget = DepositBudget(max_threads=4, max_bytes=100)
+        with budget.reserve(10, 1000) as threads:
+            self.assertEqual(4, threads)
+            self.assertEqual((4, 100), (budget.threads_in_use, budget.bytes_in_flight))
+
+    def test_unlimited_budget(self):
+        budget = DepositBudget()
+        with budget.reserve(10, 1000), budget.reserve(10, 1000):
+            self.assertEqual((20, 2000), (budget.threads_in_use, budget.bytes_in_flight))
@@ -0,0 +1,59 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from archiver.asset import Asset
+from archiver.cache import HashCache
+
+
+class TestHashCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = HashCache(os.path.join(self.tmp_dir.name, 'cache', 'hashes.sqlite'))
+        self.file_path = os.path.join(self.tmp_dir.name, 'file.txt')
+        with open(self.file_path, 'wb') as f:
+            f.write(b'ABC\n')
+
+    def test_cached_digest_skips_hashing(self):
+        digest = Asset(self.file_path, hash_cache=self.cache).calculate_digest(2)
+
+        with patch('archiver.asset.calculate_digest') as mock_calculate_digest:
+            asset = Asset(self.file_path, hash_cache=self.cache)
+            cached_digest = asset.calculate_digest(2)
+            self.assertEqual(digest.etag, cached_digest.etag)
+            self.assertEqual(digest.md5, asset.md5)
+            self.assertEqual('6d0b865b7d33c81b43fabaf044a35f76', Asset(self.file_path, hash_cache=self.cache).md5)
+            mock_calculate_digest.assert_not_called()
+
+    def test_changed_file_invalidates_entry(self):
+        Asset(self.file_path, hash_cache=self.cache).calculate_digest(2)
+        with open(self.file_path, 'wb') as f:
+            f.write(b'ABCD\n')
+        os.utime(self.file_path, ns=(0, 0))
+
+        self.assertIsNone(self.cache.get(self.file_path, os.stat(self.file_path), 2))
+        asset = Asset(self.file_path, hash_cache=self.cache)
+        self.assertEqual(hashlib.md5(b'ABCD\n').hexdigest(), asset.md5)
+
+    def test_missing_chunk_size_is_a_miss(self):
+        Asset(self.file_path, hash_cache=self.cache).calculate_digest(2)
+        self.assertIsNone(self.cache.get(self.file_path, os.stat(self.file_path), 3))
+        # Unchunked files only need the MD5
+        self.assertEqual('6d0b865b7d33c81b43fabaf044a35f76',
+                         self.cache.get(self.file_path, os.stat(self.file_path), 10).etag)
+
+    def test_prune(self):
+        Asset(self.file_path, hash_cache=self.cache).calculate_digest(2)
+        self.assertEqual(0, self.cache.prune(max_age=3600))
+        self.assertEqual(1, self.cache.prune(max_age=-1))
+        self.assertIsNone(self.cache.get(self.file_path, os.stat(self.file_path)))
+
+        Asset(self.file_path, hash_cache=self.cache).calculate_digest(2)
+        os.remove(self.file_path)
+        self.assertEqual(1, self.cache.prune(remove_missing=True))
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
@@ -0,0 +1,35 @@
+import unittest
+
+from archiver.clients import DEFAULT_POOL_CONNECTIONS, POOL_HEADROOM, S3ClientFactory, connections_needed
+from archiver.deposit import run_connections
+from archiver.fake_s3 import FakeS3
+
+
+class TestConnectionsNeeded(unittest.TestCase):
+    def test_connections_needed(self):
+        self.assertEqual(DEFAULT_POOL_CONNECTIONS, connections_needed(1, 1))
+        self.assertEqual(4 * 10 + 4 + POOL_HEADROOM, connections_needed(4 * 10, 4))
+        self.assertEqual(16 + 4 + POOL_HEADROOM, connections_needed(4 * 10, 4, max_upload_threads=16))
+
+    def test_run_connections(self):
+        configs = [
+            {'max_assets': 4, 'max_threads': 10},
+            {'max_assets': 2, 'max_threads': 8, 'verify_threads': 8},
+            {},
+        ]
+        # The two batches with the most uploads and verify requests at once
+        self.assertEqual(40 + 16 + 12 + POOL_HEADROOM, run_connections(configs, 2))
+        self.assertEqual(30 + 12 + POOL_HEADROOM, run_connections(configs, 2, max_total_threads='30'))
+
+
+class TestS3ClientFactory(unittest.TestCase):
+    def test_shared_client(self):
+        fake_s3 = FakeS3()
+        factory = S3ClientFactory(max_pool_connections=64, tcp_keepalive=True, fake_s3=fake_s3)
+        s3_client = factory.client()
+        self.assertIs(s3_client, factory.client())
+        self.assertEqual(64, s3_client.meta.config.max_pool_connections)
+        self.assertTrue(s3_client.meta.config.tcp_keepalive)
+
+        s3_client.put_object(Bucket='bucket', Key='key', Body=b'data')
+        self.assertIn(('bucket', 'key'), fake_s3.objects)
@@ -0,0 +1,64 @@
+import csv
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from argparse import Namespace
+from unittest.mock import patch
+
+import yaml
+
+from archiver.cache import HashCache
+from archiver.deposit import batch_deposit
+
+
+class TestBatchDeposit(unittest.TestCase):
+    def test_concurrent_batch_deposit_dry_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            batches = []
+            for b in range(3):
+                batch_dir = os.path.join(tmp_dir, f'batch_{b}')
+                os.mkdir(batch_dir)
+                with open(os.path.join(batch_dir, 'manifest.txt'), 'w') as manifest_file:
+                    for i in range(2):
+                        path = os.path.join(batch_dir, f'file_{i}.txt')
+                        data = f'batch {b} file {i}\n'.encode()
+                        with open(path, 'wb') as f:
+                            f.write(data)
+                        manifest_file.write(f'{hashlib.md5(data).hexdigest()}  {path}\n')
+                batches.append({'path': f'batch_{b}', 'bucket': 'test_bucket', 'asset_root': batch_dir,
+                                'name': f'batch_{b}', 'chunk_size': 'auto', 'max_assets': 2,
+                                'trace_requests': True})
+
+            batches_filename = os.path.join(tmp_dir, 'batches.yml')
+            with open(batches_filename, 'w') as batches_file:
+                yaml.safe_dump({'batches_dir': tmp_dir, 'max_batches': 2, 'max_total_threads': '2',
+                                'max_bytes_in_flight': '10MB', 'metrics_file': os.path.join(tmp_dir, 'archiver.prom'),
+                                'hash_cache': os.path.join(tmp_dir, 'hashes.sqlite'), 'batches': batches},
+                               batches_file)
+
+            s3_dir = os.path.join(tmp_dir, 's3')
+            with patch.object(HashCache, 'close', autospec=True, side_effect=HashCache.close) as close:
+                batch_deposit(Namespace(batches_file=batches_filename, profile='default', progress='quiet',
+                                        dry_run=True, dry_run_dir=s3_dir, dry_run_latency=0.001,
+                                        dry_run_bandwidth='100MB', dry_run_error_rate=None))
+            close.assert_called_once()
+
+            with open(os.path.join(tmp_dir, 'stats.csv')) as stats_file:
+                stats = {row['batch_name']: row for row in csv.DictReader(stats_file)}
+            self.assertEqual({'batch_0', 'batch_1', 'batch_2'}, set(stats))
+            for row in stats.values():
+                self.assertEqual('2', row['successful_deposits'])
+                self.assertNotEqual('', row['upload_p50'])
+            with open(os.path.join(tmp_dir, 'archiver.prom')) as metrics_file:
+                self.assertIn('archiver_batch_successful_deposits{batch="batch_2"} 2', metrics_file.read())
+            for b in range(3):
+                self.assertTrue(os.path.exists(os.path.join(tmp_dir, f'batch_{b}', 'logs', 'results.csv')))
+                # Each batch traced its own uploads, of its two files
+                with open(os.path.join(tmp_dir, f'batch_{b}', 'logs', 'requests.json')) as trace_file:
+                    calls = {line['operation']: line['calls'] for line in map(json.loads, trace_file)}
+                self.assertEqual(2, calls['PutObject'])
+                # The dry run stored the uploaded objects
+                with open(os.path.join(s3_dir, 'objects', 'test_bucket', f'batch_{b}', 'file_1.txt')) as f:
+                    self.assertEqual(f'batch {b} file 1\n', f.read())
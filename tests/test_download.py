@@ -0,0 +1,77 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
+
+from archiver.asset import MB
+from archiver.download import block_ranges, download_object, verify_download
+from archiver.fake_s3 import FakeS3
+
+
+class TestBlockRanges(unittest.TestCase):
+    def test_ranges_aligned_to_parts(self):
+        self.assertEqual([(0, 4), (4, 5), (5, 9), (9, 10), (10, 12)], block_ranges(12, part_size=5, block_size=4))
+        self.assertEqual([(0, 4), (4, 8), (8, 12)], block_ranges(12, block_size=4))
+        self.assertEqual([], block_ranges(0, part_size=5))
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fake_s3 = FakeS3(os.path.join(self.tmp_dir.name, 's3'))
+        self.s3_client = self.fake_s3.client()
+        self.data = os.urandom(11 * MB + 123)
+        path = os.path.join(self.tmp_dir.name, 'source.bin')
+        with open(path, 'wb') as f:
+            f.write(self.data)
+        self.md5 = hashlib.md5(self.data).hexdigest()
+        config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+        self.s3_client.upload_file(path, 'bucket', 'key', ExtraArgs={'Metadata': {'md5': self.md5}}, Config=config)
+        self.etag = self.fake_s3.objects[('bucket', 'key')].etag
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.tmp_dir.cleanup()
+
+    def download(self, **kwargs):
+        path = os.path.join(self.tmp_dir.name, 'download.bin')
+        digest, head = download_object(self.s3_client, self.executor, 'bucket', 'key', path, **kwargs)
+        with open(path, 'rb') as f:
+            return f.read(), digest, head
+
+    def test_parallel_download(self):
+        data, digest, head = self.download(part_size=5 * MB, block_size=2 * MB, window=3)
+        self.assertEqual(self.data, data)
+        self.assertEqual(self.md5, digest.md5)
+        self.assertEqual(self.etag, digest.etag)
+        self.assertTrue(self.etag.endswith('-3'))
+        self.assertEqual([], verify_download(digest, head, 5 * MB, self.md5, self.etag))
+
+        # Without the part size, only the MD5 is verified
+        data, digest, head = self.download(block_size=3 * MB)
+        self.assertEqual(self.data, data)
+        self.assertEqual([], verify_download(digest, head, None, self.md5, 'unknown'))
+
+    def test_corrupted_object(self):
+        with open(self.fake_s3.object_path('bucket', 'key'), 'r+b') as f:
+            f.seek(6 * MB)
+            f.write(b'corrupted')
+        data, digest, head = self.download(part_size=5 * MB, block_size=4 * MB)
+        errors = verify_download(digest, head, 5 * MB, self.md5, self.etag)
+        self.assertEqual(4, len(errors))
+        self.assertIn('does not match the md5 metadata', errors[2])
+
+    def test_object_changed(self):
+        # The object is replaced between the HEAD request and the GETs
+        def replace_object(**kwargs):
+            self.fake_s3.objects[('bucket', 'key')].etag = 'changed'
+
+        self.s3_client.meta.events.register('after-call.s3.HeadObject', replace_object)
+        with self.assertRaises(ClientError) as context:
+            self.download(block_size=4 * MB)
+        self.assertEqual('PreconditionFailed', context.exception.response['Error']['Code'])
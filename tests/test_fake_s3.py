@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from archiver.asset import MB, calculate_digest
+from archiver.batch import Batch
+from archiver.exceptions import ConfigException
+from archiver.fake_s3 import FakeS3
+from archiver.manifests.manifest_factory import ManifestFactory
+from archiver.progress import PROGRESS_QUIET, ProgressReporter
+
+
+class CorruptingReader:
+    def __init__(self, body):
+        self.body = body
+
+    def read(self, size=None):
+        return self.body.read(size).replace(b'data', b'date')
+
+    def seek(self, offset, whence=0):
+        return self.body.seek(offset, whence)
+
+    def tell(self):
+        return self.body.tell()
+
+
+class TestFakeS3(unittest.TestCase):
+    def test_multipart_upload(self):
+        fake_s3 = FakeS3()
+        s3_client = fake_s3.client()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'data.bin')
+            with open(path, 'wb') as data_file:
+                data_file.write(os.urandom(12 * MB))
+            sent = []
+            config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+            s3_client.upload_file(path, 'bucket', 'prefix/data file.bin', Config=config, Callback=sent.append,
+                                  ExtraArgs={'Metadata': {'md5': 'abc'}, 'StorageClass': 'DEEP_ARCHIVE'})
+            expected_etag = calculate_digest(path, 5 * MB).etag
+
+        self.assertEqual(12 * MB, sum(sent))
+        response = s3_client.head_object(Bucket='bucket', Key='prefix/data file.bin')
+        self.assertEqual(f'"{expected_etag}"', response['ETag'])
+        self.assertEqual(12 * MB, response['ContentLength'])
+        self.assertEqual('DEEP_ARCHIVE', response['StorageClass'])
+        self.assertEqual({'md5': 'abc'}, response['Metadata'])
+        self.assertFalse(fake_s3.uploads)
+
+    def test_sha256_checksums(self):
+        fake_s3 = FakeS3()
+        s3_client = fake_s3.client()
+        data = b'data' * 1000
+        response = s3_client.put_object(Bucket='bucket', Key='single', Body=io.BytesIO(data),
+                                        ChecksumAlgorithm='SHA256')
+        self.assertEqual(base64.b64encode(hashlib.sha256(data).digest()).decode(), response['ChecksumSHA256'])
+        self.assertEqual(len(data), fake_s3.objects[('bucket', 'single')].size)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'data.bin')
+            with open(path, 'wb') as data_file:
+                data_file.write(os.urandom(12 * MB))
+            config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+            s3_client.upload_file(path, 'bucket', 'multipart', Config=config,
+                                  ExtraArgs={'ChecksumAlgorithm': 'SHA256'})
+            expected_etag = calculate_digest(path, 5 * MB).etag
+        response = s3_client.head_object(Bucket='bucket', Key='multipart', ChecksumMode='ENABLED')
+        self.assertEqual(f'"{expected_etag}"', response['ETag'])
+        self.assertTrue(response['ChecksumSHA256'].endswith('-3'))
+
+        # The data received does not match the checksum, every time the
+        # request is retried
+        def corrupt(request, **kwargs):
+            request.body = CorruptingReader(request.body)
+
+        s3_client.meta.events.register_first('before-send.s3.PutObject', corrupt)
+        with self.assertRaises(ClientError) as context:
+            s3_client.put_object(Bucket='bucket', Key='corrupted', Body=io.BytesIO(data),
+                                 ChecksumAlgorithm='SHA256')
+        self.assertEqual('BadDigest', context.exception.response['Error']['Code'])
+        self.assertNotIn(('bucket', 'corrupted'), fake_s3.objects)
+
+    def test_head_missing_object(self):
+        s3_client = FakeS3().client()
+        with self.assertRaises(ClientError) as context:
+            s3_client.head_object(Bucket='bucket', Key='missing')
+        self.assertEqual('404', context.exception.response['Error']['Code'])
+
+    def test_list_objects_pages(self):
+        s3_client = FakeS3().client()
+        for key in ('a/1', 'a/2', 'a/3', 'b/1'):
+            s3_client.put_object(Bucket='bucket', Key=key, Body=b'data')
+        pages = s3_client.get_paginator('list_objects_v2').paginate(Bucket='bucket', Prefix='a/',
+                                                                    PaginationConfig={'PageSize': 2})
+        keys = [[entry['Key'] for entry in page['Contents']] for page in pages]
+        self.assertEqual([['a/1', 'a/2'], ['a/3']], keys)
+
+    def test_batch_deposit(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lines = []
+            for name, size in (('small.txt', 100), ('large.bin', 6 * MB)):
+                path = os.path.join(tmp_dir, name)
+                with open(path, 'wb') as data_file:
+                    data_file.write(os.urandom(size))
+                lines.append(f'{calculate_digest(path).md5}  {path}\n')
+            manifest_filename = os.path.join(tmp_dir, 'manifest.txt')
+            with open(manifest_filename, 'w') as manifest_file:
+                manifest_file.writelines(lines)
+
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='bucket', asset_root=tmp_dir, name='test')
+            manifest.load_manifest(batch.results_filename, batch)
+            fake_s3 = FakeS3()
+            batch.deposit(profile_name=None, chunk_size='5MB', progress=ProgressReporter(PROGRESS_QUIET),
+                          s3_client=fake_s3.client(), checksum_sha256=True)
+            with open(os.path.join(tmp_dir, 'small.txt'), 'rb') as data_file:
+                small_checksum = base64.b64encode(hashlib.sha256(data_file.read()).digest()).decode()
+
+        self.assertEqual(2, batch.stats['successful_deposits'])
+        self.assertEqual(0, batch.stats['failed_deposits'])
+        self.assertEqual({('bucket', 'test/small.txt'), ('bucket', 'test/large.bin')}, set(fake_s3.objects))
+        # The uploads were sent with SHA256 checksums, which were validated
+        self.assertEqual(small_checksum, fake_s3.objects[('bucket', 'test/small.txt')].checksum_sha256)
+        self.assertTrue(fake_s3.objects[('bucket', 'test/large.bin')].checksum_sha256.endswith('-2'))
+
+    def test_stores_objects_in_directory(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = os.path.join(tmp_dir, 's3')
+            path = os.path.join(tmp_dir, 'data.bin')
+            data = os.urandom(11 * MB)
+            with open(path, 'wb') as data_file:
+                data_file.write(data)
+            s3_client = FakeS3(root).client()
+            config = TransferConfig(multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+            s3_client.upload_file(path, 'bucket', 'a/b/data.bin', Config=config)
+            s3_client.put_object(Bucket='bucket', Key='a/small.txt', Body=b'small')
+
+            fake_s3 = FakeS3(root)
+            with open(fake_s3.object_path('bucket', 'a/b/data.bin'), 'rb') as object_file:
+                self.assertEqual(data, object_file.read())
+            # The objects are found by a new instance using the same directory
+            self.assertEqual({('bucket', 'a/b/data.bin'), ('bucket', 'a/small.txt')}, set(fake_s3.objects))
+            response = fake_s3.client().head_object(Bucket='bucket', Key='a/b/data.bin')
+            self.assertEqual(f'"{calculate_digest(path, 5 * MB).etag}"', response['ETag'])
+            self.assertEqual([], os.listdir(os.path.join(root, 'uploads')))
+
+    def test_injected_errors_are_retried(self):
+        fake_s3 = FakeS3(error_rate=0.5, seed=1)
+        s3_client = fake_s3.client()
+        with patch('botocore.retryhandler.random.random', return_value=0), patch('time.sleep'):
+            for n in range(10):
+                s3_client.put_object(Bucket='bucket', Key=f'key{n}', Body=b'data')
+        self.assertEqual(10, len(fake_s3.objects))
+        self.assertGreater(fake_s3.errors_injected, 0)
+        self.assertEqual(10 + fake_s3.errors_injected, fake_s3.request_count)
+
+    def test_from_config(self):
+        fake_s3 = FakeS3.from_config(latency='0.5', bandwidth='10MB', error_rate='0.1')
+        self.assertEqual(0.5, fake_s3.latency)
+        self.assertEqual(10 * MB, fake_s3.limiter.rate)
+        self.assertEqual(0.1, fake_s3.error_rate)
+        self.assertIsNone(FakeS3.from_config().limiter)
+        with self.assertRaises(ConfigException):
+            FakeS3.from_config(error_rate=1)
+        with self.assertRaises(ConfigException):
+            FakeS3.from_config(latency=-1)
@@ -0,0 +1,82 @@
+import csv
+import hashlib
+import os
+import tempfile
+import unittest
+
+from archiver.batch import Batch
+from archiver.inventory import write_inventory, INVENTORY_FORMAT, MD5_SUM_FORMAT
+from archiver.manifests.inventory_manifest import InventoryManifest
+from archiver.manifests.manifest_factory import ManifestFactory
+from archiver.manifests.md5_sum_manifest import Md5SumManifest
+
+
+class TestInventory(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'root')
+        self.files = {
+            'a.txt': b'a',
+            'sub/b.tif': b'bb' * 10,
+            'sub/deeper/c.jpg': b'',
+        }
+        for relpath, data in self.files.items():
+            path = os.path.join(self.root, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def write_manifest(self, filename, **kwargs):
+        manifest_filename = os.path.join(self.tmp_dir.name, filename)
+        with open(manifest_filename, 'w', newline='') as output:
+            count = write_inventory(self.root, output, workers=2, **kwargs)
+        self.assertEqual(len(self.files), count)
+        return manifest_filename
+
+    def test_md5sum_format(self):
+        manifest_filename = self.write_manifest('manifest.txt', output_format=MD5_SUM_FORMAT)
+        manifest = ManifestFactory.create(manifest_filename)
+        self.assertIsInstance(manifest, Md5SumManifest)
+
+        with open(manifest_filename) as f:
+            lines = sorted(f.readlines())
+        expected = sorted(
+            f'{hashlib.md5(data).hexdigest()}  {os.path.join(self.root, relpath)}\n'
+            for relpath, data in self.files.items()
+        )
+        self.assertEqual(expected, lines)
+
+    def test_inventory_format(self):
+        manifest_filename = self.write_manifest('manifest.csv', output_format=INVENTORY_FORMAT, batch_name='TEST',
+                                                chunk_size=8)
+        manifest = ManifestFactory.create(manifest_filename)
+        self.assertIsInstance(manifest, InventoryManifest)
+
+        with open(manifest_filename) as f:
+            rows = {row['RELPATH']: row for row in csv.DictReader(f)}
+        self.assertEqual(set(self.files), set(rows))
+        row = rows['sub/b.tif']
+        data = self.files['sub/b.tif']
+        self.assertEqual('TEST', row['BATCH'])
+        self.assertEqual('TIF', row['EXTENSION'])
+        self.assertEqual(str(len(data)), row['BYTES'])
+        self.assertEqual(hashlib.md5(data).hexdigest(), row['MD5'])
+        self.assertEqual(hashlib.sha1(data).hexdigest(), row['SHA1'])
+        self.assertEqual(hashlib.sha256(data).hexdigest(), row['SHA256'])
+        self.assertTrue(row['ETAG'].endswith('-3'))
+
+        batch = Batch(manifest, bucket='test_bucket', asset_root=self.root, log_dir=self.tmp_dir.name)
+        manifest.load_manifest(batch.results_filename, batch, etag_exists=True)
+        self.assertEqual(3, batch.stats['assets_found'])
+
+    def test_parallel_digests(self):
+        manifest_filename = self.write_manifest('manifest.csv', output_format=INVENTORY_FORMAT, parallel_digests=True)
+        with open(manifest_filename) as f:
+            rows = {row['RELPATH']: row for row in csv.DictReader(f)}
+        for relpath, data in self.files.items():
+            self.assertEqual(hashlib.md5(data).hexdigest(), rows[relpath]['MD5'])
+            self.assertEqual(hashlib.sha1(data).hexdigest(), rows[relpath]['SHA1'])
+            self.assertEqual(hashlib.sha256(data).hexdigest(), rows[relpath]['SHA256'])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
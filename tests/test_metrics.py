@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from archiver.metrics import LatencyHistogram, MetricsExporter, PhaseMetrics, STATS_FIELDS
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_percentiles(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(50))
+        for ms in range(1, 101):
+            histogram.add(ms / 1000)
+        # Accurate to within a bucket
+        self.assertAlmostEqual(0.050, histogram.percentile(50), delta=0.005)
+        self.assertAlmostEqual(0.099, histogram.percentile(99), delta=0.01)
+        self.assertEqual(100, histogram.count)
+
+    def test_phase_stats(self):
+        metrics = PhaseMetrics()
+        with metrics.timed('upload', 100):
+            pass
+        metrics.record('upload', 2.0, 50)
+        stats = metrics.stats()
+        self.assertEqual(set(STATS_FIELDS), set(stats))
+        self.assertEqual(150, stats['upload_bytes'])
+        self.assertGreaterEqual(stats['upload_time'], 2.0)
+        self.assertEqual('', stats['verify_p50'])
+
+    def test_exporter_writes_textfile(self):
+        metrics = PhaseMetrics()
+        metrics.record('hash', 0.5, 1024)
+        batch = SimpleNamespace(label='batch "1"', metrics=metrics,
+                                current_stats=lambda: {'batch_name': 'batch', 'successful_deposits': 3})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'archiver.prom')
+            exporter = MetricsExporter(filename)
+            exporter.add(batch)
+            exporter.write()
+            self.assertEqual(['archiver.prom'], os.listdir(tmp_dir))
+            with open(filename) as metrics_file:
+                lines = metrics_file.read().splitlines()
+
+        self.assertIn('archiver_phase_bytes_total{batch="batch \\"1\\"",phase="hash"} 1024', lines)
+        self.assertIn('archiver_phase_seconds_count{batch="batch \\"1\\"",phase="hash"} 1', lines)
+        self.assertIn('archiver_batch_successful_deposits{batch="batch \\"1\\""} 3', lines)
+        self.assertEqual(1, lines.count('# TYPE archiver_phase_seconds summary'))
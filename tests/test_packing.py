@@ -0,0 +1,159 @@
+import csv
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from archiver.asset import Asset, GB, MB, calculate_digest
+from archiver.batch import MIN_PART_SIZE, Batch, PartSizing
+from archiver.fake_s3 import FakeS3
+from archiver.manifests.manifest_factory import ManifestFactory
+from archiver.packing import Container, Packer
+from archiver.progress import PROGRESS_QUIET, ProgressReporter
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class TestContainer(unittest.TestCase):
+    def test_tar_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            container = Container('batch/_packed/test.tar')
+            contents = {}
+            for i, size in enumerate((0, 1, 511, 512, 513, 70000)):
+                name = f'dir/{"long_" * 30 * (i % 2)}file_{i}.bin'
+                path = os.path.join(tmp_dir, f'file_{i}.bin')
+                contents[name] = os.urandom(size)
+                write_file(path, contents[name])
+                container.add(i, Asset(path), name, f'batch/{name}')
+
+            reader = container.open(5 * MB)
+            data = reader.read(1000) + reader.read()
+            self.assertEqual(container.bytes, len(data))
+            self.assertEqual(calculate_digest_of(data), reader.result().etag)
+
+            with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+                self.assertEqual(list(contents), tar.getnames())
+                for name, expected in contents.items():
+                    self.assertEqual(expected, tar.extractfile(name).read())
+            for member in container.members:
+                expected = contents[member.info.name]
+                self.assertEqual(expected, data[member.data_offset:member.data_offset + member.bytes])
+                self.assertEqual(hashlib.md5(expected).hexdigest(), member.md5)
+                self.assertIsNone(member.error)
+
+    def test_read_in_parts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            container = Container('test.tar')
+            for i in range(3):
+                path = os.path.join(tmp_dir, f'file_{i}.bin')
+                write_file(path, os.urandom(100000))
+                container.add(i, Asset(path), f'file_{i}.bin', f'batch/file_{i}.bin')
+
+            expected = container.open().read()
+            reader = container.open()
+            parts = []
+            for size in (1, 511, 70000, 1000000):
+                parts.append(reader.read(size))
+                self.assertEqual(min(size, len(expected) - len(b''.join(parts[:-1]))), len(parts[-1]))
+            self.assertEqual(b'', reader.read(10))
+            self.assertEqual(expected, b''.join(parts))
+
+    def test_container_part_size(self):
+        part_sizing = PartSizing.from_chunk_size('1GB')
+        self.assertEqual(GB, part_sizing.part_size(GB))
+        self.assertEqual(11 * MB, part_sizing.container_part_size(GB))
+        self.assertEqual(MIN_PART_SIZE, part_sizing.container_part_size(MB))
+        self.assertEqual(5 * MB, PartSizing.from_chunk_size('5MB').container_part_size(GB))
+
+    def test_file_changed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'file.bin')
+            write_file(path, b'x' * 1000)
+            container = Container('test.tar')
+            member = container.add(1, Asset(path), 'file.bin', 'batch/file.bin')
+            write_file(path, b'x' * 10)
+
+            data = container.open().read()
+            self.assertEqual(container.bytes, len(data))
+            self.assertIsNotNone(member.error)
+
+    def test_packer(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'file.bin')
+            write_file(path, b'x' * 4000)
+            asset = Asset(path)
+            large_path = os.path.join(tmp_dir, 'large.bin')
+            write_file(large_path, b'x' * 5000)
+            # Each member takes 4608 bytes, and the tar file is padded to
+            # records of 10240 bytes
+            packer = Packer(threshold=5000, target_size=30000, run_id='run')
+            self.assertTrue(packer.accepts(asset))
+            self.assertFalse(packer.accepts(Asset(large_path)))
+            self.assertIsNone(packer.add(0, asset, 'b', 'file0', 'b/file0'))
+            full = [packer.add(n, asset, 'a', f'file{n}', f'a/file{n}') for n in range(1, 7)]
+            self.assertEqual([None] * 4, full[:4])
+            container = full[4]
+            self.assertEqual('a/_packed/run-00002.tar', container.key_path)
+            self.assertEqual(5, len(container.members))
+            self.assertEqual(30720, container.bytes)
+            self.assertEqual(['a/_packed/run-00003.tar', 'b/_packed/run-00001.tar'],
+                             sorted(c.key_path for c in packer.flush()))
+            self.assertEqual([], packer.flush())
+
+
+def calculate_digest_of(data):
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        return calculate_digest(f.name, 5 * MB).etag
+
+
+class TestPackedDeposit(unittest.TestCase):
+    def test_deposit_packs_small_assets(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            asset_root = os.path.join(tmp_dir, 'files')
+            lines = []
+            contents = {}
+            for i in range(6):
+                relpath = f'sub{i % 2}/file_{i}.bin'
+                data = os.urandom(6 * MB if i == 0 else 1000 * i)
+                write_file(os.path.join(asset_root, relpath), data)
+                contents[relpath] = data
+                lines.append(f'{hashlib.md5(data).hexdigest()}  {os.path.join(asset_root, relpath)}\n')
+            manifest_filename = os.path.join(tmp_dir, 'manifest.txt')
+            with open(manifest_filename, 'w') as f:
+                f.writelines(lines)
+
+            manifest = ManifestFactory.create(manifest_filename)
+            batch = Batch(manifest, bucket='bucket', asset_root=asset_root, name='batch', log_dir='logs')
+            manifest.load_manifest(batch.results_filename, batch)
+            fake_s3 = FakeS3(os.path.join(tmp_dir, 's3'))
+            batch.deposit(profile_name=None, chunk_size='5MB', max_assets=2, progress=ProgressReporter(PROGRESS_QUIET),
+                          s3_client=fake_s3.client(), pack_threshold='1MB', pack_size='1MB')
+
+            self.assertEqual(6, batch.stats['successful_deposits'])
+            self.assertEqual(0, batch.stats['failed_deposits'])
+            containers = [key for _, key in fake_s3.objects if '/_packed/' in key]
+            self.assertEqual(1, len(containers))
+            self.assertIn(('bucket', 'batch/sub0/file_0.bin'), fake_s3.objects)
+
+            with open(batch.results_filename) as results_file:
+                rows = {row['KEYPATH']: row for row in csv.DictReader(results_file)}
+            self.assertEqual(6, len(rows))
+            self.assertEqual('', rows['batch/sub0/file_0.bin']['CONTAINER'])
+            for relpath, data in contents.items():
+                row = rows[f'batch/{relpath}']
+                self.assertEqual('success', row['RESULT'])
+                if row['CONTAINER']:
+                    self.assertEqual(f'bucket/{row["CONTAINER"]}', row['STORAGELOCATION'])
+                    self.assertEqual(str(len(data)), row['LENGTH'])
+                    self.assertEqual(hashlib.md5(data).hexdigest(), row['MEMBERMD5'])
+                    with open(fake_s3.object_path('bucket', row['CONTAINER']), 'rb') as container_file:
+                        container_file.seek(int(row['OFFSET']))
+                        self.assertEqual(data, container_file.read(int(row['LENGTH'])))
@@ -0,0 +1,70 @@
+import io
+import json
+import threading
+import unittest
+from types import SimpleNamespace
+
+from archiver.progress import (
+    COUNTER_STRIPES, ProgressReporter, ShardedCounter, UploadCallback, format_bytes, format_duration
+)
+
+
+class TestProgress(unittest.TestCase):
+    def test_sharded_counter_sums_threads(self):
+        counter = ShardedCounter()
+        threads = [threading.Thread(target=lambda: [counter.add(1) for _ in range(1000)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8000, counter.value)
+
+    def test_sharded_counter_does_not_grow_with_threads(self):
+        counter = ShardedCounter()
+        for _ in range(100):
+            thread = threading.Thread(target=counter.add, args=(1,))
+            thread.start()
+            thread.join()
+        self.assertEqual(100, counter.value)
+        self.assertEqual(COUNTER_STRIPES, len(counter._stripes))
+
+    def test_upload_callback_consumes_limiters(self):
+        consumed = []
+        limiter = SimpleNamespace(consume=consumed.append)
+        counter = ShardedCounter()
+        callback = UploadCallback(counter, (limiter,))
+        callback(100)
+        callback(50)
+        self.assertEqual([100, 50], consumed)
+        self.assertEqual(150, counter.value)
+
+    def test_snapshot(self):
+        reporter = ProgressReporter('quiet')
+        reporter.add_expected(3, 300)
+        counter = reporter.counter()
+        first, second = SimpleNamespace(bytes=100), SimpleNamespace(bytes=200)
+
+        with reporter.uploading(first):
+            counter.add(100)
+        reporter.asset_done(first)
+        with reporter.uploading(second):
+            counter.add(50)
+            progress = reporter.snapshot()
+            self.assertEqual(1, progress['assets_in_flight'])
+
+        self.assertEqual(150, progress['bytes_sent'])
+        self.assertEqual(1, progress['assets_completed'])
+        self.assertEqual(3, progress['assets_total'])
+        self.assertEqual(150, progress['bytes_remaining'])
+
+    def test_json_report(self):
+        stream = io.StringIO()
+        reporter = ProgressReporter('json', stream=stream)
+        reporter.counter().add(10)
+        reporter.report()
+        self.assertEqual(10, json.loads(stream.getvalue())['bytes_sent'])
+
+    def test_formatting(self):
+        self.assertEqual('512B', format_bytes(512))
+        self.assertEqual('1.5MB', format_bytes(1536 * 1024))
+        self.assertEqual('1:01:05', format_duration(3665))
@@ -0,0 +1,180 @@
+import argparse
+import csv
+import hashlib
+import os
+import tempfile
+import unittest
+
+from archiver.asset import MB
+from archiver.batch import Batch
+from archiver.exceptions import ConfigException, FailureException
+from archiver.fake_s3 import FakeS3
+from archiver.manifests.manifest_factory import ManifestFactory
+from archiver.progress import PROGRESS_QUIET, ProgressReporter
+from archiver.restore import (
+    RESTORE_REQUESTED, RETRIEVE_FAILED, RETRIEVE_NOT_RESTORED, RETRIEVE_SKIPPED, RETRIEVED, STATUS_ARCHIVED,
+    STATUS_AVAILABLE, STATUS_MISSING, STATUS_RESTORED, STATUS_RESTORING, destination_path, load_items, poll_restores,
+    request_restores, restore, retrieve, retrieve_items, unique_locations
+)
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def deposit_files(tmp_dir, storage_class='DEEP_ARCHIVE'):
+    """
+    Deposit a few files to a FakeS3 stored in tmp_dir/s3, packing the small
+    ones. Returns the results filename and the contents of the files, by
+    KEYPATH.
+    """
+    asset_root = os.path.join(tmp_dir, 'files')
+    lines = []
+    contents = {}
+    for i in range(5):
+        relpath = f'sub{i % 2}/file_{i}.bin'
+        data = os.urandom(9 * MB if i == 0 else 1000 * i)
+        write_file(os.path.join(asset_root, relpath), data)
+        contents[f'batch/{relpath}'] = data
+        lines.append(f'{hashlib.md5(data).hexdigest()}  {os.path.join(asset_root, relpath)}\n')
+    manifest_filename = os.path.join(tmp_dir, 'manifest.txt')
+    with open(manifest_filename, 'w') as f:
+        f.writelines(lines)
+
+    manifest = ManifestFactory.create(manifest_filename)
+    batch = Batch(manifest, bucket='bucket', asset_root=asset_root, name='batch',
+                  log_dir=os.path.join(tmp_dir, 'logs'))
+    manifest.load_manifest(batch.results_filename, batch)
+    batch.deposit(profile_name=None, chunk_size='5MB', storage_class=storage_class,
+                  progress=ProgressReporter(PROGRESS_QUIET), s3_client=FakeS3(os.path.join(tmp_dir, 's3')).client(),
+                  pack_threshold='1MB')
+    return batch.results_filename, contents
+
+
+class TestLoadItems(unittest.TestCase):
+    def test_results_rows(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_filename = os.path.join(tmp_dir, 'results.csv')
+            with open(results_filename, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['ID', 'MD5', 'KEYPATH', 'ETAG', 'RESULT', 'STORAGELOCATION', 'CONTAINER', 'OFFSET',
+                                 'LENGTH', 'MEMBERMD5'])
+                writer.writerow([1, 'aaa', 'b/1.tif', 'e1', 'failed', 'bucket/b/1.tif', '', '', '', ''])
+                writer.writerow([2, 'bbb', 'b/2.txt', '', 'success', 'bucket/b/_packed/r-00001.tar',
+                                 'b/_packed/r-00001.tar', 1536, 10, 'ccc'])
+                writer.writerow([3, 'ddd', 'b/3.txt', '', 'success', 'bucket/b/_packed/r-00001.tar',
+                                 'b/_packed/r-00001.tar', 2560, 20, 'ddd'])
+                writer.writerow([1, 'aaa', 'b/1.tif', 'e2', 'success', 'bucket/b/1.tif', '', '', '', ''])
+
+            items = load_items([results_filename])
+            self.assertEqual(['b/2.txt', 'b/3.txt', 'b/1.tif'], [item.key_path for item in items])
+            self.assertEqual([('bucket', 'b/_packed/r-00001.tar'), ('bucket', 'b/1.tif')], unique_locations(items))
+            packed, _, whole = items
+            self.assertTrue(packed.packed)
+            self.assertEqual((1536, 10, 'ccc'), (packed.offset, packed.length, packed.md5))
+            self.assertFalse(whole.packed)
+            self.assertEqual(('aaa', 'e2'), (whole.md5, whole.etag))
+
+            self.assertEqual(['b/1.tif'], [item.key_path for item in load_items([results_filename], ['*.tif'])])
+
+    def test_not_results_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'manifest.csv')
+            with open(filename, 'w') as f:
+                f.write('md5,path\n')
+            with self.assertRaises(ConfigException):
+                load_items([filename])
+            with self.assertRaises(ConfigException):
+                load_items([os.path.join(tmp_dir, 'missing.csv')])
+
+    def test_destination_path(self):
+        self.assertEqual(os.path.join('out', 'a', 'b.txt'), destination_path('out', '/a//b.txt'))
+        with self.assertRaises(ConfigException):
+            destination_path('out', 'a/../../b.txt')
+
+
+class TestRestore(unittest.TestCase):
+    def test_restore_and_retrieve(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_filename, contents = deposit_files(tmp_dir)
+            items = load_items([results_filename])
+            self.assertEqual(set(contents), {item.key_path for item in items})
+            locations = unique_locations(items)
+            # The large file, and the container of the small files
+            self.assertEqual(2, len(locations))
+
+            fake_s3 = FakeS3(os.path.join(tmp_dir, 's3'), restore_time=3600)
+            s3_client = fake_s3.client()
+            output_dir = os.path.join(tmp_dir, 'output')
+            self.assertEqual({RETRIEVE_NOT_RESTORED}, set(retrieve_items(s3_client, items, output_dir, 4).values()))
+            self.assertEqual({STATUS_ARCHIVED}, set(poll_restores(s3_client, locations, 4).values()))
+
+            outcomes = request_restores(s3_client, locations, days=7, tier='Bulk', rate=1000, threads=4)
+            self.assertEqual({RESTORE_REQUESTED}, set(outcomes.values()))
+            self.assertEqual({STATUS_RESTORING}, set(poll_restores(s3_client, locations, 4).values()))
+            outcomes = request_restores(s3_client, locations, days=7, tier='Bulk', rate=1000, threads=4)
+            self.assertEqual({STATUS_RESTORING}, set(outcomes.values()))
+
+            # Restores completed in an instant, as seen by a new FakeS3 using
+            # the same directory
+            fake_s3 = FakeS3(os.path.join(tmp_dir, 's3'))
+            for stored in fake_s3.objects.values():
+                stored.restore_ready = 0
+            s3_client = fake_s3.client()
+            self.assertEqual({STATUS_RESTORED}, set(poll_restores(s3_client, locations, 4).values()))
+            self.assertEqual({STATUS_RESTORED}, set(
+                request_restores(s3_client, locations, days=7, tier='Bulk', rate=1000, threads=4).values()
+            ))
+
+            outcomes = retrieve_items(s3_client, items, output_dir, 4)
+            self.assertEqual({RETRIEVED}, set(outcomes.values()))
+            for key_path, data in contents.items():
+                with open(os.path.join(output_dir, key_path), 'rb') as f:
+                    self.assertEqual(data, f.read())
+            self.assertEqual({RETRIEVE_SKIPPED}, set(retrieve_items(s3_client, items, output_dir, 4).values()))
+
+            # Corrupted objects are not retrieved
+            for location in locations:
+                with open(fake_s3.object_path(*location), 'r+b') as f:
+                    f.seek(5000)
+                    f.write(b'corrupted')
+            outcomes = retrieve_items(s3_client, items, output_dir, 4, overwrite=True)
+            self.assertEqual({RETRIEVE_FAILED}, set(outcomes.values()) - {RETRIEVED})
+            self.assertEqual(RETRIEVE_FAILED, outcomes['batch/sub0/file_0.bin'])
+            self.assertFalse(os.path.exists(os.path.join(output_dir, 'batch/sub0/file_0.bin.part')))
+
+    def test_not_archived(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_filename, contents = deposit_files(tmp_dir, storage_class='STANDARD')
+            locations = unique_locations(load_items([results_filename]))
+            s3_client = FakeS3(os.path.join(tmp_dir, 's3')).client()
+            missing = ('bucket', 'missing')
+            outcomes = request_restores(s3_client, locations + [missing], days=7, tier='Bulk', rate=None, threads=4)
+            self.assertEqual(STATUS_MISSING, outcomes.pop(missing))
+            self.assertEqual({STATUS_AVAILABLE}, set(outcomes.values()))
+            statuses = poll_restores(s3_client, locations + [missing], 4)
+            self.assertEqual(STATUS_MISSING, statuses.pop(missing))
+            self.assertEqual({STATUS_AVAILABLE}, set(statuses.values()))
+
+    def test_dry_run_subcommands(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_filename, contents = deposit_files(tmp_dir)
+            output_dir = os.path.join(tmp_dir, 'output')
+            args = argparse.Namespace(
+                results=[results_filename], include=['batch/sub1/*', '*/file_0.bin'], profile=None, days=7,
+                tier='Bulk', rate=100, threads=2, status=False, wait=True, poll_interval=0, output=output_dir,
+                overwrite=False, part_threads=4, block_size='1MB', dry_run=True,
+                dry_run_dir=os.path.join(tmp_dir, 's3'), dry_run_latency=None, dry_run_bandwidth=None,
+                dry_run_error_rate=None
+            )
+            with self.assertRaises(FailureException):
+                retrieve(args)
+            restore(args)
+            retrieve(args)
+            batch_dir = os.path.join(output_dir, 'batch')
+            self.assertEqual(['file_1.bin', 'file_3.bin'], sorted(os.listdir(os.path.join(batch_dir, 'sub1'))))
+            self.assertEqual(['file_0.bin'], os.listdir(os.path.join(batch_dir, 'sub0')))
+            with open(os.path.join(output_dir, 'batch', 'sub0', 'file_0.bin'), 'rb') as f:
+                self.assertEqual(contents['batch/sub0/file_0.bin'], f.read())
@@ -0,0 +1,55 @@
+import csv
+import os
+import tempfile
+import unittest
+
+from archiver.results import ResultsIndex
+
+
+class TestResultsIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.results_filename = os.path.join(self.tmp_dir.name, 'results.csv')
+
+    def append_results(self, rows, fieldnames=('ID', 'MD5', 'PATH', 'RESULT')):
+        exists = os.path.exists(self.results_filename)
+        with open(self.results_filename, 'a') as results_file:
+            writer = csv.DictWriter(results_file, fieldnames=fieldnames)
+            if not exists:
+                writer.writeheader()
+            writer.writerows(rows)
+
+    def test_index_is_built_from_results_file(self):
+        self.append_results([{'ID': 1, 'MD5': 'md5_1', 'PATH': '/a', 'RESULT': 'success'}])
+        with ResultsIndex(self.results_filename) as index:
+            self.assertIn(('md5_1', '/a'), index)
+            self.assertNotIn(('md5_2', '/a'), index)
+
+    def test_added_assets_are_kept_without_rebuilding(self):
+        self.append_results([{'ID': 1, 'MD5': 'md5_1', 'PATH': '/a', 'RESULT': 'success'}])
+        index = ResultsIndex(self.results_filename)
+        self.append_results([{'ID': 2, 'MD5': 'md5_2', 'PATH': '/b', 'RESULT': 'success'}])
+        index.add('md5_2', '/b')
+        index.close()
+
+        with ResultsIndex(self.results_filename) as index:
+            self.assertIn(('md5_1', '/a'), index)
+            self.assertIn(('md5_2', '/b'), index)
+
+    def test_index_is_rebuilt_when_results_file_changes(self):
+        self.append_results([{'ID': 1, 'MD5': 'md5_1', 'PATH': '/a', 'RESULT': 'success'}])
+        ResultsIndex(self.results_filename).close()
+        # Results written without updating the index
+        self.append_results([{'ID': 2, 'MD5': 'md5_2', 'PATH': '/b', 'RESULT': 'success'}])
+
+        with ResultsIndex(self.results_filename) as index:
+            self.assertIn(('md5_1', '/a'), index)
+            self.assertIn(('md5_2', '/b'), index)
+
+    def test_patsy_results_columns(self):
+        self.append_results([{'md5': 'md5_1', 'filepath': '/a'}], fieldnames=('md5', 'filepath'))
+        with ResultsIndex(self.results_filename) as index:
+            self.assertIn(('md5_1', '/a'), index)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+from archiver.tracing import RequestTracer
+
+
+class RawResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def respond(responses):
+    """
+    Returns a before-send handler that answers requests with the given (status,
+    body) pairs, in order, instead of sending them.
+    """
+    def handler(request, **kwargs):
+        status, body = responses.pop(0)
+        return AWSResponse(request.url, status, {'ETag': '"abc123"'}, RawResponse(body))
+    return handler
+
+
+class TestRequestTracer(unittest.TestCase):
+    def test_traces_retries_and_throttles(self):
+        s3_client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test',
+                                 aws_secret_access_key='test')
+        slow_down = b'<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>'
+        responses = [(503, slow_down), (200, b''), (200, b''), (200, b'')]
+        s3_client.meta.events.register('before-send.s3', respond(responses))
+
+        tracer = RequestTracer()
+        tracer.register(s3_client)
+        with patch('botocore.endpoint.time.sleep'):
+            s3_client.put_object(Bucket='bucket', Key='key', Body=b'data')
+            s3_client.head_object(Bucket='bucket', Key='key')
+        # Requests after unregistering are not traced
+        tracer.unregister(s3_client)
+        s3_client.head_object(Bucket='bucket', Key='key')
+
+        summary = tracer.summary()
+        self.assertEqual(['HeadObject', 'PutObject'], list(summary))
+        self.assertEqual(1, summary['PutObject']['calls'])
+        self.assertEqual(1, summary['PutObject']['retries'])
+        self.assertEqual(1, summary['PutObject']['throttles'])
+        self.assertEqual({'503': 1, '200': 1}, summary['PutObject']['status_codes'])
+        self.assertEqual(1, summary['HeadObject']['calls'])
+        self.assertEqual(0, summary['HeadObject']['throttles'])
+        self.assertIsNotNone(summary['HeadObject']['latency']['p50'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'requests.json')
+            tracer.write(filename)
+            with open(filename) as trace_file:
+                lines = [json.loads(line) for line in trace_file]
+        self.assertEqual(['HeadObject', 'PutObject'], [line['operation'] for line in lines])
+
+    def test_tracers_sharing_a_client(self):
+        s3_client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test',
+                                 aws_secret_access_key='test')
+        s3_client.meta.events.register('before-send.s3', respond([(200, b'')] * 3))
+
+        first = RequestTracer(accepts=lambda bucket, key: key.startswith('first/'))
+        second = RequestTracer(accepts=lambda bucket, key: key.startswith('second/'))
+        first.register(s3_client)
+        second.register(s3_client)
+        s3_client.head_object(Bucket='bucket', Key='first/key')
+        s3_client.put_object(Bucket='bucket', Key='second/key', Body=b'data')
+        # The other tracer keeps tracing once one is unregistered
+        first.unregister(s3_client)
+        s3_client.head_object(Bucket='bucket', Key='second/key')
+
+        self.assertEqual({'HeadObject': 1}, {name: op['calls'] for name, op in first.summary().items()})
+        self.assertEqual({'HeadObject': 1, 'PutObject': 1},
+                         {name: op['calls'] for name, op in second.summary().items()})
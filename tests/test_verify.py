@@ -0,0 +1,42 @@
+import unittest
+from unittest.mock import patch
+
+import boto3
+from botocore.stub import ANY, Stubber
+
+from archiver.verify import (
+    UploadResponseCapture, needs_head_request, VERIFY_HEAD, VERIFY_RESPONSE, VERIFY_SAMPLE
+)
+
+
+def create_client():
+    return boto3.client(
+        's3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test'
+    )
+
+
+class TestVerify(unittest.TestCase):
+    def test_captures_upload_response(self):
+        s3_client = create_client()
+        capture = UploadResponseCapture.for_client(s3_client)
+        self.assertIs(capture, UploadResponseCapture.for_client(s3_client))
+
+        with Stubber(s3_client) as stubber:
+            stubber.add_response(
+                'put_object', {'ETag': '"abc123"'}, {'Bucket': 'bucket', 'Key': 'a/b.txt', 'Body': ANY}
+            )
+            stubber.add_response('head_object', {'ETag': '"abc123"'}, {'Bucket': 'bucket', 'Key': 'a/b.txt'})
+            s3_client.put_object(Bucket='bucket', Key='a/b.txt', Body=b'data')
+            s3_client.head_object(Bucket='bucket', Key='a/b.txt')
+
+        self.assertEqual('"abc123"', capture.pop('bucket', 'a/b.txt')['ETag'])
+        self.assertIsNone(capture.pop('bucket', 'a/b.txt'))
+
+    def test_needs_head_request(self):
+        response = {'ETag': '"abc123"'}
+        self.assertTrue(needs_head_request(VERIFY_RESPONSE, 0.05, None))
+        self.assertFalse(needs_head_request(VERIFY_RESPONSE, 0.05, response))
+        self.assertTrue(needs_head_request(VERIFY_HEAD, 0.05, response))
+        with patch('archiver.verify.random.random', return_value=0.5):
+            self.assertFalse(needs_head_request(VERIFY_SAMPLE, 0.05, response))
+            self.assertTrue(needs_head_request(VERIFY_SAMPLE, 0.75, response))